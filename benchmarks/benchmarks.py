@@ -0,0 +1,221 @@
+"""
+Scale benchmarks of the populate and harvest entry points, for `asv`_.
+
+The corpus is generated once per scale by :mod:`benchmarks.corpus` under
+``CFDB_BENCH_CORPUS`` (``~/.cache/cfdb-bench`` by default). The scales are read
+from ``CFDB_BENCH_SCALES`` (``10k`` by default, e.g. ``10k,100k,1M``). Every entry
+point is tracked for its time (``time_*``), peak memory (``peakmem_*``) and, for
+the database updates, number of SQL statements (``track_*``). The start-up time
+of the CLI is tracked in a fresh interpreter (``timeraw_*``)::
+
+    CFDB_BENCH_SCALES=10k,100k asv run
+    asv compare HEAD~1 HEAD
+
+.. _asv: https://asv.readthedocs.io
+"""
+
+import os
+import tempfile
+from pathlib import Path
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from benchmarks.corpus import SCALES, generate
+from cfdb.harvest.harvester import harvest_bytes
+from cfdb.models.schema import Base
+from cfdb.populate import artifacts, feedstock_outputs, import_to_package_maps
+from cfdb.populate.utils import traverse_files
+
+CORPUS_ROOT = Path(
+    os.environ.get("CFDB_BENCH_CORPUS", Path.home() / ".cache" / "cfdb-bench")
+)
+BENCH_SCALES = os.environ.get("CFDB_BENCH_SCALES", "10k").split(",")
+
+
+def corpus(scale: str) -> Path:
+    return generate(CORPUS_ROOT / scale, SCALES[scale])
+
+
+class _Database:
+    """A fresh SQLite database per sample, counting the SQL statements."""
+
+    def setup_database(self):
+        self._tmp = tempfile.TemporaryDirectory(prefix="cfdb-bench-")
+        self.engine = create_engine(f"sqlite:///{self._tmp.name}/cfdb.db")
+        Base.metadata.create_all(self.engine)
+        self.statements = 0
+
+        def count(*args):
+            self.statements += 1
+
+        event.listen(self.engine, "before_cursor_execute", count)
+        self.session = sessionmaker(bind=self.engine)()
+
+    def teardown(self, *args):
+        self.session.close()
+        self.engine.dispose()
+        self._tmp.cleanup()
+
+
+class TraverseFiles:
+    params = BENCH_SCALES
+    param_names = ["scale"]
+    timeout = 3600
+
+    def setup(self, scale):
+        self.outputs = corpus(scale) / "outputs"
+        self._tmp = tempfile.TemporaryDirectory(prefix="cfdb-bench-")
+
+    def teardown(self, scale):
+        self._tmp.cleanup()
+
+    def time_traverse_files(self, scale):
+        traverse_files(self.outputs, Path(self._tmp.name))
+
+    def peakmem_traverse_files(self, scale):
+        traverse_files(self.outputs, Path(self._tmp.name))
+
+
+class CompareArtifacts:
+    params = BENCH_SCALES
+    param_names = ["scale"]
+    timeout = 3600
+
+    def setup(self, scale):
+        self.root = corpus(scale) / "artifacts"
+        self._tmp = tempfile.TemporaryDirectory(prefix="cfdb-bench-")
+        self.stored_files = traverse_files(
+            self.root,
+            Path(self._tmp.name),
+            process_function=artifacts._process_artifact_batches,
+        )
+        # half of the artifacts are already in the database
+        self.rows = []
+        with open(self.stored_files[0]) as f:
+            for i, line in enumerate(f):
+                if i % 2:
+                    path, package, platform, version, build = line.strip().split(",")
+                    name = Path(path).relative_to(self.root / package / "conda-forge")
+                    self.rows.append(
+                        (name.with_suffix("").as_posix(), package, platform, version, build)
+                    )
+
+    def teardown(self, scale):
+        self._tmp.cleanup()
+
+    def time_compare_files(self, scale):
+        artifacts._compare_files(self.rows, self.stored_files, root_dir=self.root)
+
+    def peakmem_compare_files(self, scale):
+        artifacts._compare_files(self.rows, self.stored_files, root_dir=self.root)
+
+
+class UpdateFeedstockOutputs(_Database):
+    params = BENCH_SCALES
+    param_names = ["scale"]
+    number = 1
+    timeout = 3600
+
+    def setup(self, scale):
+        self.path = corpus(scale) / "outputs"
+        self.setup_database()
+
+    def time_update(self, scale):
+        feedstock_outputs.update(self.session, self.path)
+
+    def peakmem_update(self, scale):
+        feedstock_outputs.update(self.session, self.path)
+
+    def track_sql_statements(self, scale):
+        feedstock_outputs.update(self.session, self.path)
+        return self.statements
+
+    track_sql_statements.unit = "statements"
+
+
+class UpdateImportMaps(_Database):
+    params = BENCH_SCALES
+    param_names = ["scale"]
+    number = 1
+    timeout = 3600
+
+    def setup(self, scale):
+        self.path = corpus(scale) / "import_to_pkg_maps"
+        self.setup_database()
+
+    def time_update(self, scale):
+        import_to_package_maps.update(self.session, self.path)
+
+    def peakmem_update(self, scale):
+        import_to_package_maps.update(self.session, self.path)
+
+    def track_sql_statements(self, scale):
+        import_to_package_maps.update(self.session, self.path)
+        return self.statements
+
+    track_sql_statements.unit = "statements"
+
+
+class UpdateArtifacts(_Database):
+    params = BENCH_SCALES
+    param_names = ["scale"]
+    number = 1
+    timeout = 7200
+
+    def setup(self, scale):
+        self.path = corpus(scale) / "artifacts"
+        self.setup_database()
+
+    def time_update(self, scale):
+        artifacts.update(self.session, self.path)
+
+    def peakmem_update(self, scale):
+        artifacts.update(self.session, self.path)
+
+    def track_sql_statements(self, scale):
+        artifacts.update(self.session, self.path)
+        return self.statements
+
+    track_sql_statements.unit = "statements"
+
+
+class HarvestArchives:
+    params = BENCH_SCALES
+    param_names = ["scale"]
+    timeout = 3600
+
+    def setup(self, scale):
+        self.archives = [
+            (path.name, path.read_bytes())
+            for path in sorted((corpus(scale) / "archives").rglob("*"))
+            if path.is_file()
+        ]
+
+    def time_harvest(self, scale):
+        for filename, content in self.archives:
+            harvest_bytes(content, filename)
+
+    def peakmem_harvest(self, scale):
+        for filename, content in self.archives:
+            harvest_bytes(content, filename)
+
+
+class Startup:
+    """
+    Start-up time of the CLI, in a fresh interpreter (``cfdb --help`` should stay
+    under 200 ms).
+    """
+
+    def timeraw_import_main(self):
+        return "import cfdb.main"
+
+    def timeraw_help(self):
+        return """
+from cfdb.main import app
+
+try:
+    app(["--help"])
+except SystemExit:
+    pass
+"""
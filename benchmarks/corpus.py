@@ -0,0 +1,210 @@
+"""
+Deterministic synthetic corpus for the benchmarks.
+
+Generates, for a given number of items and seed, the same trees as the inputs of
+the populate and harvest entry points:
+
+- a feedstock-outputs tree (``outputs/n/u/m/numpy.json``),
+- import_to_pkg_maps partitions (``<prefix>.<partition>.json``),
+- artifact JSON blobs (``<package>/conda-forge/<subdir>/<artifact>.json``),
+- fake ``.tar.bz2`` and ``.conda`` archives holding the usual ``info/`` members.
+
+Usage::
+
+    python -m benchmarks.corpus --scale 100k --out /tmp/cfdb-corpus
+"""
+
+import argparse
+import bz2
+import io
+import json
+import random
+import tarfile
+import zipfile
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+SCALES = {"1k": 1_000, "10k": 10_000, "100k": 100_000, "1M": 1_000_000}
+
+SUBDIRS = ("linux-64", "osx-64", "win-64", "noarch", "osx-arm64", "linux-aarch64")
+
+_SYLLABLES = (
+    "py", "lib", "num", "sci", "data", "net", "x", "zlib", "ssl", "arrow", "geo",
+    "ml", "io", "cuda", "tk", "qt", "boost", "json", "yaml", "http", "core", "utils",
+)
+
+
+def package_names(count: int, seed: int = 0) -> List[str]:
+    """``count`` distinct, deterministic package names."""
+    rng = random.Random(seed)
+    names = []
+    for i in range(count):
+        stem = "-".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(1, 3)))
+        names.append(f"{stem}-{i}")
+    return names
+
+
+def iter_artifacts(count: int, seed: int = 0) -> Iterator[Tuple[str, str, str, dict]]:
+    """
+    Yields ``count`` artifacts as ``(package, subdir, artifact stem, record)``, with
+    about ten artifacts per package.
+    """
+    rng = random.Random(seed)
+    packages = package_names(max(count // 10, 1), seed)
+    for i in range(count):
+        package = packages[i % len(packages)]
+        subdir = SUBDIRS[rng.randrange(len(SUBDIRS))]
+        version = f"{rng.randint(0, 5)}.{rng.randint(0, 30)}.{i // len(packages)}"
+        build_number = rng.randint(0, 3)
+        stem = f"{package}-{version}-h{i:08x}_{build_number}"
+        files = [
+            f"lib/python3.11/site-packages/{package.replace('-', '_')}/module{j}.py"
+            for j in range(rng.randint(1, 20))
+        ]
+        record = {
+            "name": package,
+            "version": version,
+            "index": {
+                "name": package,
+                "version": version,
+                "build": f"h{i:08x}_{build_number}",
+                "build_number": build_number,
+                "subdir": subdir,
+                "depends": ["python >=3.8"] + [
+                    rng.choice(packages) for _ in range(rng.randint(0, 3))
+                ],
+            },
+            "about": {"license": "BSD-3-Clause"},
+            "files": files,
+        }
+        yield package, subdir, stem, record
+
+
+def generate_feedstock_outputs(root: Path, count: int, seed: int = 0) -> Path:
+    """Writes ``count`` feedstock outputs under ``root/outputs``."""
+    outputs = Path(root) / "outputs"
+    for name in package_names(count, seed):
+        path = outputs.joinpath(*name[:3].ljust(3, "_")) / f"{name}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps({"feedstocks": [f"{name}-feedstock"]}))
+    return outputs
+
+
+def generate_import_maps(
+    root: Path, count: int, seed: int = 0, partition_size: int = 1000
+) -> Path:
+    """Writes ``count`` imports under ``root/import_to_pkg_maps``, in partitions."""
+    rng = random.Random(seed)
+    directory = Path(root) / "import_to_pkg_maps"
+    directory.mkdir(parents=True, exist_ok=True)
+    packages = package_names(max(count // 2, 1), seed)
+    for partition, start in enumerate(range(0, count, partition_size)):
+        payload = {
+            f"mod{i}": {"elements": rng.sample(packages, min(len(packages), 2))}
+            for i in range(start, min(start + partition_size, count))
+        }
+        (directory / f"import_to_pkg_maps.{partition:04d}.json").write_text(
+            json.dumps(payload)
+        )
+    return directory
+
+
+def generate_artifacts(root: Path, count: int, seed: int = 0) -> Path:
+    """Writes ``count`` harvested artifacts as JSON blobs under ``root/artifacts``."""
+    artifacts = Path(root) / "artifacts"
+    for package, subdir, stem, record in iter_artifacts(count, seed):
+        path = artifacts / package / "conda-forge" / subdir / f"{stem}.json"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(record))
+    return artifacts
+
+
+def _info_members(record: dict) -> List[Tuple[str, bytes]]:
+    return [
+        ("info/index.json", json.dumps(record["index"]).encode()),
+        ("info/files", "\n".join(record["files"]).encode() + b"\n"),
+        ("info/about.json", json.dumps(record["about"]).encode()),
+        (
+            "info/recipe/meta.yaml",
+            f"package:\n  name: {record['name']}\n  version: '{record['version']}'\n".encode(),
+        ),
+    ]
+
+
+def _tar(members: List[Tuple[str, bytes]]) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as tf:
+        for name, content in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tf.addfile(info, io.BytesIO(content))
+    return buffer.getvalue()
+
+
+def make_archive(record: dict, conda_format: bool, payload_size: int = 4096) -> bytes:
+    """A fake package archive whose payload holds the files of ``record``."""
+    payload = [(name, b"x" * payload_size) for name in record["files"]]
+    if not conda_format:
+        return bz2.compress(_tar(_info_members(record) + payload))
+
+    import zstandard
+
+    compressor = zstandard.ZstdCompressor()
+    stem = f"{record['name']}-{record['version']}-{record['index']['build']}"
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as zf:
+        zf.writestr("metadata.json", json.dumps({"conda_pkg_format_version": 2}))
+        zf.writestr(f"info-{stem}.tar.zst", compressor.compress(_tar(_info_members(record))))
+        zf.writestr(f"pkg-{stem}.tar.zst", compressor.compress(_tar(payload)))
+    return buffer.getvalue()
+
+
+def generate_archives(root: Path, count: int, seed: int = 0) -> Path:
+    """Writes ``count`` fake archives under ``root/archives``, half of them ``.conda``."""
+    archives = Path(root) / "archives"
+    for i, (_, subdir, stem, record) in enumerate(iter_artifacts(count, seed)):
+        conda_format = i % 2 == 0
+        path = archives / subdir / (stem + (".conda" if conda_format else ".tar.bz2"))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(make_archive(record, conda_format))
+    return archives
+
+
+def generate(root: Path, count: int, seed: int = 0, archives: int = None) -> Path:
+    """
+    Writes the whole corpus under ``root``, unless it was already generated with
+    the same parameters.
+
+    Args:
+        root (Path): Directory of the corpus.
+        count (int): Number of feedstock outputs, imports and artifacts.
+        seed (int): Seed of the generator.
+        archives (int): Number of archives, ``count // 100`` by default.
+    """
+    root = Path(root)
+    archives = count // 100 if archives is None else archives
+    marker = root / "corpus.json"
+    params = {"count": count, "seed": seed, "archives": archives}
+    if marker.is_file() and json.loads(marker.read_text()) == params:
+        return root
+
+    generate_feedstock_outputs(root, count, seed)
+    generate_import_maps(root, count, seed)
+    generate_artifacts(root, count, seed)
+    generate_archives(root, archives, seed)
+    marker.write_text(json.dumps(params))
+    return root
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--scale", choices=SCALES, default="10k")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--archives", type=int, default=None)
+    parser.add_argument("--out", type=Path, required=True)
+    args = parser.parse_args(argv)
+    generate(args.out, SCALES[args.scale], seed=args.seed, archives=args.archives)
+
+
+if __name__ == "__main__":
+    main()
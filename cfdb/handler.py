@@ -1,12 +1,26 @@
 import os
+from contextlib import contextmanager
 from pathlib import Path
 
 from sqlalchemy import create_engine
 from sqlalchemy.engine.url import URL
 from sqlalchemy.orm import sessionmaker
 
-from cfdb.models.schema import Base
-from cfdb.populate import artifacts, feedstock_outputs, import_to_package_maps
+from cfdb import metrics, sqlstats
+from cfdb.models.schema import Base, RunHistory
+from cfdb.populate import (
+    artifacts,
+    bootstrap,
+    dependencies,
+    feedstock_outputs,
+    file_paths,
+    import_to_package_maps,
+    latest,
+    reconcile,
+)
+from cfdb.populate.checkpoint import default_checkpoint_dir
+from cfdb.populate.packages import PackageRegistry
+from cfdb.populate.utils import WalkCache
 
 
 class CFDBHandler:
@@ -20,10 +34,22 @@ class CFDBHandler:
         db_url (str): The URL of the database.
         engine (Engine): SQLAlchemy Engine object.
         Session (sessionmaker): SQLAlchemy sessionmaker object.
+        packages (PackageRegistry): Package names shared by every update of the handler.
+        walks (WalkCache): Directory walks shared by every update of the handler.
+        sql_stats (SQLStats): Accounting of the SQL statements of the engine, None
+            unless enabled with :func:`cfdb.sqlstats.enable`.
 
     Methods:
         update_feedstock_outputs: Update the feedstock outputs in the database.
         update_artifacts: Update the artifacts in the database.
+        bootstrap_artifacts: Fill the artifacts tables from the upstream repodata.
+        reverse_dependencies: Packages depending on a package.
+        latest_artifact: Latest artifact of a package on a platform.
+        harvest_artifacts: Harvest the upstream artifacts straight into the database.
+        failure_registry: Registry of the artifacts that could not be reaped.
+        record_run: Add a run report to the run history.
+        run_history: Reports of the past runs.
+        vacuum: Return the free pages of the database to the file system.
     """
 
     def __init__(self, db_url=None):
@@ -41,35 +67,190 @@ class CFDBHandler:
 
         self.db_url = db_url
         self.engine = create_engine(db_url)
+        self.sql_stats = sqlstats.active()
+        if self.sql_stats is not None:
+            self.sql_stats.attach(self.engine)
         Base.metadata.create_all(self.engine)
+        file_paths.create_indexes(self.engine)
+        import_to_package_maps.add_path_column(self.engine)
         self.Session = sessionmaker(bind=self.engine)
+        self.packages = PackageRegistry()
+        self.walks = WalkCache()
 
-    def update_feedstock_outputs(self, path):
+    @contextmanager
+    def _update_session(self):
+        """
+        Session of an update, committed at the end. On error, it is rolled back and
+        the package registry is invalidated: the names it queued or inserted in the
+        rolled back transaction are not stored.
+        """
+        session = self.Session()
+        try:
+            yield session
+            session.commit()
+        except BaseException:
+            session.rollback()
+            self.packages.invalidate()
+            raise
+        finally:
+            session.close()
+
+    def update_feedstock_outputs(self, path, prune=False):
         """
         Update the feedstock outputs in the database.
 
         Args:
             path (str): Path to the feedstock outputs directory.
+            prune (bool): Delete the feedstock outputs whose file was removed.
         """
-        session = self.Session()
-        feedstock_outputs.update(session, path=Path(path))
-        session.commit()
+        with self._update_session() as session:
+            feedstock_outputs.update(
+                session,
+                path=Path(path),
+                packages=self.packages,
+                walks=self.walks,
+                prune=prune,
+            )
+
+    def update_artifacts(self, path, resume=True, prune=False):
+        """
+        Update the artifacts in the database. The run is checkpointed in
+        ``CFDB_CHECKPOINT_DIR`` (``.cfdb/checkpoints`` by default).
 
-    def update_artifacts(self, path):
+        Args:
+            path (str): The harvested data, directory or sharded store.
+            resume (bool): Resume the interrupted run on the same path, if any.
+            prune (bool): Delete the artifacts whose file was removed.
         """
-        Update the artifacts in the database.
+        with self._update_session() as session:
+            artifacts.update(
+                session,
+                path=Path(path),
+                packages=self.packages,
+                walks=self.walks,
+                checkpoint_dir=default_checkpoint_dir(),
+                resume=resume,
+                prune=prune,
+            )
+
+    def bootstrap_artifacts(self, subdirs=None):
         """
-        session = self.Session()
-        artifacts.update(session, path=Path(path))
-        session.commit()
+        Fill the packages, artifacts and dependencies tables straight from the upstream
+        repodata. The files of the bootstrapped artifacts are backfilled by the harvester.
+
+        Args:
+            subdirs (list): Only bootstrap these subdirs (e.g. ``linux-64``), all by default.
 
-    def update_import_to_package_maps(self, path):
+        Returns:
+            int: The number of inserted artifacts.
+        """
+        from cfdb.harvest.upstream import (
+            channel_list,
+            install_response_cache,
+            iter_channel_records,
+        )
+
+        install_response_cache()
+        channels = [
+            arch
+            for arch in channel_list
+            if not subdirs or arch.rsplit("/", 1)[-1] in subdirs
+        ]
+        with self._update_session() as session:
+            return bootstrap.update(
+                session, iter_channel_records(channels), packages=self.packages
+            )
+
+    def reverse_dependencies(self, package_name, platform, transitive=False):
+        """
+        Packages depending on a package, see
+        :func:`cfdb.populate.dependencies.reverse_dependencies`.
+        """
+        with self.Session() as session:
+            return dependencies.reverse_dependencies(
+                session, package_name, platform, transitive=transitive
+            )
+
+    def latest_artifact(self, package_name, platform):
+        """
+        Latest artifact of a package on a platform, see
+        :func:`cfdb.populate.latest.latest_artifact`.
+        """
+        with self.Session() as session:
+            return latest.latest_artifact(session, package_name, platform)
+
+    def update_import_to_package_maps(self, path, prune=False):
         """
         Update the import to package maps in the database.
 
         Args:
             path (str): Path to the import to package maps directory.
+            prune (bool): Delete the mappings of the files removed or modified.
         """
-        session = self.Session()
-        import_to_package_maps.update(session, path=Path(path))
-        session.commit()
+        with self._update_session() as session:
+            import_to_package_maps.update(
+                session,
+                path=Path(path),
+                packages=self.packages,
+                walks=self.walks,
+                prune=prune,
+            )
+
+    def vacuum(self):
+        """
+        Return the pages freed by the deletions to the file system, see
+        :func:`cfdb.populate.reconcile.vacuum`.
+        """
+        reconcile.vacuum(self.engine)
+
+    def harvest_artifacts(self, **reap_kwargs):
+        """
+        Harvest the upstream artifacts missing from the database and ingest them as they
+        are harvested, without the round trip through the JSON blobs.
+
+        Args:
+            reap_kwargs: Extra arguments for :func:`cfdb.harvest.core.reap`.
+        """
+        # the harvesting stack (requests, requests_cache, xonsh) is only needed here
+        from cfdb.harvest.core import reap
+        from cfdb.populate.ingest import ArtifactWriter
+
+        with ArtifactWriter(self.Session, packages=self.packages) as writer:
+            reap(self.engine, writer=writer, **reap_kwargs)
+
+    def failure_registry(self):
+        """
+        Registry of the artifacts that could not be reaped, see
+        :mod:`cfdb.harvest.failures`.
+        """
+        from cfdb.harvest.failures import FailureRegistry
+
+        return FailureRegistry(self.Session)
+
+    def record_run(self, report):
+        """
+        Add a run report to the ``run_history`` table, see :mod:`cfdb.metrics`.
+
+        Args:
+            report (dict): The report, as built by :func:`cfdb.metrics.build_report`.
+        """
+        with self.Session() as session:
+            metrics.record_run(session, report)
+            session.commit()
+
+    def run_history(self, command=None, limit=20):
+        """
+        Reports of the past runs, most recent first.
+
+        Args:
+            command (str): Only the runs of this command.
+            limit (int): Maximum number of runs.
+
+        Returns:
+            List[RunHistory]: The runs.
+        """
+        with self.Session() as session:
+            query = session.query(RunHistory)
+            if command:
+                query = query.filter(RunHistory.command == command)
+            return query.order_by(RunHistory.started_at.desc()).limit(limit).all()
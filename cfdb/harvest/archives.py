@@ -0,0 +1,201 @@
+"""
+Harvesting of local package archives.
+
+Local mirrors and package caches hold hundreds of thousands of ``.conda`` and
+``.tar.bz2`` files. :func:`harvest_local` walks such a directory and harvests its
+archives through the :class:`~cfdb.harvest.pipeline.HarvestPipeline` (files are
+read on threads and harvested in a process pool), which also makes it a
+network-free benchmark of the harvester.
+
+Harvested archives are recorded in a manifest (``filename``, ``size`` and
+``sha256``, one per line), and skipped on the following runs unless their size,
+or their checksum when asked for, changed.
+"""
+
+import hashlib
+import os
+import threading
+from logging import getLogger
+from pathlib import Path
+from typing import Dict, Iterator, NamedTuple, Optional
+
+from cfdb.harvest.core import write_harvested
+from cfdb.harvest.harvester import DEFAULT_MAX_SCAN_MEMBERS
+from cfdb.harvest.pipeline import HarvestPipeline
+from cfdb.log import progressBar
+
+logger = getLogger(__name__)
+
+ARCHIVE_EXTENSIONS = (".conda", ".tar.bz2")
+
+
+def default_manifest_path() -> Path:
+    return Path(
+        os.environ.get("CFDB_LOCAL_MANIFEST", Path.cwd() / ".cfdb" / "local-archives.tsv")
+    )
+
+
+def artifact_stem(filename: str) -> str:
+    for extension in ARCHIVE_EXTENSIONS:
+        if filename.endswith(extension):
+            return filename[: -len(extension)]
+    return filename
+
+
+def iter_archives(root: Path) -> Iterator[Path]:
+    """Recursively lists the package archives under ``root``."""
+    for dirpath, _, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            if filename.endswith(ARCHIVE_EXTENSIONS):
+                yield Path(dirpath) / filename
+
+
+def sha256_file(path: Path, chunk_size: int = 1 << 20) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class ManifestEntry(NamedTuple):
+    filename: str
+    size: int
+    sha256: str
+
+
+class ArchiveManifest:
+    """
+    Append-only record of the harvested archives, keyed by file name (the last line
+    of a file name wins).
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self.entries: Dict[str, ManifestEntry] = {}
+        if self.path.is_file():
+            with open(self.path, "r", encoding="utf8") as f:
+                for line in f:
+                    fields = line.rstrip("\n").split("\t")
+                    # lines cut short by a crash are ignored
+                    if (
+                        not line.endswith("\n")
+                        or len(fields) != 3
+                        or not fields[1].isdigit()
+                    ):
+                        continue
+                    entry = ManifestEntry(fields[0], int(fields[1]), fields[2])
+                    self.entries[entry.filename] = entry
+
+    def is_harvested(self, path: Path, size: int, verify_checksum: bool = False) -> bool:
+        entry = self.entries.get(path.name)
+        if entry is None or entry.size != size:
+            return False
+        return not verify_checksum or entry.sha256 == sha256_file(path)
+
+    def record(self, entry: ManifestEntry):
+        line = "\t".join(map(str, entry)) + "\n"
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "a", encoding="utf8") as f:
+                f.write(line)
+            self.entries[entry.filename] = entry
+
+
+def harvest_local(
+    root: Path,
+    store=None,
+    manifest: Optional[ArchiveManifest] = None,
+    channel: str = "conda-forge",
+    read_workers: int = 4,
+    harvest_workers: Optional[int] = None,
+    lazy_yaml: bool = False,
+    max_scan_members: Optional[int] = DEFAULT_MAX_SCAN_MEMBERS,
+    verify_checksum: bool = False,
+) -> int:
+    """
+    Harvests the archives found under ``root`` that are not in the manifest yet.
+
+    The harvested data is written like :func:`cfdb.harvest.core.reap` does, as JSON
+    blobs under ``CFDB_ARTIFACTS_PATH/artifacts`` or to ``store``.
+
+    Args:
+        root (Path): Directory of the archives, walked recursively.
+        store (ShardStore, optional): Sharded store receiving the harvested data.
+        manifest (ArchiveManifest, optional): Record of the harvested archives, defaults
+            to ``CFDB_LOCAL_MANIFEST`` (``.cfdb/local-archives.tsv``).
+        channel (str): Channel the archives belong to, used to name the artifacts.
+        read_workers (int): Number of threads reading the archives.
+        harvest_workers (int, optional): Number of harvesting processes.
+        lazy_yaml (bool): Whether to defer parsing the YAML members.
+        max_scan_members (int, optional): See :func:`cfdb.harvest.core.reap_package`.
+        verify_checksum (bool): Whether to also compare the sha256 of the archives listed
+            in the manifest with the same size before skipping them.
+
+    Returns:
+        int: The number of harvested archives.
+    """
+    if manifest is None:
+        manifest = ArchiveManifest(default_manifest_path())
+
+    pending = []
+    skipped = 0
+    for path in iter_archives(root):
+        if manifest.is_harvested(path, path.stat().st_size, verify_checksum):
+            skipped += 1
+        else:
+            # the package name is only a placeholder until the index is read
+            pending.append(("", path.name, str(path)))
+    logger.info(f"Found {len(pending)} archives to harvest ({skipped} already harvested)")
+
+    checksums = {}
+
+    def read(package_data):
+        path = package_data[2]
+        with open(path, "rb") as f:
+            content = f.read()
+        checksums[path] = hashlib.sha256(content).hexdigest()
+        return content
+
+    def write(package_data, data, blob):
+        path = Path(package_data[2])
+        index = data["index"]
+        subdir = index.get("subdir") or path.parent.name
+        dst_path = os.path.join(channel, subdir, f"{artifact_stem(path.name)}.json")
+        data = write_harvested(
+            (index.get("name") or data["name"], dst_path, str(path)),
+            data,
+            store=store,
+            blob=blob,
+        )
+        manifest.record(
+            ManifestEntry(path.name, path.stat().st_size, checksums.pop(str(path)))
+        )
+        return data
+
+    pipeline = HarvestPipeline(
+        fetch=read,
+        write=write,
+        download_workers=read_workers,
+        harvest_workers=harvest_workers,
+        lazy_yaml=lazy_yaml,
+        max_scan_members=max_scan_members,
+        serialize=store is None,
+    )
+
+    harvested = 0
+    with progressBar:
+        for package_data, _, error in progressBar.track(
+            sequence=pipeline.run(pending),
+            description="Harvesting archives...",
+            total=len(pending),
+        ):
+            if error is not None:
+                checksums.pop(package_data[2], None)
+                logger.error(f"Failed to harvest '{package_data[2]}': {error}")
+            else:
+                harvested += 1
+
+    logger.info(f"Harvested {harvested} archives from {root}")
+    return harvested
@@ -0,0 +1,170 @@
+"""
+Content-addressed cache of the downloaded package archives.
+
+Archives are stored under their sha256, as announced by the repodata, so that
+retrying a failed harvest or re-harvesting after a ``METADATA_VERSION`` bump
+costs no download::
+
+    <root>/<sha256[:2]>/<sha256>
+
+Downloads are streamed to a temporary file while their sha256 and size are
+computed, and only moved into the cache once both match the repodata, so no
+extra pass over the bytes is needed and the cache never holds a corrupt
+archive. The least recently used archives are evicted once the cache grows
+past its maximum size.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from logging import getLogger
+from pathlib import Path
+from typing import Iterable, Optional
+
+logger = getLogger(__name__)
+
+DEFAULT_MAX_SIZE_GB = 20
+
+
+class IntegrityError(ValueError):
+    """Raised when a download does not match the checksum or size of the repodata."""
+
+
+def verify_chunks(
+    chunks: Iterable[bytes], sha256: Optional[str], size: Optional[int], sink=None
+) -> bytes:
+    """
+    Joins ``chunks``, verifying their sha256 and total size on the fly.
+
+    Args:
+        chunks (Iterable[bytes]): The payload, in chunks.
+        sha256 (str, optional): The expected checksum, not verified when None.
+        size (int, optional): The expected size, not verified when None.
+        sink (file, optional): A binary file the chunks are also written to.
+
+    Raises:
+        IntegrityError: If the checksum or the size do not match.
+    """
+    hasher = hashlib.sha256()
+    parts = []
+    received = 0
+    for chunk in chunks:
+        hasher.update(chunk)
+        received += len(chunk)
+        parts.append(chunk)
+        if sink is not None:
+            sink.write(chunk)
+        if size is not None and received > size:
+            raise IntegrityError(f"Received more than the expected {size} bytes")
+
+    if size is not None and received != size:
+        raise IntegrityError(f"Received {received} bytes, expected {size}")
+    if sha256 is not None and hasher.hexdigest() != sha256:
+        raise IntegrityError(f"sha256 mismatch, expected {sha256}")
+    return b"".join(parts)
+
+
+class ArchiveCache:
+    """
+    Args:
+        root (Path): Directory of the cache, created if needed.
+        max_bytes (int): Total size above which the least recently used archives
+            are evicted.
+    """
+
+    def __init__(self, root: Path, max_bytes: int = DEFAULT_MAX_SIZE_GB * 1024**3):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.total_bytes = sum(path.stat().st_size for path in self._iter_entries())
+        self.hits = 0
+        self.misses = 0
+
+    def _iter_entries(self):
+        for shard in self.root.iterdir():
+            if shard.is_dir() and len(shard.name) == 2:
+                yield from (p for p in shard.iterdir() if not p.name.endswith(".tmp"))
+
+    def path_for(self, sha256: str) -> Path:
+        return self.root / sha256[:2] / sha256
+
+    def get(self, sha256: str) -> Optional[bytes]:
+        """Returns the cached archive, or None if it is not cached."""
+        path = self.path_for(sha256)
+        try:
+            with open(path, "rb") as f:
+                content = f.read()
+            # the modification time serves as the last access time for eviction
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.hits += 1
+        return content
+
+    def fetch(
+        self, chunks: Iterable[bytes], sha256: str, size: Optional[int] = None
+    ) -> bytes:
+        """
+        Stores a download in the cache while verifying it.
+
+        Args:
+            chunks (Iterable[bytes]): The downloaded payload, in chunks.
+            sha256 (str): The checksum announced by the repodata.
+            size (int, optional): The size announced by the repodata.
+
+        Raises:
+            IntegrityError: If the checksum or the size do not match, in which case
+                nothing is cached.
+        """
+        path = self.path_for(sha256)
+        path.parent.mkdir(exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as sink:
+                content = verify_chunks(chunks, sha256, size, sink=sink)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        with self._lock:
+            self.total_bytes += len(content)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+        return content
+
+    def _evict(self):
+        # evict down to 90% of the budget, so that the cache is not scanned on every put
+        target = self.max_bytes * 0.9
+        entries = []
+        for path in self._iter_entries():
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        start = time.perf_counter()
+        evicted = 0
+        self.total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if self.total_bytes <= target:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            self.total_bytes -= size
+            evicted += 1
+
+        logger.debug(
+            f"Evicted {evicted} archives from {self.root} in {time.perf_counter() - start:.2f}s"
+        )
+
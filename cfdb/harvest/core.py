@@ -1,41 +1,103 @@
 import json
 import os
-import tempfile
 import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from time import localtime, strftime
 from logging import getLogger
+from typing import NamedTuple, Optional
 
 import requests
+import requests_cache
+from sqlalchemy.engine import Engine
 
-from cfdb.harvest.harvester import harvest, harvest_dot_conda
+from cfdb import metrics
+from cfdb.harvest.cache import verify_chunks
+from cfdb.harvest.harvester import (
+    DEFAULT_MAX_SCAN_MEMBERS,
+    harvest_bytes,
+    log_scan_stats,
+)
+from cfdb.harvest.incremental import fetch_incremental
 from cfdb.harvest.local import fetch_db, fetch_jsonblobs
-from cfdb.harvest.upstream import fetch as upstream_fetch
-from cfdb.harvest.utils import expand_file_and_mkdirs
+from cfdb.harvest.pipeline import HarvestPipeline
+from cfdb.harvest.policy import HarvestPolicy
+from cfdb.harvest.upstream import fetch as upstream_fetch, install_response_cache
+from cfdb.harvest.utils import expand_file_and_mkdirs, peak_rss_mb
 from cfdb.log import progressBar
 
 logger = getLogger(__name__)
 
-def diff(path):
+
+class PackageData(NamedTuple):
+    """An artifact to reap, as returned by :func:`diff`."""
+
+    package: str
+    filename: str
+    url: str
+    sha256: Optional[str] = None
+    size: Optional[int] = None
+    version: Optional[str] = None
+    build_number: Optional[int] = None
+    timestamp: Optional[int] = None
+
+
+@metrics.timer("harvest.diff")
+def diff(path, incremental=False, policy=None):
+    """
+    Computes the upstream artifacts that are missing from the local jsonblobs or database.
+
+    Args:
+        path: Root of the jsonblob directory (or sharded store), path to a SQLite
+            database, database URL or engine.
+        incremental (bool): Only consider the upstream artifacts that were not seen in a
+            previous incremental run (see :mod:`cfdb.harvest.incremental`).
+        policy (HarvestPolicy, optional): Restricts the upstream artifacts to consider.
+
+    Returns:
+        set: A set of :class:`PackageData` tuples.
+    """
     missing_files = set()
-    upstream = upstream_fetch()
+    if incremental:
+        upstream, update = fetch_incremental()
+    else:
+        upstream = upstream_fetch()
+
+    excluded_urls = []
+    if policy is not None and policy.is_restrictive:
+        selected = policy.select(upstream)
+        excluded_urls = [
+            artifact.url
+            for package, artifacts in upstream.items()
+            for filename, artifact in artifacts.items()
+            if filename not in selected.get(package, ())
+        ]
+        logger.info(f"The harvest policy excluded {len(excluded_urls)} upstream artifacts")
+        upstream = selected
 
-    if not isinstance(path, Path):
+    if isinstance(path, Engine) or isinstance(path, str) and "://" in path:
+        local = fetch_db(path)
+        path = None
+    elif not isinstance(path, Path):
         path = Path(path)
-        if path.is_dir():
-            # assume we've been given the root of the jsonblob directory
-            local = fetch_jsonblobs(path)
-        elif path.is_file() and path.suffix == ".db":
-            local = fetch_db(f"sqlite:///{path}")
-        else:
-            raise ValueError(f"Unknown path type: {path}")
+
+    if path is None:
+        pass
+    elif path.is_dir():
+        # assume we've been given the root of the jsonblob directory
+        local = fetch_jsonblobs(path)
+    elif path.is_file() and path.suffix == ".db":
+        local = fetch_db(f"sqlite:///{path}")
+    else:
+        raise ValueError(f"Unknown path type: {path}")
 
     missing_packages = set(upstream.keys()) - set(local.keys())
     present_packages = set(upstream.keys()) & set(local.keys())
 
     for package in missing_packages:
-        missing_files.update((package, k, v) for k, v in upstream[package].items())
+        missing_files.update(
+            PackageData(package, k, *v) for k, v in upstream[package].items()
+        )
 
     for package in present_packages:
         upstream_artifacts = upstream[package]
@@ -43,56 +105,104 @@ def diff(path):
 
         missing_artifacts = set(upstream_artifacts) - set(present_artifacts)
         missing_files.update(
-            (package, k, v)
+            PackageData(package, k, *v)
             for k, v in upstream_artifacts.items()
             if k in missing_artifacts
         )
 
+    if incremental:
+        # artifacts excluded by the policy are not seen yet, a later run may select them
+        update.commit(
+            [package_data.url for package_data in missing_files] + excluded_urls
+        )
+
     return missing_files
 
 
 class ReapFailure(Exception):
-    def __init__(self, package, src_url, msg):
+    def __init__(self, package, src_url, msg, error_class=None):
         super().__init__(f"Failed to reap package '{package}' from '{src_url}': {msg}")
         self.package = package
         self.src_url = src_url
         self.msg = msg
+        self.error_class = error_class or "ReapFailure"
+
+    @classmethod
+    def wrap(cls, package, src_url, error):
+        """Wraps any error raised while reaping an artifact, keeping its original class."""
+        if isinstance(error, cls):
+            return cls(package, src_url, error.msg, error.error_class)
+        return cls(package, src_url, str(error), type(error).__name__)
 
     def write_to_file(self):
         with open("reap_failures.txt", "a") as f:
             f.write(f"{self.package}\t{self.src_url}\t{self.msg}\n")
 
 
-def fetch_url(src_url):
+@metrics.timer("harvest.download")
+def fetch_url(src_url, sha256=None, size=None, cache=None):
+    """
+    Downloads an archive, verifying its sha256 and size while streaming when known.
+
+    Args:
+        src_url (str): The archive URL.
+        sha256 (str, optional): The checksum announced by the repodata.
+        size (int, optional): The size announced by the repodata.
+        cache (ArchiveCache, optional): Cache of the archives, used when ``sha256`` is known.
+    """
+    if cache is not None and sha256:
+        content = cache.get(sha256)
+        if content is not None:
+            return content
+
     try:
-        response = requests.get(src_url, timeout=60 * 2)
-        response.raise_for_status()
-        return response.content
+        if sha256 is None and size is None:
+            response = requests.get(src_url, timeout=60 * 2)
+            response.raise_for_status()
+            return response.content
+
+        # the response cache needs the whole body in memory, bypass it when streaming
+        with requests_cache.disabled():
+            with requests.get(src_url, stream=True, timeout=60 * 2) as response:
+                response.raise_for_status()
+                chunks = response.iter_content(chunk_size=1 << 20)
+                if cache is not None and sha256:
+                    return cache.fetch(chunks, sha256, size)
+                return verify_chunks(chunks, sha256, size)
     except Exception as e:
-        fail = ReapFailure("Unknown", src_url, str(e))
+        fail = ReapFailure("Unknown", src_url, str(e), type(e).__name__)
         fail.write_to_file()
         raise fail
 
 
-def reap_package(package_data):
-    package, dst_path, src_url = package_data
-    try:
-        file_content = fetch_url(src_url)
-
-        with tempfile.TemporaryDirectory() as tmpdir:
-            pkg_pth = os.path.join(tmpdir, os.path.basename(src_url))
-            with open(pkg_pth, "wb") as file:
-                file.write(file_content)
-
-            with open(pkg_pth, "rb") as filelike:
-                if pkg_pth.endswith(".tar.bz2"):
-                    harvested_data = harvest(filelike)
-                elif pkg_pth.endswith(".conda"):
-                    harvested_data = harvest_dot_conda(filelike, pkg_pth)
-                else:
-                    raise RuntimeError(
-                        f"File '{pkg_pth}' is not a recognized conda format!"
-                    )
+def fetch_package(package_data, cache=None):
+    """Downloads the archive of a :class:`PackageData` (or ``(package, filename, url)``)."""
+    return fetch_url(package_data[2], *package_data[3:5], cache=cache)
+
+
+def write_harvested(package_data, harvested_data, store=None, write_blobs=True, blob=None):
+    """
+    Stores the harvested data of an artifact either as a JSON blob under
+    ``CFDB_ARTIFACTS_PATH/artifacts`` or in ``store``, then adds the fields
+    describing the artifact (``path``, ``pkg``, ``channel``, ``arch``, ``name``).
+
+    Args:
+        package_data (PackageData): The artifact, as returned by ``diff``.
+        harvested_data (dict): The harvested data.
+        store (ShardStore, optional): Sharded store receiving the harvested data.
+        write_blobs (bool): Whether to store the harvested data at all (it is
+            only returned otherwise, e.g. for direct ingestion).
+        blob (str, optional): The JSON blob, when already serialized.
+
+    Returns:
+        dict: The harvested data.
+    """
+    package, dst_path = package_data[:2]
+    if not write_blobs:
+        pass
+    elif store is not None:
+        store.put(package, dst_path, harvested_data)
+    else:
         # Obtain the root path from the environment variable CFDB_ARTIFACTS_PATH,
         # to be used to store the harvested data
         root_path = os.environ.get("CFDB_ARTIFACTS_PATH", dst_path.split(os.sep)[0])
@@ -100,60 +210,208 @@ def reap_package(package_data):
         dir_path = Path(root_path) / "artifacts" / package
         os.makedirs(dir_path, exist_ok=True)
 
-        with open(expand_file_and_mkdirs((dir_path / dst_path).as_posix()), "w") as fo:
-            json.dump(harvested_data, fo, indent=1, sort_keys=True)
-
-        channel, arch, name = dst_path.split(os.sep)
-        name = os.path.splitext(name)[0]
-        harvested_data.update(
-            {
-                "path": os.path.join(package, dst_path),
-                "pkg": package,
-                "channel": channel,
-                "arch": arch,
-                "name": name,
-            }
+        with open(
+            expand_file_and_mkdirs((dir_path / dst_path).as_posix()), "w"
+        ) as fo:
+            if blob is None:
+                json.dump(harvested_data, fo, indent=1, sort_keys=True)
+            else:
+                fo.write(blob)
+
+    channel, arch, name = dst_path.split(os.sep)
+    name = os.path.splitext(name)[0]
+    harvested_data.update(
+        {
+            "path": os.path.join(package, dst_path),
+            "pkg": package,
+            "channel": channel,
+            "arch": arch,
+            "name": name,
+        }
+    )
+    return harvested_data
+
+
+def reap_package(
+    package_data,
+    lazy_yaml=False,
+    store=None,
+    write_blobs=True,
+    max_scan_members=DEFAULT_MAX_SCAN_MEMBERS,
+    cache=None,
+):
+    """
+    Downloads and harvests a single artifact, storing the harvested data either as a
+    JSON blob under ``CFDB_ARTIFACTS_PATH/artifacts`` or in ``store``.
+
+    Args:
+        package_data (PackageData): The artifact, as returned by ``diff``.
+        lazy_yaml (bool): Whether to defer parsing the YAML members.
+        store (ShardStore, optional): Sharded store receiving the harvested data.
+        write_blobs (bool): Whether to store the harvested data at all (it is
+            only returned otherwise, e.g. for direct ingestion).
+        max_scan_members (int, optional): Bound of the fallback scans of ``.tar.bz2``
+            archives (see :func:`cfdb.harvest.harvester.harvest_tarfile`), None for
+            no bound.
+        cache (ArchiveCache, optional): Cache of the downloaded archives.
+    """
+    package, _, src_url = package_data[:3]
+    try:
+        file_content = fetch_package(package_data, cache=cache)
+        metrics.incr("harvest.download.bytes", len(file_content))
+        with metrics.timer("harvest.harvest"):
+            harvested_data = harvest_bytes(
+                file_content,
+                os.path.basename(src_url),
+                lazy_yaml=lazy_yaml,
+                max_scan_members=max_scan_members,
+            )
+        return write_harvested(
+            package_data, harvested_data, store=store, write_blobs=write_blobs
         )
-        return harvested_data
     except Exception as e:
-        raise ReapFailure(package, src_url, str(e))
+        raise ReapFailure.wrap(package, src_url, e)
+
+
+def _reap_threaded(packages, max_workers, **kwargs):
+    """Runs :func:`reap_package` on a thread pool, yielding ``(package_data, data, error)``."""
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(reap_package, package_data, **kwargs): package_data
+            for package_data in packages
+        }
+        for f in as_completed(futures):
+            try:
+                yield futures[f], f.result(), None
+            except Exception as e:
+                yield futures[f], None, e
 
 
-def reap(comparing_source_path, known_bad_packages=(), max_workers=20):
-    sorted_files = list(diff(comparing_source_path))
+def reap(
+    comparing_source_path,
+    known_bad_packages=(),
+    max_workers=20,
+    incremental=False,
+    lazy_yaml=False,
+    store=None,
+    writer=None,
+    write_blobs=True,
+    max_scan_members=DEFAULT_MAX_SCAN_MEMBERS,
+    pipeline=False,
+    harvest_workers=None,
+    cache=None,
+    failures=None,
+    policy=None,
+    max_artifacts=1000,
+):
+    """
+    Harvests the upstream artifacts missing from ``comparing_source_path``.
+
+    Args:
+        comparing_source_path: Root of the jsonblob directory (or sharded store), path
+            to a SQLite database, database URL or engine.
+        known_bad_packages: URLs to skip, on top of the ones quarantined in ``failures``.
+        max_workers (int): Number of download/harvest threads (download threads only
+            with ``pipeline``).
+        incremental (bool): See :func:`diff`.
+        lazy_yaml (bool): Whether to defer parsing the YAML members.
+        store (ShardStore, optional): Sharded store receiving the harvested data.
+        writer (ArtifactWriter, optional): Writer ingesting the harvested data into the
+            database as soon as it is available.
+        write_blobs (bool): Whether to store the harvested data as JSON blobs (or in ``store``).
+        max_scan_members (int, optional): See :func:`reap_package`.
+        pipeline (bool): Whether to harvest in a process pool, see
+            :class:`cfdb.harvest.pipeline.HarvestPipeline`.
+        harvest_workers (int, optional): Number of harvesting processes with ``pipeline``.
+        cache (ArchiveCache, optional): Cache of the downloaded archives.
+        failures (FailureRegistry, optional): Registry recording the outcome of every
+            artifact and quarantining the ones failing repeatedly.
+        policy (HarvestPolicy, optional): Restricts the upstream artifacts to consider.
+        max_artifacts (int, optional): Maximum number of artifacts reaped by the run, the
+            most recent ones first. None for no limit.
+    """
+    install_response_cache()
+    sorted_files = HarvestPolicy.prioritize(
+        diff(comparing_source_path, incremental=incremental, policy=policy)
+    )
     total_outstanding_artifacts = len(sorted_files)
+    metrics.gauge("harvest.outstanding", total_outstanding_artifacts)
     logger.info(f"Found {total_outstanding_artifacts} artifacts to reap")
+    logger.info(f"Peak RSS after comparing upstream artifacts: {peak_rss_mb():.1f} MB")
+
+    known_bad_packages = set(known_bad_packages)
+    if failures is not None:
+        quarantined = failures.quarantined_urls()
+        logger.info(f"Skipping {len(quarantined)} quarantined artifacts")
+        known_bad_packages |= quarantined
+    sorted_files = [p for p in sorted_files if p[2] not in known_bad_packages]
 
     # Restricting the number of artifacts seems only reasonable on a daily basis;
-    # in case of a complete migration, we would want to reap all artifacts
-    sorted_files = sorted_files[:1000]
+    # in case of a complete migration, we would want to reap all artifacts.
+    # The skipped artifacts must not take the place of the others.
+    if max_artifacts:
+        sorted_files = sorted_files[:max_artifacts]
+    n_total = len(sorted_files)
+    start = time.time()
+    logger.info(
+        f"Reaping {n_total} artifacts, starting at {strftime('%Y-%m-%d %H:%M:%S', localtime(start))}"
+    )
 
-    with ThreadPoolExecutor(max_workers=max_workers) as pool:
-        futures = []
-        for package_data in sorted_files:
-            if package_data[2] in known_bad_packages:
+    if pipeline:
+        harvest_pipeline = HarvestPipeline(
+            fetch=lambda package_data: fetch_package(package_data, cache=cache),
+            write=lambda package_data, data, blob: write_harvested(
+                package_data, data, store=store, write_blobs=write_blobs, blob=blob
+            ),
+            download_workers=max_workers,
+            harvest_workers=harvest_workers,
+            lazy_yaml=lazy_yaml,
+            max_scan_members=max_scan_members,
+            serialize=write_blobs and store is None,
+        )
+        results = harvest_pipeline.run(sorted_files)
+    else:
+        results = _reap_threaded(
+            sorted_files,
+            max_workers,
+            lazy_yaml=lazy_yaml,
+            store=store,
+            write_blobs=write_blobs,
+            max_scan_members=max_scan_members,
+            cache=cache,
+        )
+
+    with progressBar:
+        for package_data, harvested_data, error in progressBar.track(
+            sequence=results,
+            description="Reaping artifacts...",
+            total=n_total,
+        ):
+            if error is not None:
+                error = ReapFailure.wrap(package_data[0], package_data[2], error)
+                logger.error(error, exc_info=error)
+                metrics.incr("harvest.failed")
+                if failures is not None:
+                    failures.record_failure(
+                        package_data[2], package_data[0], error.error_class, error.msg
+                    )
                 continue
-            futures.append(pool.submit(reap_package, package_data))
 
-        n_total = len(futures)
-        start = time.time()
-        logger.info(
-            f"Reaping {n_total} artifacts, starting at {strftime('%Y-%m-%d %H:%M:%S', localtime(start))}"
-        )
+            metrics.incr("harvest.reaped")
+            if failures is not None:
+                failures.record_success(package_data[2])
+            if writer is not None:
+                writer.submit(harvested_data)
+
+    if failures is not None:
+        failures.close()
 
-        with progressBar:
-            for _, f in enumerate(
-                progressBar.track(
-                    sequence=as_completed(futures, timeout=None),
-                    description="Reaping artifacts...",
-                    total=n_total,
-                ),
-                1,
-            ):
-                try:
-                    f.result()
-                except Exception as e:
-                    logger.exception(e)
+    log_scan_stats()
+    if cache is not None:
+        logger.info(f"Archive cache: {cache.hits} hits, {cache.misses} misses")
+        metrics.gauge("harvest.cache.hits", cache.hits)
+        metrics.gauge("harvest.cache.misses", cache.misses)
+    logger.info(f"Peak RSS after reaping: {peak_rss_mb():.1f} MB")
 
 
 if __name__ == "__main__":
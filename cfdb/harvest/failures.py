@@ -0,0 +1,150 @@
+"""
+Registry of the artifacts that could not be reaped.
+
+Every failure of ``reap`` is recorded in the ``reap_failures`` table (URL, error
+class, number of consecutive attempts, first and last attempt). Once an URL
+failed ``CFDB_QUARANTINE_THRESHOLD`` times in a row it is quarantined: it is
+skipped by the following runs and only retried after an interval doubling with
+every further failure, from ``CFDB_QUARANTINE_BASE_HOURS`` up to
+``CFDB_QUARANTINE_MAX_DAYS``. A successful reap removes the URL from the
+registry.
+"""
+
+import os
+from datetime import datetime, timedelta
+from logging import getLogger
+from typing import List, Optional, Set
+
+from sqlalchemy.orm import Session, sessionmaker
+
+from cfdb.models.schema import ReapFailures
+
+logger = getLogger(__name__)
+
+
+def _utcnow() -> datetime:
+    return datetime.utcnow()
+
+
+class FailureRegistry:
+    """
+    Args:
+        session_factory (sessionmaker): Factory of the database sessions.
+        threshold (int, optional): Consecutive failures before an URL is quarantined.
+        base_interval (timedelta, optional): Retry interval of a freshly quarantined URL.
+        max_interval (timedelta, optional): Upper bound of the retry interval.
+    """
+
+    def __init__(
+        self,
+        session_factory: sessionmaker,
+        threshold: Optional[int] = None,
+        base_interval: Optional[timedelta] = None,
+        max_interval: Optional[timedelta] = None,
+    ):
+        self.session_factory = session_factory
+        self.threshold = (
+            threshold
+            if threshold is not None
+            else int(os.environ.get("CFDB_QUARANTINE_THRESHOLD", 3))
+        )
+        self.base_interval = base_interval or timedelta(
+            hours=float(os.environ.get("CFDB_QUARANTINE_BASE_HOURS", 24))
+        )
+        self.max_interval = max_interval or timedelta(
+            days=float(os.environ.get("CFDB_QUARANTINE_MAX_DAYS", 30))
+        )
+        self._session = None
+        self._failing: Set[str] = set()
+
+    def retry_interval(self, attempts: int) -> timedelta:
+        """Time to wait before retrying an URL that failed ``attempts`` times in a row."""
+        if attempts < self.threshold:
+            return timedelta(0)
+        # cap the exponent, the interval is bounded anyway
+        exponent = min(attempts - self.threshold, 32)
+        return min(self.base_interval * 2**exponent, self.max_interval)
+
+    def is_quarantined(self, failure: ReapFailures, now: Optional[datetime] = None) -> bool:
+        now = now or _utcnow()
+        return failure.last_attempt + self.retry_interval(failure.attempts) > now
+
+    def quarantined_urls(self, now: Optional[datetime] = None) -> Set[str]:
+        """The URLs to skip in the current run."""
+        with self.session_factory() as session:
+            candidates = session.query(ReapFailures).filter(
+                ReapFailures.attempts >= self.threshold
+            )
+            return {f.url for f in candidates if self.is_quarantined(f, now)}
+
+    @property
+    def session(self) -> Session:
+        """Session used to record the outcomes of a run, see :meth:`commit`."""
+        if self._session is None:
+            self._session = self.session_factory()
+            self._failing = {url for (url,) in self._session.query(ReapFailures.url)}
+        return self._session
+
+    def record_failure(
+        self,
+        url: str,
+        package_name: str,
+        error_class: str,
+        message: str,
+        now: Optional[datetime] = None,
+    ):
+        now = now or _utcnow()
+        failure = self.session.get(ReapFailures, url)
+        if failure is None:
+            failure = ReapFailures(url=url, attempts=0, first_attempt=now)
+            self.session.add(failure)
+            self._failing.add(url)
+        failure.package_name = package_name
+        failure.error_class = error_class
+        failure.message = message
+        failure.attempts += 1
+        failure.last_attempt = now
+        if failure.attempts == self.threshold:
+            logger.warning(f"Quarantining {url} after {failure.attempts} failures")
+
+    def record_success(self, url: str):
+        session = self.session
+        # only the URLs that failed before need a query
+        if url in self._failing:
+            session.query(ReapFailures).filter(ReapFailures.url == url).delete()
+            self._failing.discard(url)
+
+    def commit(self):
+        if self._session is not None:
+            self._session.commit()
+
+    def close(self):
+        if self._session is not None:
+            self._session.commit()
+            self._session.close()
+            self._session = None
+
+    def list_failures(self, quarantined_only: bool = False) -> List[ReapFailures]:
+        with self.session_factory() as session:
+            failures = session.query(ReapFailures).order_by(ReapFailures.url).all()
+        if quarantined_only:
+            now = _utcnow()
+            failures = [f for f in failures if self.is_quarantined(f, now)]
+        return failures
+
+    def clear(self, urls: Optional[List[str]] = None, package_name: Optional[str] = None) -> int:
+        """
+        Removes entries from the registry, all of them when no filter is given.
+
+        Returns:
+            int: The number of removed entries.
+        """
+        with self.session_factory() as session:
+            query = session.query(ReapFailures)
+            if urls:
+                query = query.filter(ReapFailures.url.in_(urls))
+            if package_name:
+                query = query.filter(ReapFailures.package_name == package_name)
+            removed = query.delete(synchronize_session=False)
+            session.commit()
+        return removed
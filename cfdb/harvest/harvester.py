@@ -3,15 +3,71 @@
 Harvests metadata out of a built conda package
 """
 
+import io
 import json
 import os
 import tarfile
+import threading
+import time
+from collections import Counter
+from logging import getLogger
 
-from ruamel.yaml.scanner import ScannerError
-import ruamel.yaml as ruamel_yaml
+from cfdb import metrics, profiling
+from cfdb.harvest import yaml_loader
+
+logger = getLogger(__name__)
 
 METADATA_VERSION = 1
 
+#: info members read by harvest_tarfile
+INFO_MEMBERS = frozenset(
+    {
+        "info/files",
+        "info/index.json",
+        "info/about.json",
+        "info/recipe/meta.yaml",
+        "info/meta.yaml",
+        "info/recipe/meta.yaml.template",
+        "info/recipe/conda_build_config.yaml",
+    }
+)
+#: info members every artifact is expected to provide
+REQUIRED_INFO_MEMBERS = frozenset({"info/files", "info/index.json"})
+#: once these are read there is nothing left to look for ('info/meta.yaml' is
+#: only a fallback location of 'info/recipe/meta.yaml' in older artifacts)
+ALL_INFO_MEMBERS = INFO_MEMBERS - {"info/meta.yaml"}
+
+#: default bound of the fallback scans, enough for the info members of any sane
+#: archive while capping the decompression of pathological ones
+DEFAULT_MAX_SCAN_MEMBERS = 20000
+
+#: how the members of the harvested archives were scanned, see harvest_tarfile
+scan_stats = Counter()
+_scan_stats_lock = threading.Lock()
+
+
+def _record_scan(outcome):
+    with _scan_stats_lock:
+        scan_stats[outcome] += 1
+
+
+def merge_scan_stats(stats):
+    """Adds scan outcomes counted elsewhere (e.g. in a worker process) to ``scan_stats``."""
+    with _scan_stats_lock:
+        scan_stats.update(stats)
+
+
+def log_scan_stats():
+    with _scan_stats_lock:
+        stats = dict(scan_stats)
+    if stats:
+        logger.info(
+            "Archive scans: "
+            + ", ".join(f"{outcome}={count}" for outcome, count in sorted(stats.items()))
+        )
+    for outcome, count in stats.items():
+        metrics.gauge(f"harvest.scan.{outcome}", count)
+
 
 def filter_file(filename):
     if not filename:
@@ -23,32 +79,34 @@ def filter_file(filename):
         return True
 
 
-# There are some meta.yaml files that were written weirdly and have some strange tag
-# information in them.  This is not parsable by safe loader, so we add some more
-# fallback loading
-def yaml_construct_fallback(loader, node):
-    return None
+def parse_lazy_yaml(data, key):
+    """
+    Returns ``data[key]`` for artifacts harvested with ``lazy_yaml``, parsing (and
+    caching) the raw YAML stored under ``<key>_yaml`` on first access.
 
+    Args:
+        data (dict): The harvested data.
+        key (str): ``"rendered_recipe"`` or ``"conda_build_config"``.
+    """
+    raw = data.get(f"{key}_yaml")
+    if data.get(key) is None and raw is not None:
+        from ruamel.yaml.scanner import ScannerError
 
-ruamel_yaml.add_constructor(
-    "tag:yaml.org,2002:python/object/apply:builtins.getattr",
-    yaml_construct_fallback,
-    constructor=ruamel_yaml.SafeConstructor,
-)
-ruamel_yaml.add_constructor(
-    "tag:yaml.org,2002:python/object:__builtin__.instancemethod",
-    yaml_construct_fallback,
-    constructor=ruamel_yaml.SafeConstructor,
-)
+        try:
+            data[key] = yaml_loader.safe_load(raw) or {}
+        except ScannerError:
+            # Non parseable
+            data[key] = {}
+    return data.get(key, {})
 
 
-def harvest_dot_conda(io_like, filename):
+def harvest_dot_conda(io_like, filename, lazy_yaml=False):
     from conda_package_streaming import package_streaming
 
     stream = package_streaming.stream_conda_component(
         filename, io_like, component=package_streaming.CondaComponent.info
     )
-    data = harvest_tarfile(stream)
+    data = harvest_tarfile(stream, lazy_yaml=lazy_yaml)
     stream.close()
 
     data["conda_pkg_format"] = "2"
@@ -56,28 +114,83 @@ def harvest_dot_conda(io_like, filename):
     return data
 
 
-def harvest(io_like):
+def harvest(io_like, early_exit=True, max_scan_members=None, lazy_yaml=False):
     tf = tarfile.open(fileobj=io_like, mode="r:bz2")
-    data = harvest_tarfile(tf)
+    data = harvest_tarfile(
+        tf,
+        early_exit=early_exit,
+        max_scan_members=max_scan_members,
+        lazy_yaml=lazy_yaml,
+    )
     data["conda_pkg_format"] = None
     return data
 
 
-def harvest_tarfile(tf_or_stream):
-    rendered_recipe = {}
+def harvest_tarfile(
+    tf_or_stream, early_exit=False, max_scan_members=None, lazy_yaml=False
+):
+    """
+    Extracts the metadata out of the ``info/`` members of a package.
+
+    With ``early_exit``, iteration stops as soon as every member of ``ALL_INFO_MEMBERS``
+    was read, or at the first payload member following the ``info/`` block once the
+    required members were read. Since each skipped member of a ``.tar.bz2`` would
+    otherwise be decompressed, this avoids reading most of the payload.
+
+    Archives listing payload members before the info ones fall back to a scan of
+    the following members, optionally bounded by ``max_scan_members``. A single
+    outcome per archive is counted in ``scan_stats``:
+
+    - ``early_exit``: stopped right after the ``info/`` block.
+    - ``full_scan``: every member was read.
+    - ``fallback_early_exit``, ``fallback_full_scan``: same, after payload members
+      were found before the info ones.
+    - ``fallback_scan_limit``: the fallback scan reached ``max_scan_members``.
+
+    With ``lazy_yaml``, the rendered recipe and the conda build config are not
+    parsed: their raw text is stored under ``rendered_recipe_yaml`` and
+    ``conda_build_config_yaml`` (with ``None`` as parsed value) and can be parsed
+    on demand with :func:`parse_lazy_yaml`.
+
+    Args:
+        tf_or_stream: A ``TarFile``, or a stream of ``(tarfile, member)`` tuples.
+        early_exit (bool): Whether to stop once the info members were read.
+        max_scan_members (int, optional): Maximum number of members read during a
+            fallback scan.
+        lazy_yaml (bool): Whether to defer parsing the YAML members.
+    """
     index = {}
     about = {}
     raw_recipe = ""
-    conda_build_config = {}
     raw_recipe_backup = ""
+    rendered_recipe_yaml = None
+    conda_build_config_yaml = None
 
-    for _data in tf_or_stream:
+    found = set()
+    fallback = False
+    outcome = "full_scan"
+    for scanned, _data in enumerate(tf_or_stream, 1):
         if isinstance(_data, tarfile.TarInfo):
             mem = _data
             tf = tf_or_stream
         else:
             tf, mem = _data
 
+        if early_exit and not mem.name.startswith("info/"):
+            if REQUIRED_INFO_MEMBERS <= found:
+                outcome = "early_exit"
+                break
+            if not fallback:
+                fallback = True
+                logger.debug("Payload members found before the info ones, scanning on")
+            if max_scan_members is not None and scanned > max_scan_members:
+                outcome = "scan_limit"
+                break
+            continue
+
+        if mem.name in INFO_MEMBERS:
+            found.add(mem.name)
+
         if mem.name == "info/files":
             # info/files
             file_listing = tf.extractfile(mem).readlines()
@@ -85,21 +198,11 @@ def harvest_tarfile(tf_or_stream):
             file_listing = [fn for fn in file_listing if filter_file(fn)]
         elif mem.name == "info/recipe/meta.yaml":
             raw_recipe_backup = tf.extractfile(mem).read(mem.size).decode("utf8")
-            # info/recipe/meta.yaml
-            try:
-                rendered_recipe = ruamel_yaml.safe_load(raw_recipe_backup)
-            except ScannerError:
-                # Non parseable
-                rendered_recipe = {}
+            rendered_recipe_yaml = raw_recipe_backup
         elif mem.name == "info/meta.yaml":
             # older artifacts have a meta.yaml in another location
-            try:
-                rendered_recipe = ruamel_yaml.safe_load(
-                    tf.extractfile(mem).read(mem.size)
-                )
-            except ScannerError:
-                # Non parseable
-                rendered_recipe = {}
+            if rendered_recipe_yaml is None:
+                rendered_recipe_yaml = tf.extractfile(mem).read(mem.size).decode("utf8")
         elif mem.name == "info/about.json":
             about = json.loads(tf.extractfile(mem).read(mem.size))
         elif mem.name == "info/index.json":
@@ -107,28 +210,94 @@ def harvest_tarfile(tf_or_stream):
         elif mem.name == "info/recipe/meta.yaml.template":
             raw_recipe = tf.extractfile(mem).read(mem.size).decode("utf8")
         elif mem.name == "info/recipe/conda_build_config.yaml":
-            conda_build_config = ruamel_yaml.safe_load(
-                tf.extractfile(mem).read(mem.size)
-            )
+            conda_build_config_yaml = tf.extractfile(mem).read(mem.size).decode("utf8")
+
+        if early_exit and found >= ALL_INFO_MEMBERS:
+            outcome = "early_exit"
+            break
+
+    if early_exit:
+        _record_scan(f"fallback_{outcome}" if fallback else outcome)
+
+    if outcome == "scan_limit":
+        raise RuntimeError(
+            f"Info members not found within the first {max_scan_members} archive members"
+        )
 
-    return {
+    data = {
         "metadata_version": METADATA_VERSION,
         "name": index.get("name", ""),
         "version": index.get("version", ""),
         "index": index,
         "about": about,
-        "rendered_recipe": rendered_recipe,
+        "rendered_recipe": None if rendered_recipe_yaml is not None else {},
         "raw_recipe": raw_recipe if len(raw_recipe) > 0 else raw_recipe_backup,
-        "conda_build_config": conda_build_config,
+        "conda_build_config": None if conda_build_config_yaml is not None else {},
         "files": file_listing,
     }
 
+    if lazy_yaml:
+        data["rendered_recipe_yaml"] = rendered_recipe_yaml
+        data["conda_build_config_yaml"] = conda_build_config_yaml
+    else:
+        data["rendered_recipe"] = parse_lazy_yaml(
+            {"rendered_recipe_yaml": rendered_recipe_yaml}, "rendered_recipe"
+        )
+        data["conda_build_config"] = parse_lazy_yaml(
+            {"conda_build_config_yaml": conda_build_config_yaml}, "conda_build_config"
+        )
+
+    return data
+
+
+def harvest_bytes(content, filename, lazy_yaml=False, max_scan_members=None):
+    """
+    Harvests an archive held in memory.
+
+    Args:
+        content (bytes): The archive.
+        filename (str): Its file name, used to tell ``.conda`` and ``.tar.bz2`` apart.
+        lazy_yaml (bool): Whether to defer parsing the YAML members.
+        max_scan_members (int, optional): Bound of the fallback scans of ``.tar.bz2``
+            archives, see :func:`harvest_tarfile`.
+    """
+    io_like = io.BytesIO(content)
+    if filename.endswith(".tar.bz2"):
+        return harvest(io_like, max_scan_members=max_scan_members, lazy_yaml=lazy_yaml)
+    elif filename.endswith(".conda"):
+        return harvest_dot_conda(io_like, filename, lazy_yaml=lazy_yaml)
+    else:
+        raise RuntimeError(f"File '{filename}' is not a recognized conda format!")
+
+
+def harvest_worker_init(loader):
+    """Initializer of the harvesting processes, see :mod:`cfdb.harvest.pipeline`."""
+    yaml_loader.configure(loader)
+    profiling.start_worker()
+
+
+def harvest_task(content, filename, lazy_yaml=False, max_scan_members=None, serialize=False):
+    """
+    Harvests an archive in a worker process.
+
+    Returns:
+        tuple: The harvested data, its JSON blob (with ``serialize``, None otherwise),
+        the scan outcomes counted for this archive and the time spent.
+    """
+    start = time.perf_counter()
+    scan_stats.clear()
+    data = harvest_bytes(
+        content, filename, lazy_yaml=lazy_yaml, max_scan_members=max_scan_members
+    )
+    blob = json.dumps(data, indent=1, sort_keys=True) if serialize else None
+    return data, blob, dict(scan_stats), time.perf_counter() - start
+
 
-def harvest_from_filename(filename):
+def harvest_from_filename(filename, lazy_yaml=False):
     with open(filename, "rb") as fo:
         if filename.endswith(".tar.bz2"):
-            return harvest(fo)
+            return harvest(fo, lazy_yaml=lazy_yaml)
         elif filename.endswith(".conda"):
-            return harvest_dot_conda(fo, filename)
+            return harvest_dot_conda(fo, filename, lazy_yaml=lazy_yaml)
         else:
             raise RuntimeError(f"File '{filename}' is not a recognized conda format!")
@@ -0,0 +1,353 @@
+"""
+Incremental upstream fetching.
+
+Two strategies are combined to avoid handing the full upstream listing over to
+``diff()`` on every run:
+
+1. A local ``repodata.json`` snapshot is kept per channel/arch and brought up to
+   date with the JSON Patch deltas published in ``repodata.jlap``, so that only
+   the bytes appended since the previous run are downloaded.
+2. A compact index of the artifact URLs already handled is stored next to the
+   snapshot. Only URLs missing from this index are reported as upstream
+   artifacts, whichever way the repodata was obtained.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from logging import getLogger
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import requests
+import requests_cache
+
+from cfdb.harvest.jlap import (
+    DIGEST_SIZE,
+    JLAPError,
+    apply_patch,
+    apply_record_operations,
+    group_operations,
+    parse_jlap,
+    patch_chain,
+)
+from cfdb.harvest.streaming import PACKAGE_SECTIONS, iter_repodata_records
+from cfdb.harvest.upstream import (
+    UpstreamArtifact,
+    channel_list,
+    iter_artifacts,
+    stream_repodata,
+)
+from cfdb.harvest.utils import peak_rss_mb
+
+logger = getLogger(__name__)
+
+
+def default_state_dir() -> Path:
+    return Path(os.environ.get("CFDB_REPODATA_STATE", Path.cwd() / ".cfdb" / "repodata"))
+
+
+def url_digest(url: str) -> int:
+    """64-bit digest of an artifact URL, as stored in the seen index."""
+    return int.from_bytes(
+        hashlib.blake2b(url.encode("utf8"), digest_size=8).digest(), "little"
+    )
+
+
+class SeenIndex:
+    """
+    Sorted array of 64-bit URL digests, loaded in a single read and queried with bisect.
+    A million artifacts take 8 MB on disk and in memory.
+    """
+
+    def __init__(self, digests: Optional[array] = None):
+        self.digests = digests if digests is not None else array("Q")
+
+    def __len__(self):
+        return len(self.digests)
+
+    def __contains__(self, digest: int) -> bool:
+        idx = bisect_left(self.digests, digest)
+        return idx < len(self.digests) and self.digests[idx] == digest
+
+    @classmethod
+    def load(cls, path: Path) -> "SeenIndex":
+        digests = array("Q")
+        if path.is_file():
+            with open(path, "rb") as f:
+                digests.frombytes(f.read())
+        return cls(digests)
+
+    @classmethod
+    def from_digests(cls, digests: Iterable[int]) -> "SeenIndex":
+        return cls(array("Q", sorted(set(digests))))
+
+    def save(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            self.digests.tofile(f)
+        os.replace(tmp_path, path)
+
+
+class RepodataState:
+    """
+    On-disk state kept for a single channel/arch combination::
+
+        <state_dir>/<channel>/<arch>/repodata.json  -- last known repodata snapshot
+        <state_dir>/<channel>/<arch>/state.json     -- snapshot hash and .jlap resume point
+        <state_dir>/<channel>/<arch>/seen.idx       -- URL digests already handled
+    """
+
+    def __init__(self, state_dir: Path, arch: str):
+        self.arch = arch
+        self.root = Path(state_dir) / arch.replace("https://conda.anaconda.org/", "")
+        self.snapshot_path = self.root / "repodata.json"
+        self.state_path = self.root / "state.json"
+        self.seen_path = self.root / "seen.idx"
+
+    def load(self) -> dict:
+        if not self.state_path.is_file() or not self.snapshot_path.is_file():
+            return {}
+        with open(self.state_path, "r") as f:
+            return json.load(f)
+
+    def save(self, content: bytes, state: dict):
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.snapshot_path, "wb") as f:
+            f.write(content)
+        self.save_state(state)
+
+    def save_state(self, state: dict):
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.state_path, "w") as f:
+            json.dump(state, f)
+
+    def record_snapshot(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        """
+        Passes ``chunks`` through while writing them to the snapshot, and stores the
+        snapshot hash once the stream is exhausted.
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        if self.state_path.is_file():
+            # invalidate the previous state until the new snapshot is complete
+            self.state_path.unlink()
+
+        hasher = hashlib.blake2b(digest_size=DIGEST_SIZE)
+        with open(self.snapshot_path, "wb") as f:
+            for chunk in chunks:
+                hasher.update(chunk)
+                f.write(chunk)
+                yield chunk
+
+        self.save_state({"have": hasher.hexdigest()})
+
+    def load_snapshot(self) -> dict:
+        with open(self.snapshot_path, "rb") as f:
+            return json.load(f)
+
+    def iter_snapshot(self, chunk_size: int = 1 << 20) -> Iterator[bytes]:
+        with open(self.snapshot_path, "rb") as f:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def patch_snapshot(self, chain: List[List[dict]]):
+        """
+        Applies a chain of JSON patches to the snapshot, streaming it one record at a
+        time instead of loading the whole document.
+
+        The patched records are written to one temporary file per package section,
+        which are then assembled into the new snapshot, so memory use only depends on
+        the size of the patches.
+        """
+        record_operations, other_operations = group_operations(chain)
+        others = {}
+        counts = dict.fromkeys(PACKAGE_SECTIONS, 0)
+
+        with tempfile.TemporaryDirectory(dir=self.root) as tmp_dir:
+            sections = {
+                section: open(Path(tmp_dir) / f"section-{i}.json", "w+")
+                for i, section in enumerate(PACKAGE_SECTIONS)
+            }
+            try:
+
+                def write_record(section, filename, record):
+                    if record is None:
+                        return
+                    f = sections[section]
+                    if counts[section]:
+                        f.write(",")
+                    f.write(f"{json.dumps(filename)}:{json.dumps(record)}")
+                    counts[section] += 1
+
+                records = iter_repodata_records(self.iter_snapshot(), others=others)
+                for section, filename, record in records:
+                    operations = record_operations.pop((section, filename), None)
+                    if operations:
+                        record = apply_record_operations(record, operations)
+                    write_record(section, filename, record)
+
+                # records added by the patches
+                for (section, filename), operations in record_operations.items():
+                    write_record(section, filename, apply_record_operations(None, operations))
+
+                apply_patch(others, other_operations)
+
+                tmp_path = self.snapshot_path.with_suffix(".tmp")
+                with open(tmp_path, "w") as out:
+                    out.write("{")
+                    for key, value in others.items():
+                        out.write(f"{json.dumps(key)}:{json.dumps(value)},")
+                    for i, (section, f) in enumerate(sections.items()):
+                        f.seek(0)
+                        out.write(f"{',' if i else ''}{json.dumps(section)}:{{")
+                        shutil.copyfileobj(f, out)
+                        out.write("}")
+                    out.write("}")
+            finally:
+                for f in sections.values():
+                    f.close()
+
+        os.replace(tmp_path, self.snapshot_path)
+
+    def load_seen(self) -> SeenIndex:
+        return SeenIndex.load(self.seen_path)
+
+
+def _fetch_jlap(arch: str, offset: int = 0, key: Optional[str] = None):
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    # range requests must not be answered from the response cache
+    with requests_cache.disabled():
+        response = requests.get(f"{arch}/repodata.jlap", headers=headers, timeout=60)
+
+    if offset and response.status_code == 206:
+        return parse_jlap(response.content, offset=offset, key=key)
+    if response.status_code == 200:
+        return parse_jlap(response.content)
+    raise JLAPError(f"Unexpected status code {response.status_code} for {response.url}")
+
+
+def update_from_jlap(state: RepodataState) -> bool:
+    """
+    Brings the local snapshot up to date by applying the ``repodata.jlap`` patches.
+
+    The snapshot is only rewritten when patches were applied, and is streamed either
+    way (see :meth:`RepodataState.patch_snapshot`).
+
+    Returns:
+        bool: Whether the snapshot is up to date. False when there is no usable snapshot
+        or the patches could not be applied (in which case a full download is needed).
+    """
+    local_state = state.load()
+    if not local_state.get("have"):
+        return False
+
+    try:
+        try:
+            jlap = _fetch_jlap(
+                state.arch, local_state.get("jlap_offset", 0), local_state.get("jlap_key")
+            )
+        except JLAPError:
+            if not local_state.get("jlap_offset"):
+                raise
+            # the remote file was trimmed or rotated since the last visit
+            jlap = _fetch_jlap(state.arch)
+
+        chain = patch_chain(local_state["have"], jlap)
+        if chain:
+            # invalidate the state until the patched snapshot is in place
+            state.state_path.unlink()
+            state.patch_snapshot(chain)
+            local_state = {"have": jlap.latest}
+            logger.debug(f"Applied {len(chain)} repodata patches")
+
+        local_state.update(jlap_offset=jlap.resume_offset, jlap_key=jlap.resume_key)
+        state.save_state(local_state)
+
+        logger.info(f"Updated {state.arch} from repodata.jlap")
+        return True
+    except (JLAPError, requests.RequestException, ValueError, KeyError, IndexError) as e:
+        logger.warning(f"Unable to update {state.arch} from repodata.jlap: {e}")
+        return False
+
+
+def fetch_arch_incremental(state: RepodataState):
+    """
+    Same as :func:`cfdb.harvest.upstream.fetch_arch`, but tries the ``.jlap`` patches
+    first and refreshes the local snapshot either way.
+    """
+    logger.info(f"Fetching {state.arch} (incremental)")
+
+    if update_from_jlap(state):
+        chunks = state.iter_snapshot()
+    else:
+        # stream the full repodata, recording it as the snapshot for the next run
+        chunks = state.record_snapshot(stream_repodata(state.arch))
+    yield from iter_artifacts(state.arch, iter_repodata_records(chunks))
+
+    logger.info(f"Peak RSS after fetching {state.arch}: {peak_rss_mb():.1f} MB")
+
+
+class IncrementalUpdate:
+    """
+    Tracks the URLs listed upstream during an incremental fetch, so that the seen
+    indexes are only advanced once ``diff()`` knows which artifacts are still pending.
+    """
+
+    def __init__(self):
+        self._listed: List[Tuple[RepodataState, array]] = []
+
+    def add(self, state: RepodataState, digests: array):
+        self._listed.append((state, digests))
+
+    def commit(self, pending_urls: Iterable[str]):
+        """
+        Marks every listed URL as seen, except for ``pending_urls`` (not yet harvested),
+        which will be reported again on the next run.
+        """
+        pending = {url_digest(url) for url in pending_urls}
+        for state, digests in self._listed:
+            seen = SeenIndex.from_digests(d for d in digests if d not in pending)
+            seen.save(state.seen_path)
+            logger.debug(f"Stored {len(seen)} seen artifacts for {state.arch}")
+
+
+def fetch_incremental(
+    state_dir: Path = None,
+) -> Tuple[Dict[str, Dict[str, UpstreamArtifact]], IncrementalUpdate]:
+    """
+    Fetches the upstream artifacts not listed in the seen indexes.
+
+    Returns:
+        tuple: The package URLs (same layout as :func:`cfdb.harvest.upstream.fetch`) and
+        the :class:`IncrementalUpdate` to commit once the diff is known.
+    """
+    if state_dir is None:
+        state_dir = default_state_dir()
+
+    package_urls = defaultdict(dict)
+    update = IncrementalUpdate()
+    for channel_arch in channel_list:
+        state = RepodataState(state_dir, channel_arch)
+        seen = state.load_seen()
+        listed = array("Q")
+        new_count = 0
+        for package_name, filename, artifact in fetch_arch_incremental(state):
+            digest = url_digest(artifact.url)
+            listed.append(digest)
+            if digest not in seen:
+                package_urls[package_name][filename] = artifact
+                new_count += 1
+
+        logger.info(f"{new_count} new artifacts in {channel_arch} since the last run")
+        update.add(state, listed)
+
+    return package_urls, update
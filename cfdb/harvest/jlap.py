@@ -0,0 +1,239 @@
+"""
+Support for incremental repodata updates through the ``repodata.jlap`` format.
+
+A ``.jlap`` file is a sequence of JSON lines: the first line is a hexadecimal
+initialization vector, followed by JSON Patch documents (``{"from", "to",
+"patch"}``), a metadata line (``{"url", "latest"}``) and a trailing checksum.
+Each line is chained to the previous one with a keyed BLAKE2b-256 hash, so a
+client can fetch only the bytes appended since its last visit and still verify
+the whole chain.
+"""
+
+import hashlib
+import json
+from logging import getLogger
+from collections import defaultdict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from cfdb.harvest.streaming import PACKAGE_SECTIONS
+
+logger = getLogger(__name__)
+
+DIGEST_SIZE = 32
+
+
+class JLAPError(Exception):
+    """Raised when a ``.jlap`` payload cannot be verified or applied."""
+
+
+class JLAPPatches(NamedTuple):
+    patches: List[Dict[str, Any]]
+    latest: str
+    # byte offset (in the remote file) of the metadata line, and the chained
+    # hash of the line right before it; both are needed to resume with a
+    # ``Range`` request on the next run
+    resume_offset: int
+    resume_key: str
+
+
+def keyed_hash(data: bytes, key: bytes) -> bytes:
+    return hashlib.blake2b(data, key=key, digest_size=DIGEST_SIZE).digest()
+
+
+def hash_repodata(content: bytes) -> str:
+    """BLAKE2b-256 hash of a ``repodata.json`` payload, as used by ``.jlap``."""
+    return hashlib.blake2b(content, digest_size=DIGEST_SIZE).hexdigest()
+
+
+def parse_jlap(content: bytes, offset: int = 0, key: Optional[str] = None) -> JLAPPatches:
+    """
+    Parses and verifies a (possibly partial) ``.jlap`` payload.
+
+    Args:
+        content (bytes): The payload, either the whole file or the bytes starting at ``offset``.
+        offset (int): Position of ``content`` in the remote file.
+        key (str, optional): Hex chained hash preceding ``content``. When omitted, the first
+            line of ``content`` is expected to be the initialization vector.
+
+    Returns:
+        JLAPPatches: The verified patches along with the metadata needed to resume.
+    """
+    lines = content.split(b"\n")
+    if lines and lines[-1] == b"":
+        lines.pop()
+
+    if len(lines) < 2:
+        raise JLAPError("Incomplete .jlap payload")
+
+    position = offset
+    if key is None:
+        iv = lines.pop(0)
+        position += len(iv) + 1
+        key = iv.decode("ascii")
+
+    *body, checksum = lines
+    if not body:
+        raise JLAPError("Missing metadata line in .jlap payload")
+
+    running_key = bytes.fromhex(key)
+    line_keys = []
+    line_offsets = []
+    for line in body:
+        line_keys.append(running_key)
+        line_offsets.append(position)
+        running_key = keyed_hash(line, running_key)
+        position += len(line) + 1
+
+    if running_key.hex() != checksum.decode("ascii").strip():
+        raise JLAPError("Checksum mismatch in .jlap payload")
+
+    metadata = json.loads(body[-1])
+    patches = [json.loads(line) for line in body[:-1]]
+
+    return JLAPPatches(
+        patches=patches,
+        latest=metadata["latest"],
+        resume_offset=line_offsets[-1],
+        resume_key=line_keys[-1].hex(),
+    )
+
+
+def _unescape(token: str) -> str:
+    return token.replace("~1", "/").replace("~0", "~")
+
+
+def _walk(document, pointer: str):
+    tokens = [_unescape(t) for t in pointer.split("/")[1:]]
+    if not tokens:
+        raise JLAPError("Patching the document root is not supported")
+    parent = document
+    for token in tokens[:-1]:
+        parent = parent[int(token)] if isinstance(parent, list) else parent[token]
+    return parent, tokens[-1]
+
+
+def apply_patch(document: Dict[str, Any], patch: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Applies a JSON Patch (RFC 6902) to ``document`` in place.
+
+    Only the ``add``, ``remove`` and ``replace`` operations are emitted by the
+    repodata patch generator, anything else raises :class:`JLAPError` so the
+    caller can fall back to a full download.
+    """
+    for operation in patch:
+        op = operation["op"]
+        parent, token = _walk(document, operation["path"])
+
+        if op in ("add", "replace"):
+            value = operation["value"]
+            if isinstance(parent, list):
+                if token == "-":
+                    parent.append(value)
+                elif op == "add":
+                    parent.insert(int(token), value)
+                else:
+                    parent[int(token)] = value
+            else:
+                parent[token] = value
+        elif op == "remove":
+            if isinstance(parent, list):
+                del parent[int(token)]
+            else:
+                del parent[token]
+        else:
+            raise JLAPError(f"Unsupported JSON Patch operation '{op}'")
+
+    return document
+
+
+def patch_chain(have: str, jlap: JLAPPatches) -> List[List[Dict[str, Any]]]:
+    """
+    Returns the chain of patches leading from ``have`` to ``jlap.latest``, in order.
+
+    Raises:
+        JLAPError: If there is no chain of patches starting at ``have``.
+    """
+    by_origin = {patch["from"]: patch for patch in jlap.patches}
+    chain = []
+    while have != jlap.latest:
+        patch = by_origin.get(have)
+        if patch is None:
+            raise JLAPError(f"No patch found starting from {have}")
+        chain.append(patch["patch"])
+        have = patch["to"]
+    return chain
+
+
+def apply_patches(repodata: Dict[str, Any], have: str, jlap: JLAPPatches) -> Dict[str, Any]:
+    """
+    Applies the chain of patches leading from ``have`` to ``jlap.latest``.
+
+    Raises:
+        JLAPError: If there is no chain of patches starting at ``have``.
+    """
+    chain = patch_chain(have, jlap)
+    for patch in chain:
+        apply_patch(repodata, patch)
+
+    logger.debug(f"Applied {len(chain)} repodata patches")
+    return repodata
+
+
+def group_operations(
+    chain: List[List[Dict[str, Any]]],
+) -> Tuple[Dict[Tuple[str, str], List[Dict[str, Any]]], List[Dict[str, Any]]]:
+    """
+    Splits a chain of patches into per-record operations and top-level operations, so
+    that they can be applied while streaming the repodata one record at a time.
+
+    Operations on different records are independent from each other, so only the
+    order of the operations on a given record has to be kept.
+
+    Returns:
+        tuple: The operations on package records, keyed by ``(section, filename)``
+        with paths relative to the record, and the remaining operations (on ``info``,
+        ``removed``, ...).
+    """
+    record_operations = defaultdict(list)
+    other_operations = []
+    for patch in chain:
+        for operation in patch:
+            tokens = operation["path"].split("/")[1:]
+            section = _unescape(tokens[0]) if tokens else ""
+            if section not in PACKAGE_SECTIONS:
+                other_operations.append(operation)
+                continue
+            if len(tokens) < 2:
+                raise JLAPError(f"Patching the whole '{section}' section is not supported")
+
+            relative = dict(operation, path="".join(f"/{t}" for t in tokens[2:]))
+            record_operations[(section, _unescape(tokens[1]))].append(relative)
+
+    return record_operations, other_operations
+
+
+def apply_record_operations(
+    record: Optional[Dict[str, Any]], operations: List[Dict[str, Any]]
+) -> Optional[Dict[str, Any]]:
+    """
+    Applies operations returned by :func:`group_operations` to a single record.
+
+    Args:
+        record (dict, optional): The record, None if it is not in the repodata yet.
+        operations (list): The operations, with paths relative to the record.
+
+    Returns:
+        dict: The patched record, or None if it was removed.
+    """
+    for operation in operations:
+        if operation["path"]:
+            if record is None:
+                raise JLAPError(f"Cannot patch a missing record at '{operation['path']}'")
+            apply_patch(record, [operation])
+        elif operation["op"] in ("add", "replace"):
+            record = operation["value"]
+        elif operation["op"] == "remove":
+            record = None
+        else:
+            raise JLAPError(f"Unsupported JSON Patch operation '{operation['op']}'")
+    return record
@@ -2,16 +2,29 @@ from collections import defaultdict
 from typing import Dict, Set
 
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import Session
 
-from cfdb.models.schema import Artifacts
+from cfdb.models.schema import Artifacts, ArtifactsBackfill
 
+from .store import ShardStore
 from .utils import recursive_ls
 
 
 def query_existing_artifacts(db_path):
-    with Session(create_engine(db_path)) as session:
-        artifacts = session.query(Artifacts.name, Artifacts.package_name).all()
+    # reuse the engine of the caller when given one
+    engine = db_path if isinstance(db_path, Engine) else create_engine(db_path)
+    with Session(engine) as session:
+        # bootstrapped artifacts whose files are not harvested yet are reported
+        # missing, so that the harvester backfills them
+        artifacts = (
+            session.query(Artifacts.name, Artifacts.package_name)
+            .outerjoin(
+                ArtifactsBackfill, ArtifactsBackfill.artifact_name == Artifacts.name
+            )
+            .filter(ArtifactsBackfill.artifact_name.is_(None))
+            .all()
+        )
 
     return artifacts
 
@@ -19,7 +32,11 @@ def query_existing_artifacts(db_path):
 def _group_existing_artifacts_by_package_name(artifacts):
     artifacts_by_package_name = defaultdict(list)
     for artifact in artifacts:
-        artifacts_by_package_name[artifact.package_name].append(artifact.name)
+        # artifact names are stored as '<arch>/<artifact>', while upstream
+        # filenames follow the jsonblob layout '<channel>/<arch>/<artifact>.json'
+        artifacts_by_package_name[artifact.package_name].append(
+            f"conda-forge/{artifact.name}.json"
+        )
 
     return artifacts_by_package_name
 
@@ -31,6 +48,9 @@ def fetch_db(db_path):
 
 
 def fetch_jsonblobs(path) -> Dict[str, Set[str]]:
+    if ShardStore.is_store(path):
+        return ShardStore(path).fetch_keys()
+
     existing_dict = defaultdict(set)
     for pak, path in recursive_ls(path):
         existing_dict[pak].add(path)
@@ -0,0 +1,237 @@
+"""
+Staged harvesting pipeline.
+
+``reap_package`` downloads, decompresses, parses and serializes an artifact on a
+single thread, so the CPU-bound steps of the 20 reaping threads contend for the
+GIL. The :class:`HarvestPipeline` splits the work into stages sized separately::
+
+    download (threads) -> harvest + serialize (processes) -> write (caller thread)
+
+Each artifact holds a slot from the moment its download is scheduled until it is
+written, so at most ``max_pending`` archives are held in memory and a slow stage
+throttles the ones upstream of it. The throughput of every stage is logged at the
+end of a run; a stage whose ``busy`` worker count is close to its number of
+workers is the one to grow.
+"""
+
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from logging import getLogger
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from cfdb import metrics
+from cfdb.harvest import yaml_loader
+from cfdb.harvest.harvester import (
+    DEFAULT_MAX_SCAN_MEMBERS,
+    harvest_task,
+    harvest_worker_init,
+    merge_scan_stats,
+)
+
+logger = getLogger(__name__)
+
+_DONE = object()
+
+
+class StageStats:
+    """Counters of a pipeline stage, updated from its workers."""
+
+    def __init__(self, name: str, workers: int):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.errors = 0
+        self.bytes = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, elapsed: float, nbytes: int = 0, error: bool = False):
+        with self._lock:
+            self.items += 1
+            self.errors += error
+            self.bytes += nbytes
+            self.busy += elapsed
+
+    def summary(self, wall: float) -> str:
+        wall = max(wall, 1e-9)
+        per_item = self.busy / self.items * 1000 if self.items else 0.0
+        return (
+            f"{self.name}: {self.items} items ({self.errors} failed), "
+            f"{self.items / wall:.1f} items/s, {self.bytes / 1024**2 / wall:.1f} MB/s, "
+            f"{per_item:.0f} ms/item, {self.busy / wall:.1f}/{self.workers} workers busy"
+        )
+
+
+class HarvestPipeline:
+    """
+    Downloads archives on threads, harvests them in a process pool, and hands the
+    harvested data over to ``write`` on the thread iterating over :meth:`run`.
+
+    Args:
+        fetch (Callable): Downloads the archive of a ``diff`` entry, returning its bytes.
+        write (Callable): Called as ``write(package_data, harvested_data, blob)``, returns
+            the data yielded by :meth:`run`.
+        download_workers (int): Number of download threads.
+        harvest_workers (int, optional): Number of harvesting processes, defaults to the
+            number of CPUs.
+        max_pending (int, optional): Maximum number of artifacts between their download
+            and their write.
+        lazy_yaml (bool): Whether to defer parsing the YAML members.
+        max_scan_members (int, optional): See :func:`cfdb.harvest.core.reap_package`.
+        serialize (bool): Whether the harvesting processes also serialize the JSON blobs.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[tuple], bytes],
+        write: Callable,
+        download_workers: int = 20,
+        harvest_workers: Optional[int] = None,
+        max_pending: Optional[int] = None,
+        lazy_yaml: bool = False,
+        max_scan_members: Optional[int] = DEFAULT_MAX_SCAN_MEMBERS,
+        serialize: bool = False,
+    ):
+        self.fetch = fetch
+        self.write = write
+        self.download_workers = download_workers
+        self.harvest_workers = harvest_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or download_workers + 2 * self.harvest_workers
+        self.lazy_yaml = lazy_yaml
+        self.max_scan_members = max_scan_members
+        self.serialize = serialize
+        self.stats: Dict[str, StageStats] = {
+            "download": StageStats("download", download_workers),
+            "harvest": StageStats("harvest", self.harvest_workers),
+            "write": StageStats("write", 1),
+        }
+
+    def _download(self, package_data):
+        start = time.perf_counter()
+        try:
+            content = self.fetch(package_data)
+        except Exception:
+            self.stats["download"].record(time.perf_counter() - start, error=True)
+            raise
+        self.stats["download"].record(time.perf_counter() - start, len(content))
+        return content
+
+    def _feed(self, packages, download_pool, harvest_pool, slots, results):
+        submitted = 0
+        try:
+            for package_data in packages:
+                slots.acquire()
+                submitted += 1
+                future = download_pool.submit(self._download, package_data)
+                future.add_done_callback(
+                    lambda f, p=package_data: self._on_downloaded(f, p, harvest_pool, results)
+                )
+        except Exception as e:
+            logger.exception(e)
+        finally:
+            results.put((_DONE, submitted, None))
+
+    def _on_downloaded(self, future, package_data, harvest_pool, results):
+        error = future.exception()
+        if error is not None:
+            results.put((package_data, None, error))
+            return
+
+        content = future.result()
+        try:
+            harvested = harvest_pool.submit(
+                harvest_task,
+                content,
+                os.path.basename(package_data[2]),
+                lazy_yaml=self.lazy_yaml,
+                max_scan_members=self.max_scan_members,
+                serialize=self.serialize,
+            )
+        except Exception as e:
+            results.put((package_data, None, e))
+            return
+        harvested.add_done_callback(
+            lambda f: self._on_harvested(f, package_data, len(content), results)
+        )
+
+    def _on_harvested(self, future, package_data, nbytes, results):
+        error = future.exception()
+        if error is not None:
+            # the time spent is unknown when the worker raised
+            self.stats["harvest"].record(0.0, nbytes, error=True)
+            results.put((package_data, None, error))
+            return
+
+        data, blob, outcomes, elapsed = future.result()
+        merge_scan_stats(outcomes)
+        self.stats["harvest"].record(elapsed, nbytes)
+        results.put((package_data, (data, blob), None))
+
+    def run(
+        self, packages: Iterable[Tuple[str, str, str]]
+    ) -> Iterator[Tuple[Tuple[str, str, str], Optional[dict], Optional[Exception]]]:
+        """
+        Harvests ``packages``, as returned by ``diff``.
+
+        Yields:
+            tuple: The package data, and either the value returned by ``write`` or the
+            error raised while downloading, harvesting or writing the artifact.
+        """
+        slots = threading.BoundedSemaphore(self.max_pending)
+        results = queue.Queue()
+        start = time.perf_counter()
+
+        context = multiprocessing.get_context("spawn")
+        with ThreadPoolExecutor(
+            max_workers=self.download_workers, thread_name_prefix="cfdb-download"
+        ) as download_pool, ProcessPoolExecutor(
+            max_workers=self.harvest_workers,
+            mp_context=context,
+            initializer=harvest_worker_init,
+            initargs=(yaml_loader.loader_name(),),
+        ) as harvest_pool:
+            feeder = threading.Thread(
+                target=self._feed,
+                args=(packages, download_pool, harvest_pool, slots, results),
+                name="cfdb-pipeline-feeder",
+                daemon=True,
+            )
+            feeder.start()
+
+            done, submitted = 0, None
+            while submitted is None or done < submitted:
+                package_data, harvested, error = results.get()
+                if package_data is _DONE:
+                    submitted = harvested
+                    continue
+
+                done += 1
+                written = None
+                if error is None:
+                    write_start = time.perf_counter()
+                    try:
+                        written = self.write(package_data, *harvested)
+                    except Exception as e:
+                        error = e
+                    self.stats["write"].record(
+                        time.perf_counter() - write_start, error=error is not None
+                    )
+                slots.release()
+                yield package_data, written, error
+
+            feeder.join()
+
+        self.log_stats(time.perf_counter() - start)
+
+    def log_stats(self, wall: float):
+        logger.info(f"Harvest pipeline ran for {wall:.1f}s")
+        for stage in self.stats.values():
+            logger.info(stage.summary(wall))
+            # the harvest stage runs in worker processes, out of reach of the registry
+            metrics.observe(f"harvest.pipeline.{stage.name}", stage.busy, stage.items)
+            metrics.incr(f"harvest.pipeline.{stage.name}.errors", stage.errors)
+            metrics.incr(f"harvest.pipeline.{stage.name}.bytes", stage.bytes)
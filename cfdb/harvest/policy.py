@@ -0,0 +1,123 @@
+"""
+Selection of the upstream artifacts to harvest.
+
+A full migration needs every artifact, but a bounded daily run should spend its
+budget on the most valuable ones. A :class:`HarvestPolicy` restricts the
+upstream listing before it is compared with the local artifacts, using the
+fields of the repodata records:
+
+- ``latest``: only the latest N versions of each package, per subdir,
+- ``since``: only the artifacts uploaded after a given time,
+- ``subdirs``: only some subdirs,
+
+and ranks the artifacts to reap, most recent uploads first.
+"""
+
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from cfdb.harvest.upstream import UpstreamArtifact
+from cfdb.harvest.versions import VersionOrder
+
+
+def _subdir(filename: str) -> str:
+    # filenames follow the jsonblob layout '<channel>/<subdir>/<artifact>.json'
+    return filename.split("/")[-2]
+
+
+def _timestamp_ms(timestamp: Optional[int]) -> int:
+    if not timestamp:
+        return 0
+    # a few old records are in seconds rather than milliseconds
+    return timestamp * 1000 if timestamp < 1e11 else timestamp
+
+
+class HarvestPolicy:
+    """
+    Args:
+        latest (int, optional): Number of versions to keep per package and subdir.
+        since (datetime, optional): Only keep the artifacts uploaded after this time
+            (naive datetimes are UTC). Artifacts without timestamp are dropped.
+        subdirs (Sequence[str], optional): Subdirs to keep, e.g. ``["linux-64", "noarch"]``.
+    """
+
+    def __init__(
+        self,
+        latest: Optional[int] = None,
+        since: Optional[datetime] = None,
+        subdirs: Optional[Sequence[str]] = None,
+    ):
+        self.latest = latest
+        self.since_ms = None
+        if since is not None:
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=timezone.utc)
+            self.since_ms = int(since.timestamp() * 1000)
+        self.subdirs = set(subdirs) if subdirs else None
+
+    @property
+    def is_restrictive(self) -> bool:
+        return bool(self.latest or self.since_ms is not None or self.subdirs)
+
+    def _keep(self, filename: str, artifact: UpstreamArtifact) -> bool:
+        if self.subdirs is not None and _subdir(filename) not in self.subdirs:
+            return False
+        if self.since_ms is not None and _timestamp_ms(artifact.timestamp) < self.since_ms:
+            return False
+        return True
+
+    def select(
+        self, upstream: Dict[str, Dict[str, UpstreamArtifact]]
+    ) -> Dict[str, Dict[str, UpstreamArtifact]]:
+        """
+        Restricts an upstream listing (as returned by :func:`cfdb.harvest.upstream.fetch`).
+        """
+        if not self.is_restrictive:
+            return upstream
+
+        selected = {}
+        for package, artifacts in upstream.items():
+            kept = {
+                filename: artifact
+                for filename, artifact in artifacts.items()
+                if self._keep(filename, artifact)
+            }
+            if self.latest:
+                kept = self._latest_versions(kept)
+            if kept:
+                selected[package] = kept
+        return selected
+
+    def _latest_versions(
+        self, artifacts: Dict[str, UpstreamArtifact]
+    ) -> Dict[str, UpstreamArtifact]:
+        versions = defaultdict(set)
+        for filename, artifact in artifacts.items():
+            versions[_subdir(filename)].add(str(artifact.version))
+
+        latest = {
+            subdir: set(sorted(subdir_versions, key=VersionOrder, reverse=True)[: self.latest])
+            for subdir, subdir_versions in versions.items()
+        }
+        return {
+            filename: artifact
+            for filename, artifact in artifacts.items()
+            if str(artifact.version) in latest[_subdir(filename)]
+        }
+
+    @staticmethod
+    def prioritize(packages: Iterable) -> List:
+        """
+        Orders the artifacts to reap (``PackageData`` tuples): most recent uploads first,
+        then the highest build numbers.
+        """
+        return sorted(
+            packages,
+            key=lambda p: (
+                _timestamp_ms(p.timestamp),
+                p.build_number or 0,
+                p.url,
+            ),
+            reverse=True,
+        )
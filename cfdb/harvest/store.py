@@ -0,0 +1,234 @@
+"""
+Sharded store for harvested artifacts.
+
+Writing one pretty-printed JSON file per artifact produces millions of small
+files. The :class:`ShardStore` groups the harvested records into a fixed number
+of append-only shards instead, each record being a zstd frame holding one JSON
+line. A sidecar index per shard gives random access to the records, and keeps
+the few fields needed to compare the store with the database (subdir, version
+and build number) without decompressing anything::
+
+    <root>/store.json         -- store format and number of shards
+    <root>/shard-042.jsonl.zst  -- concatenated zstd frames, one record each
+    <root>/shard-042.idx        -- package, key, offset, length, subdir, version, build_number
+
+Records are keyed by package name and by the relative path they would have in
+the jsonblob layout (``conda-forge/<arch>/<artifact>.json``), so both layouts can
+be used interchangeably. Re-harvesting an artifact appends a new record, the last
+one wins.
+"""
+
+import json
+import os
+import threading
+import zlib
+from collections import defaultdict
+from logging import getLogger
+from pathlib import Path
+from typing import Dict, Iterator, NamedTuple, Set, Tuple
+
+logger = getLogger(__name__)
+
+STORE_FORMAT = 1
+DEFAULT_NUM_SHARDS = 256
+
+
+def _zstd():
+    """Returns thread-safe ``(compress, decompress)`` functions from the available zstd bindings."""
+    try:
+        import zstandard
+    except ImportError:
+        pass
+    else:
+        # zstandard (de)compressors must not be shared between threads
+        local = threading.local()
+
+        def compress(data):
+            if not hasattr(local, "compressor"):
+                local.compressor = zstandard.ZstdCompressor(level=10)
+            return local.compressor.compress(data)
+
+        def decompress(data):
+            if not hasattr(local, "decompressor"):
+                local.decompressor = zstandard.ZstdDecompressor()
+            return local.decompressor.decompress(data)
+
+        return compress, decompress
+
+    try:
+        from compression import zstd
+    except ImportError:
+        from backports import zstd
+
+    return (lambda data: zstd.compress(data, level=10)), zstd.decompress
+
+
+class IndexEntry(NamedTuple):
+    package: str
+    key: str
+    offset: int
+    length: int
+    subdir: str
+    version: str
+    build_number: str
+
+
+class ShardStore:
+    """
+    Append-only, zstd-compressed store of harvested artifacts.
+
+    Args:
+        root (Path): Directory of the store, created if needed.
+        num_shards (int): Number of shards of a new store; existing stores keep theirs.
+    """
+
+    def __init__(self, root: Path, num_shards: int = DEFAULT_NUM_SHARDS):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+        meta_path = self.root / "store.json"
+        if meta_path.is_file():
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            if meta.get("format") != STORE_FORMAT:
+                raise ValueError(f"Unsupported store format in {meta_path}")
+            num_shards = meta["num_shards"]
+        else:
+            with open(meta_path, "w") as f:
+                json.dump({"format": STORE_FORMAT, "num_shards": num_shards}, f)
+
+        self.num_shards = num_shards
+        self._compress, self._decompress = _zstd()
+        self._locks = [threading.Lock() for _ in range(num_shards)]
+        self._indexes = {}
+
+    @staticmethod
+    def is_store(path: Path) -> bool:
+        return (Path(path) / "store.json").is_file()
+
+    def shard_for(self, package: str) -> int:
+        return zlib.crc32(package.encode("utf8")) % self.num_shards
+
+    def _data_path(self, shard: int) -> Path:
+        return self.root / f"shard-{shard:03d}.jsonl.zst"
+
+    def _index_path(self, shard: int) -> Path:
+        return self.root / f"shard-{shard:03d}.idx"
+
+    def put(self, package: str, key: str, record: dict):
+        """
+        Appends a harvested record to the shard of ``package``.
+
+        Args:
+            package (str): The package name.
+            key (str): The relative path of the artifact (``conda-forge/<arch>/<artifact>.json``).
+            record (dict): The harvested data.
+        """
+        payload = self._compress(
+            json.dumps(record, sort_keys=True).encode("utf8") + b"\n"
+        )
+        index = record.get("index", {})
+
+        shard = self.shard_for(package)
+        with self._locks[shard]:
+            with open(self._data_path(shard), "ab") as f:
+                offset = f.tell()
+                f.write(payload)
+
+            entry = IndexEntry(
+                package,
+                key,
+                offset,
+                len(payload),
+                str(index.get("subdir")),
+                str(index.get("version")),
+                str(index.get("build_number")),
+            )
+            line = ("\t".join(map(str, entry)) + "\n").encode("utf8")
+            with open(self._index_path(shard), "a+b") as f:
+                if f.seek(0, os.SEEK_END) and not self._ends_with_newline(f):
+                    # terminate a line left partial by an interrupted write, it is
+                    # skipped when loading the index
+                    line = b"\n" + line
+                # a single write of a complete line
+                f.write(line)
+
+            if shard in self._indexes:
+                self._indexes[shard][(package, key)] = entry
+
+    @staticmethod
+    def _ends_with_newline(f) -> bool:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+    def _load_index(self, shard: int) -> Dict[Tuple[str, str], IndexEntry]:
+        if shard not in self._indexes:
+            entries = {}
+            index_path = self._index_path(shard)
+            if index_path.is_file():
+                with open(index_path, "r", encoding="utf8", errors="replace") as f:
+                    for line in f:
+                        entry = self._parse_index_line(line)
+                        if entry is None:
+                            logger.warning(f"Skipping a malformed line of {index_path}")
+                            continue
+                        entries[(entry.package, entry.key)] = entry
+            self._indexes[shard] = entries
+        return self._indexes[shard]
+
+    @staticmethod
+    def _parse_index_line(line: str):
+        # lines cut short by a crash miss their newline or some of their fields
+        if not line.endswith("\n"):
+            return None
+        fields = line[:-1].split("\t")
+        if len(fields) != len(IndexEntry._fields):
+            return None
+        package, key, offset, length, *rest = fields
+        try:
+            return IndexEntry(package, key, int(offset), int(length), *rest)
+        except ValueError:
+            return None
+
+    def entries(self) -> Iterator[IndexEntry]:
+        """Iterates over the latest index entry of every stored artifact."""
+        for shard in range(self.num_shards):
+            with self._locks[shard]:
+                entries = list(self._load_index(shard).values())
+            yield from entries
+
+    def get(self, package: str, key: str) -> dict:
+        """
+        Reads a single record.
+
+        Raises:
+            KeyError: If the artifact is not stored.
+        """
+        shard = self.shard_for(package)
+        with self._locks[shard]:
+            entry = self._load_index(shard)[(package, key)]
+
+        with open(self._data_path(shard), "rb") as f:
+            f.seek(entry.offset)
+            payload = f.read(entry.length)
+        return json.loads(self._decompress(payload))
+
+    def iter_records(self) -> Iterator[Tuple[IndexEntry, dict]]:
+        """Iterates over every stored record, reading each shard sequentially."""
+        for shard in range(self.num_shards):
+            with self._locks[shard]:
+                entries = sorted(self._load_index(shard).values(), key=lambda e: e.offset)
+            if not entries:
+                continue
+            with open(self._data_path(shard), "rb") as f:
+                for entry in entries:
+                    f.seek(entry.offset)
+                    yield entry, json.loads(self._decompress(f.read(entry.length)))
+
+    def fetch_keys(self) -> Dict[str, Set[str]]:
+        """Same layout as :func:`cfdb.harvest.local.fetch_jsonblobs`."""
+        existing_dict = defaultdict(set)
+        for entry in self.entries():
+            existing_dict[entry.package].add(entry.key)
+        return existing_dict
+
@@ -0,0 +1,151 @@
+"""
+Low-memory parsing of ``repodata.json`` payloads.
+
+The repodata of the larger subdirs is several hundred MB once decompressed and
+several GB once loaded as Python objects. The helpers below decompress the
+payload chunk by chunk and walk the top-level JSON object incrementally, so
+that only a single package record is decoded at any given time.
+"""
+
+import bz2
+import codecs
+import json
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+PACKAGE_SECTIONS = ("packages", "packages.conda")
+
+_WHITESPACE = " \t\n\r"
+
+
+def iter_bz2_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """
+    Incrementally decompresses a (possibly multi-stream) bz2 payload.
+
+    Args:
+        chunks (Iterable[bytes]): The compressed payload, in chunks.
+
+    Yields:
+        bytes: The decompressed payload, in chunks.
+    """
+    decompressor = bz2.BZ2Decompressor()
+    for chunk in chunks:
+        while chunk:
+            data = decompressor.decompress(chunk)
+            if data:
+                yield data
+            if decompressor.eof:
+                chunk = decompressor.unused_data
+                decompressor = bz2.BZ2Decompressor()
+            else:
+                chunk = b""
+
+
+class _JSONReader:
+    """Pull-based reader decoding one JSON value at a time out of a stream of bytes."""
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, min_size: int = 1):
+        """Reads at least ``min_size`` more characters, dropping the consumed ones."""
+        pending = [self.buf[self.pos :]]
+        read = 0
+        while read < min_size and not self.eof:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self.eof = True
+                text = self._decoder.decode(b"", final=True)
+            else:
+                text = self._decoder.decode(chunk)
+            pending.append(text)
+            read += len(text)
+        self.buf = "".join(pending)
+        self.pos = 0
+
+    def peek(self) -> str:
+        """Returns the next non-whitespace character without consuming it."""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if self.eof:
+                return ""
+            self._fill()
+
+    def expect(self, char: str):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected '{char}' at position {self.pos}, found '{found}'")
+        self.pos += 1
+
+    def value(self) -> Any:
+        """Decodes the next JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            else:
+                # a value ending exactly at the end of the buffer may be a
+                # truncated number, make sure it is delimited before accepting it
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            # grow the buffer geometrically to keep large values linear
+            self._fill(min_size=max(len(self.buf) - self.pos, 1 << 16))
+
+
+def iter_repodata_records(
+    chunks: Iterable[bytes], others: Optional[Dict[str, Any]] = None
+) -> Iterator[Tuple[str, str, dict]]:
+    """
+    Iterates over the package records of a ``repodata.json`` payload without loading
+    the whole document.
+
+    Args:
+        chunks (Iterable[bytes]): The decompressed payload, in chunks.
+        others (dict, optional): Receives the other (small) top-level values, such as
+            ``info`` or ``removed``, which are dropped otherwise.
+
+    Yields:
+        tuple: A tuple containing the section ("packages" or "packages.conda"), the
+        artifact filename and its record.
+    """
+    reader = _JSONReader(chunks)
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+
+    while True:
+        key = reader.value()
+        reader.expect(":")
+        if key in PACKAGE_SECTIONS:
+            reader.expect("{")
+            if reader.peek() != "}":
+                while True:
+                    filename = reader.value()
+                    reader.expect(":")
+                    yield key, filename, reader.value()
+                    if reader.peek() != ",":
+                        break
+                    reader.expect(",")
+            reader.expect("}")
+        else:
+            # 'info', 'removed', 'repodata_version': small, kept only when asked for
+            value = reader.value()
+            if others is not None:
+                others[key] = value
+
+        if reader.peek() != ",":
+            break
+        reader.expect(",")
+
+    reader.expect("}")
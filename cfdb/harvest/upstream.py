@@ -1,13 +1,13 @@
-import bz2
-import io
-import json
-from collections import defaultdict
+from collections import Counter, defaultdict
 from logging import getLogger
-from typing import Dict
+from typing import Dict, Iterable, Iterator, NamedTuple, Optional, Tuple
 
 import requests
 import requests_cache
 
+from cfdb.harvest.streaming import iter_bz2_chunks, iter_repodata_records
+from cfdb.harvest.utils import peak_rss_mb
+
 logger = getLogger(__name__)
 
 channel_list = [
@@ -21,12 +21,108 @@ channel_list = [
 ]
 
 
-# Enable caching with requests_cache (when debugging)
-# Use a local SQLite database to store the cached responses
-# You can customize the cache name and expiration time as needed
-requests_cache.install_cache(
-    cache_name="arch_cache", expire_after=3600
-)  # Cache expires after 1 hour (3600 seconds)
+def install_response_cache():
+    """
+    Caches the responses of ``requests`` in a local SQLite database
+    (``arch_cache.sqlite``, when debugging), for an hour. Called when a harvest
+    starts rather than on import, so that importing the module has no side effect.
+    """
+    if not requests_cache.is_installed():
+        requests_cache.install_cache(cache_name="arch_cache", expire_after=3600)
+
+
+class UpstreamArtifact(NamedTuple):
+    """An artifact listed upstream, with the fields of its repodata record used to fetch and select it."""
+
+    url: str
+    sha256: Optional[str] = None
+    size: Optional[int] = None
+    version: Optional[str] = None
+    build_number: Optional[int] = None
+    #: upload time, in milliseconds since the epoch
+    timestamp: Optional[int] = None
+
+
+def stream_repodata(arch, chunk_size=1 << 20) -> Iterator[bytes]:
+    """
+    Streams the decompressed ``repodata.json`` of a channel/arch combination.
+
+    The compressed payload is never held in memory as a whole: it is decompressed
+    chunk by chunk while being downloaded.
+
+    Args:
+        arch (str): The channel/arch URL.
+        chunk_size (int): Size of the compressed chunks read from the response.
+
+    Yields:
+        bytes: The decompressed payload, in chunks.
+    """
+    url = f"{arch}/repodata.json.bz2"
+    # the response cache needs the whole body in memory, bypass it when streaming
+    with requests_cache.disabled():
+        with requests.get(url, stream=True, timeout=60 * 5) as response:
+            if response.status_code != 200:
+                logger.error(
+                    f"Failed to fetch {url}. Status code: {response.status_code}"
+                )
+                response.raise_for_status()
+
+            yield from iter_bz2_chunks(response.iter_content(chunk_size=chunk_size))
+
+
+def iter_artifacts(
+    arch, records: Iterable[Tuple[str, str, dict]]
+) -> Iterator[Tuple[str, str, UpstreamArtifact]]:
+    """
+    Maps repodata records to the artifacts to harvest.
+
+    Args:
+        arch (str): The channel/arch URL the records were fetched from.
+        records (Iterable[Tuple[str, str, dict]]): ``(section, filename, record)`` tuples.
+
+    Yields:
+        tuple: A tuple containing package name, file name, and the upstream artifact.
+    """
+    counts = Counter()
+    for section, p, v in records:
+        extension = ".conda" if section == "packages.conda" else ".tar.bz2"
+        counts[extension] += 1
+
+        package_url = f"{arch}/{p}"
+        file_name = package_url.replace("https://conda.anaconda.org/", "").replace(
+            extension, ".json"
+        )
+        yield v["name"], file_name, UpstreamArtifact(
+            package_url,
+            v.get("sha256"),
+            v.get("size"),
+            v.get("version"),
+            v.get("build_number"),
+            v.get("timestamp"),
+        )
+
+    # Display the number of .conda and .tar.bz2 artifacts found in the repodata
+    logger.info(f"Found {counts['.conda']} .conda artifacts")
+    logger.info(f"Found {counts['.tar.bz2']} .tar.bz2 artifacts")
+
+
+def iter_repodata(arch, repodata):
+    """
+    Iterates over the artifacts listed in an already parsed repodata.
+
+    Args:
+        arch (str): The channel/arch URL the repodata was fetched from.
+        repodata (dict): The parsed repodata.
+
+    Yields:
+        tuple: A tuple containing package name, file name, and the upstream artifact.
+    """
+    records = (
+        (section, p, v)
+        for section in ("packages.conda", "packages")
+        for p, v in repodata.get(section, {}).items()
+    )
+    yield from iter_artifacts(arch, records)
 
 
 def fetch_arch(arch):
@@ -37,42 +133,33 @@ def fetch_arch(arch):
         arch (str): The architecture for which to fetch the repository data.
 
     Yields:
-        tuple: A tuple containing package name, file name, and package URL.
+        tuple: A tuple containing package name, file name, and the upstream artifact.
     """
     # Generate a set of URLs to fetch for a channel/arch combo
     logger.info(f"Fetching {arch}")
 
-    # Fetch the repodata.json.bz2 file
-    url = f"{arch}/repodata.json.bz2"
-    response = requests.get(url)
-
-    if response.status_code != 200:
-        logger.error(f"Failed to fetch {url}. Status code: {response.status_code}")
+    yield from iter_artifacts(arch, iter_repodata_records(stream_repodata(arch)))
 
-    repodata = json.load(bz2.BZ2File(io.BytesIO(response.content)))
+    logger.info(f"Peak RSS after fetching {arch}: {peak_rss_mb():.1f} MB")
 
-    # Display the number of .conda and .tar.bz2 artifacts found in the repodata
-    conda_artifacts_count = len(repodata.get("packages.conda", []))
-    tar_bz2_artifacts_count = len(repodata.get("packages", []))
-
-    logger.info(f"Found {conda_artifacts_count} .conda artifacts")
-    logger.info(f"Found {tar_bz2_artifacts_count} .tar.bz2 artifacts")
 
-    for package_type in ["conda", "tar.bz2"]:
-        package_key = "packages.conda" if package_type == "conda" else "packages"
-        extension = ".conda" if package_type == "conda" else ".tar.bz2"
+def iter_channel_records(channels=channel_list) -> Iterator[Tuple[str, str, dict]]:
+    """
+    Streams the repodata records of every channel/arch combination.
 
-        for p, v in repodata[package_key].items():
-            package_url = f"{arch}/{p}"
-            file_name = package_url.replace("https://conda.anaconda.org/", "").replace(
-                extension, ".json"
-            )
-            yield v["name"], file_name, package_url
+    Yields:
+        tuple: A tuple containing the channel/arch URL, the file name of the artifact
+        and its repodata record.
+    """
+    for arch in channels:
+        logger.info(f"Fetching {arch}")
+        for _, filename, record in iter_repodata_records(stream_repodata(arch)):
+            yield arch, filename, record
 
 
-def fetch() -> Dict[str, Dict[str, str]]:
+def fetch() -> Dict[str, Dict[str, UpstreamArtifact]]:
     package_urls = defaultdict(dict)
     for channel_arch in channel_list:
-        for package_name, filename, url in fetch_arch(channel_arch):
-            package_urls[package_name][filename] = url
+        for package_name, filename, artifact in fetch_arch(channel_arch):
+            package_urls[package_name][filename] = artifact
     return package_urls
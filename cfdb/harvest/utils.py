@@ -3,6 +3,8 @@ import glob
 
 from xonsh.tools import expand_path
 
+from cfdb.metrics import peak_rss_mb  # noqa: F401
+
 
 def recursive_ls(root):
     """
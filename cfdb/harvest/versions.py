@@ -0,0 +1,155 @@
+"""
+Ordering of conda version strings.
+
+A port of the comparison rules of ``conda.models.version.VersionOrder``, so that
+the harvester can rank versions without depending on conda:
+
+- an optional epoch (``1!2.0``) and local version (``2.0+local``),
+- components split on ``.`` and ``_``, then into runs of digits and letters,
+- numbers are greater than strings, ``dev`` is lower and ``post`` greater than any
+  other string, and a component starting with letters gets an implicit leading 0,
+- missing components count as 0, so ``1.0 == 1.0.0`` and ``1.0a1 < 1.0``.
+
+:func:`sort_key` encodes the same order as a plain string, for databases to sort
+versions with an index.
+"""
+
+import re
+from functools import total_ordering
+from itertools import zip_longest
+from typing import List, Union
+
+_COMPONENT_RE = re.compile(r"([0-9]+|[^0-9]+)")
+
+Part = Union[int, float, str]
+
+
+def _split(version: str) -> List[List[Part]]:
+    components = []
+    for component in version.replace("_", ".").split("."):
+        parts: List[Part] = []
+        for token in _COMPONENT_RE.findall(component):
+            if token.isdigit():
+                parts.append(int(token))
+            elif token == "post":
+                parts.append(float("inf"))
+            elif token == "dev":
+                # upper case sorts before any lower case string
+                parts.append("DEV")
+            else:
+                parts.append(token)
+        if not parts or isinstance(parts[0], str):
+            parts.insert(0, 0)
+        components.append(parts)
+    return components
+
+
+def _less(left: List[List[Part]], right: List[List[Part]]) -> bool:
+    for c1, c2 in zip_longest(left, right, fillvalue=[]):
+        for p1, p2 in zip_longest(c1, c2, fillvalue=0):
+            if p1 == p2:
+                continue
+            if isinstance(p1, str) != isinstance(p2, str):
+                # strings sort before numbers
+                return isinstance(p1, str)
+            return p1 < p2
+    return False
+
+
+@total_ordering
+class VersionOrder:
+    """Comparable conda version, e.g. ``sorted(versions, key=VersionOrder)``."""
+
+    def __init__(self, version: str):
+        self.text = version
+        version = str(version).strip().lower()
+        epoch = "0"
+        if "!" in version:
+            epoch, version = version.split("!", 1)
+        local = ""
+        if "+" in version:
+            version, local = version.split("+", 1)
+
+        self.version = [[int(epoch) if epoch.isdigit() else 0]] + _split(version)
+        self.local = _split(local) if local else []
+
+    def __eq__(self, other):
+        return not self < other and not other < self
+
+    def __lt__(self, other):
+        if _less(self.version, other.version):
+            return True
+        if _less(other.version, self.version):
+            return False
+        return _less(self.local, other.local)
+
+    def __repr__(self):
+        return f"VersionOrder({self.text!r})"
+
+    def sort_key(self) -> str:
+        """See :func:`sort_key`."""
+        return _encode(self.version) + _encode(self.local)
+
+
+# Tags of the tokens of a sort key, in increasing order. Zeros and component ends
+# (which stand for the zeros padding the shorter side) all sort like 0, the next
+# non-zero part deciding against which side: they are tagged with its kind.
+(
+    _STRING,
+    _ZERO_BEFORE_STRING,
+    _END_BEFORE_STRING,
+    _END,
+    _END_BEFORE_NUMBER,
+    _ZERO_BEFORE_NUMBER,
+    _NUMBER,
+    _POST,
+) = "01234567"
+
+
+def _encode(components: List[List[Part]]) -> str:
+    # trailing zeros are the same as padding
+    components = [list(parts) for parts in components]
+    for parts in components:
+        while parts and parts[-1] == 0:
+            parts.pop()
+    while components and not components[-1]:
+        components.pop()
+
+    tokens = []
+    for parts in components:
+        for part in parts:
+            if isinstance(part, str):
+                tokens.append(_STRING + part + " ")
+            elif part == 0:
+                tokens.append(0)
+            elif part == float("inf"):
+                tokens.append(_POST)
+            else:
+                digits = str(part)
+                tokens.append(f"{_NUMBER}{len(digits):02d}{digits}")
+        tokens.append(None)
+
+    # tag the zeros and component ends with the kind of the next non-zero part
+    following = None
+    for i in range(len(tokens) - 1, -1, -1):
+        if tokens[i] is None:
+            tokens[i] = {None: _END, _STRING: _END_BEFORE_STRING}.get(
+                following, _END_BEFORE_NUMBER
+            )
+        elif tokens[i] == 0:
+            # a trailing zero was stripped, so a non-zero part follows in the component
+            tokens[i] = (
+                _ZERO_BEFORE_STRING if following == _STRING else _ZERO_BEFORE_NUMBER
+            )
+        else:
+            following = tokens[i][0]
+    return "".join(tokens) or _END
+
+
+def sort_key(version: str) -> str:
+    """
+    String key sorting versions like :class:`VersionOrder`, e.g. ``1.10`` after
+    ``1.9`` and ``1.0rc1`` before ``1.0``. Equal versions (``1.0`` and ``1.0.0``)
+    have the same key.
+    """
+    return VersionOrder(version).sort_key()
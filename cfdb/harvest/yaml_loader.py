@@ -0,0 +1,117 @@
+"""
+YAML loading used by the harvester.
+
+Two backends are available:
+
+- ``ruamel`` (default): ``ruamel.yaml``'s safe loader, which follows YAML 1.2.
+- ``libyaml``: PyYAML's C-accelerated ``CSafeLoader``, several times faster
+  than the pure Python loaders. Documents it cannot parse are handed over to
+  ruamel.
+
+libyaml is opt-in because it resolves plain scalars following YAML 1.1, so the
+harvested data differs from the one obtained with ruamel: ``yes``/``no`` and
+``on``/``off`` become booleans, ``010`` is an octal number (8) and ``1:20`` a
+sexagesimal one (80). Only use it when these differences do not matter.
+
+The backend is selected with the ``CFDB_YAML_LOADER`` environment variable (or
+:func:`configure`).
+"""
+
+import functools
+import os
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+LOADERS = ("ruamel", "libyaml")
+
+_loader_name = None
+
+
+# There are some meta.yaml files that were written weirdly and have some strange tag
+# information in them.  This is not parsable by safe loader, so we add some more
+# fallback loading
+def yaml_construct_fallback(loader, node):
+    return None
+
+
+FALLBACK_TAGS = (
+    "tag:yaml.org,2002:python/object/apply:builtins.getattr",
+    "tag:yaml.org,2002:python/object:__builtin__.instancemethod",
+)
+
+
+@functools.lru_cache(maxsize=None)
+def _ruamel():
+    # imported on first use, the CLI does not need it to start
+    import ruamel.yaml as ruamel_yaml
+
+    for tag in FALLBACK_TAGS:
+        ruamel_yaml.add_constructor(
+            tag,
+            yaml_construct_fallback,
+            constructor=ruamel_yaml.SafeConstructor,
+        )
+    return ruamel_yaml
+
+
+@functools.lru_cache(maxsize=None)
+def _libyaml():
+    try:
+        import yaml
+        from yaml import CSafeLoader
+    except ImportError:
+        return None
+
+    class HarvestLoader(CSafeLoader):
+        pass
+
+    for tag in FALLBACK_TAGS:
+        HarvestLoader.add_constructor(tag, yaml_construct_fallback)
+
+    return yaml, HarvestLoader
+
+
+def configure(loader: str = None):
+    """
+    Selects the YAML backend, defaults to the ``CFDB_YAML_LOADER`` environment variable.
+
+    Args:
+        loader (str): One of ``LOADERS``.
+    """
+    global _loader_name
+
+    if loader is None:
+        loader = os.environ.get("CFDB_YAML_LOADER", "ruamel")
+    if loader not in LOADERS:
+        raise ValueError(f"Unknown YAML loader '{loader}', expected one of {LOADERS}")
+    if loader == "libyaml" and _libyaml() is None:
+        raise ValueError("The libyaml loader requires PyYAML built with libyaml")
+
+    _loader_name = loader
+    logger.debug(f"Using the {loader} YAML loader")
+
+
+def loader_name() -> str:
+    if _loader_name is None:
+        configure()
+    return _loader_name
+
+
+def safe_load(stream):
+    """
+    Safely loads a YAML document (``str`` or ``bytes``) with the configured backend.
+
+    Raises:
+        ruamel.yaml.YAMLError: If the document cannot be parsed.
+    """
+    if loader_name() == "libyaml":
+        yaml, HarvestLoader = _libyaml()
+        try:
+            return yaml.load(stream, Loader=HarvestLoader)
+        except yaml.YAMLError:
+            # ruamel is more lenient with some documents, and raises the
+            # errors handled by the callers otherwise
+            pass
+
+    return _ruamel().safe_load(stream)
@@ -1,7 +1,11 @@
+import atexit
 import logging
 import os
+import queue
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
+from typing import List, Optional
 
 from rich.logging import RichHandler
 from rich.progress import (
@@ -14,15 +18,71 @@ from rich.progress import (
 )
 
 
+#: level of the log file (``CFDB_LOG_LEVEL``), e.g. ``INFO`` to drop the debug messages
+LOG_LEVEL_ENV = "CFDB_LOG_LEVEL"
+#: ``0`` to write the log file from the logging thread (``CFDB_LOG_ASYNC``)
+LOG_ASYNC_ENV = "CFDB_LOG_ASYNC"
+#: log one per-item message out of N (``CFDB_LOG_ITEMS_EVERY``)
+LOG_ITEMS_EVERY_ENV = "CFDB_LOG_ITEMS_EVERY"
+#: maximum number of per-item messages logged per loop and run, ``0`` to only log
+#: their count (``CFDB_LOG_ITEMS_LIMIT``)
+LOG_ITEMS_LIMIT_ENV = "CFDB_LOG_ITEMS_LIMIT"
+
+_listener: Optional[QueueListener] = None
+
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
+def _start_listener(queue_handler: QueueHandler, handlers: List[logging.Handler]):
+    global _listener
+    # a fresh queue, the one of the parent may be locked by its listener thread
+    queue_handler.queue = queue.SimpleQueue()
+    _listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def _restart_in_child(queue_handler: QueueHandler, handlers: List[logging.Handler]):
+    import multiprocessing.util
+
+    _start_listener(queue_handler, handlers)
+    # the worker processes exit without running the atexit hooks
+    multiprocessing.util.Finalize(None, stop_logging, exitpriority=1)
+
+
+def stop_logging():
+    """Writes the queued records and stops the logging thread, if any."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
 def initialize_logging(logging_dir: Path = None):
+    """
+    Logs the ``cfdb`` messages to the console (from INFO) and to a timestamped file
+    of ``logging_dir`` (``CFDB_LOGGING_DIR``, ``.logs`` by default).
+
+    The file is written by a background thread fed through a queue, so that the
+    loops logging per item do not wait for the disk; its level is read from
+    ``CFDB_LOG_LEVEL`` (``DEBUG`` by default) and ``CFDB_LOG_ASYNC=0`` writes it
+    synchronously.
+    """
     # use package name to affect all descendants
     logger = logging.getLogger('cfdb')  
-    logger.setLevel(logging.DEBUG)
 
     if logger.handlers:
         # The logger already has handlers attached to it
         return
         
+    file_level = logging.getLevelName(os.environ.get(LOG_LEVEL_ENV, "DEBUG").upper())
+    if not isinstance(file_level, int):
+        raise ValueError(f"Invalid {LOG_LEVEL_ENV}: {os.environ[LOG_LEVEL_ENV]}")
+    # the records below both levels are dropped before being created
+    logger.setLevel(min(file_level, logging.INFO))
+
     # Create a rich handler
     rich_handler = RichHandler()
     rich_handler.setLevel(logging.INFO)
@@ -39,15 +99,100 @@ def initialize_logging(logging_dir: Path = None):
     # Set the formatter for the file handler
     if logging_dir is None:
         logging_dir = os.environ.get('CFDB_LOGGING_DIR', Path.cwd() / '.logs')
+    logging_dir = Path(logging_dir)
     logging_dir.mkdir(parents=True, exist_ok=True)
     filename = f'{datetime.now().strftime("%Y-%m-%d_%H-%M-%S")}.log'
     file_handler = logging.FileHandler(filename=logging_dir / filename)
-    file_handler.setLevel(logging.DEBUG)
+    file_handler.setLevel(file_level)
     file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
+
+    if os.environ.get(LOG_ASYNC_ENV, "1") == "0":
+        logger.addHandler(file_handler)
+        return logger
+
+    queue_handler = QueueHandler(queue.SimpleQueue())
+    queue_handler.setLevel(file_level)
+    logger.addHandler(queue_handler)
+    _start_listener(queue_handler, [file_handler])
+    atexit.register(stop_logging)
+    if hasattr(os, "register_at_fork"):
+        # the listener thread is not inherited by the forked worker processes
+        os.register_at_fork(
+            after_in_child=lambda: _restart_in_child(queue_handler, [file_handler])
+        )
 
     return logger
 
+
+class ItemLog:
+    """
+    Sampled logging of the per-item messages of a loop.
+
+    Logs one message out of ``every`` (``CFDB_LOG_ITEMS_EVERY``, all of them by
+    default) and at most ``limit`` of them (``CFDB_LOG_ITEMS_LIMIT``, no limit by
+    default), the others being only counted. The messages use the lazy
+    ``%``-style formatting of :mod:`logging`, so that the skipped ones cost a
+    counter increment. :meth:`summary` (called on exit when used as a context
+    manager) logs the number of skipped messages at the end of the loop.
+
+    Example::
+
+        with ItemLog(logger, "Updating artifacts") as items:
+            for name in names:
+                items.log("Updating %s", name)
+
+    Args:
+        logger (logging.Logger): The logger of the messages.
+        name (str): Description of the loop, for the summary.
+        level (int): Level of the messages.
+        every (int): Log one message out of ``every``.
+        limit (int): Maximum number of logged messages, ``0`` to only count them.
+    """
+
+    def __init__(
+        self,
+        logger: logging.Logger,
+        name: str,
+        level: int = logging.DEBUG,
+        every: int = None,
+        limit: int = None,
+    ):
+        self.logger = logger
+        self.name = name
+        self.level = level
+        self.every = max(every or _env_int(LOG_ITEMS_EVERY_ENV) or 1, 1)
+        self.limit = _env_int(LOG_ITEMS_LIMIT_ENV) if limit is None else limit
+        self.count = 0
+        self.logged = 0
+
+    def log(self, msg: str, *args):
+        self.count += 1
+        if (self.count - 1) % self.every or (
+            self.limit is not None and self.logged >= self.limit
+        ):
+            return
+        if self.logger.isEnabledFor(self.level):
+            self.logged += 1
+            self.logger.log(self.level, msg, *args)
+
+    def summary(self):
+        """Logs the number of skipped messages, if any."""
+        if self.logged < self.count and self.logger.isEnabledFor(self.level):
+            self.logger.log(
+                self.level,
+                "%s: logged %d of %d messages",
+                self.name,
+                self.logged,
+                self.count,
+            )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.summary()
+
+
 #: progress bar columns for rich progress bar
 progressBar = Progress(
     TextColumn("[progress.description]{task.description}"),
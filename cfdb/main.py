@@ -1,10 +1,23 @@
+import sys
+import time
+from datetime import datetime
+from logging import getLogger
+from pathlib import Path
+from typing import List
+
 import typer
 from click import Context
 from typer.core import TyperGroup
 
-from cfdb.handler import CFDBHandler
-from cfdb.harvest.core import reap as reap_artifacts
-from cfdb.log import initialize_logging
+# the database, harvesting and logging stacks are imported by the commands using
+# them, so that `cfdb --help` stays fast and free of side effects
+from cfdb import metrics
+from cfdb.harvest import yaml_loader
+from cfdb.harvest.cache import DEFAULT_MAX_SIZE_GB, ArchiveCache
+from cfdb.harvest.harvester import DEFAULT_MAX_SCAN_MEMBERS
+from cfdb.harvest.store import ShardStore
+
+logger = getLogger(__name__)
 
 
 class OrderCommands(TyperGroup):
@@ -23,11 +36,118 @@ app = typer.Typer(
 )
 
 
+@app.callback()
+def _run_report(
+    ctx: typer.Context,
+    metrics_report: Path = typer.Option(
+        None,
+        "--metrics-report",
+        envvar="CFDB_METRICS_REPORT",
+        help="Write a JSON report of the run, with the timings and counts of its stages.",
+    ),
+    metrics_prometheus: Path = typer.Option(
+        None,
+        "--metrics-prometheus",
+        envvar="CFDB_METRICS_PROMETHEUS",
+        help="Also write the report as a Prometheus textfile (e.g. for the node exporter).",
+    ),
+    record_history: bool = typer.Option(
+        True,
+        "--run-history/--no-run-history",
+        envvar="CFDB_RUN_HISTORY",
+        help="Record the report of the runs of the update and harvest commands in the database.",
+    ),
+    sql_stats: bool = typer.Option(
+        False,
+        "--sql-stats",
+        envvar="CFDB_SQL_STATS",
+        help="Count the SQL statements, rows and time per query shape and calling function, flag the N+1 patterns and print the most expensive shapes at the end.",
+    ),
+    sql_stats_top: int = typer.Option(
+        15, "--sql-stats-top", help="Number of query shapes printed with --sql-stats."
+    ),
+    profile: bool = typer.Option(
+        False,
+        "--profile",
+        envvar="CFDB_PROFILE",
+        help="Profile the command with cProfile, worker threads and processes included, and print its hottest functions. The profile is written to CFDB_PROFILING_DIR (.profiles by default).",
+    ),
+    profile_memory: bool = typer.Option(
+        False,
+        "--profile-memory",
+        envvar="CFDB_PROFILE_MEMORY",
+        help="Trace the allocations of the command with tracemalloc, and print the lines holding the most memory.",
+    ),
+):
+    from cfdb.log import initialize_logging
+
+    initialize_logging()
+    started_at, start = metrics.utcnow(), time.perf_counter()
+    metrics.registry.reset()
+    stats = None
+    if sql_stats:
+        from cfdb import sqlstats
+
+        stats = sqlstats.enable()
+    profiler = None
+    if profile or profile_memory:
+        from cfdb import profiling
+
+        profiler = profiling.Profiler(
+            ctx.invoked_subcommand, cpu=profile, memory=profile_memory
+        )
+        profiler.start()
+
+    def finish():
+        # called while the exception of a failed command, if any, is propagating
+        error = sys.exc_info()[1]
+        failed = error is not None and getattr(error, "exit_code", 1) != 0
+        if profiler is not None:
+            typer.echo(profiler.stop(), err=True)
+        if stats is not None:
+            typer.echo(stats.format_table(top=sql_stats_top), err=True)
+            results = stats.results()
+            metrics.gauge("sql.statements", sum(result.statements for result in results))
+            metrics.gauge("sql.n_plus_one", sum(result.n_plus_one for result in results))
+        report = metrics.build_report(
+            ctx.invoked_subcommand,
+            "failed" if failed else "done",
+            started_at,
+            time.perf_counter() - start,
+        )
+        if metrics_report:
+            metrics.write_report(metrics_report, report)
+        if metrics_prometheus:
+            metrics.write_prometheus(metrics_prometheus, report)
+        # the queries and listings record nothing, and are left out of the history
+        if record_history and metrics.registry:
+            try:
+                from cfdb.handler import CFDBHandler
+
+                CFDBHandler().record_run(report)
+            except Exception:
+                logger.warning("Could not record the run in the history", exc_info=True)
+
+    ctx.call_on_close(finish)
+
+
 @app.command()
 def update_feedstock_outputs(
     path: str = typer.Option(
         ..., "--path", "-p", help="Path to the feedstock outputs directory."
-    )
+    ),
+    prune: bool = typer.Option(
+        False,
+        "--prune",
+        help="Delete the feedstock outputs whose file was removed, and the feedstocks "
+        "left without output.",
+    ),
+    vacuum: bool = typer.Option(
+        False,
+        "--vacuum",
+        help="Return the pages freed by the deletions to the file system at the end "
+        "(incremental VACUUM on SQLite).",
+    ),
 ):
     """
     Update the feedstock outputs in the database based on the local path to the feedstock outputs cloned from Conda Forge. Path to the feedstock outputs directory. The path should point to the 'outputs' folder inside the 'feedstock-outputs' root directory.
@@ -37,15 +157,30 @@ def update_feedstock_outputs(
         To update the feedstock outputs, use the following command:
         $ cfdb update_feedstock_outputs --path /path/to/feedstock-outputs/outputs
     """
+    from cfdb.handler import CFDBHandler
+
     db_handler = CFDBHandler()
-    db_handler.update_feedstock_outputs(path)
+    db_handler.update_feedstock_outputs(path, prune=prune)
+    if vacuum:
+        db_handler.vacuum()
 
 
 @app.command()
 def update_import_to_package_maps(
     path: str = typer.Option(
         ..., "--path", "-p", help="Path to the import to package maps directory."
-    )
+    ),
+    prune: bool = typer.Option(
+        False,
+        "--prune",
+        help="Delete the mappings of the files that were removed or modified.",
+    ),
+    vacuum: bool = typer.Option(
+        False,
+        "--vacuum",
+        help="Return the pages freed by the deletions to the file system at the end "
+        "(incremental VACUUM on SQLite).",
+    ),
 ):
     """
     Update the import to package maps in the database based on the local path to the
@@ -57,37 +192,454 @@ def update_import_to_package_maps(
         To update the import to package maps, use the following command:
         $ cfdb update_import_to_package_maps --path /path/to/libcfgraph/import_to_package_maps
     """
+    from cfdb.handler import CFDBHandler
+
     db_handler = CFDBHandler()
-    db_handler.update_import_to_package_maps(path)
+    db_handler.update_import_to_package_maps(path, prune=prune)
+    if vacuum:
+        db_handler.vacuum()
 
 
 @app.command()
 def update_artifacts(
     path: str = typer.Option(
         ..., "--path", "-p", help="Path to the artifacts directory."
-    )
+    ),
+    resume: bool = typer.Option(
+        True,
+        "--resume/--no-resume",
+        help="Resume the interrupted run on the same path from its checkpoint, "
+        "without traversing and comparing the files again.",
+    ),
+    prune: bool = typer.Option(
+        False,
+        "--prune",
+        help="Delete the artifacts whose file was removed, with their dependencies and "
+        "orphaned file paths. Only for a complete artifacts directory: the artifacts "
+        "ingested by the harvest are not in it.",
+    ),
+    vacuum: bool = typer.Option(
+        False,
+        "--vacuum",
+        help="Return the pages freed by the deletions to the file system at the end "
+        "(incremental VACUUM on SQLite).",
+    ),
 ):
     """
     Update the artifacts in the database.
     """
+    from cfdb.handler import CFDBHandler
+
     db_handler = CFDBHandler()
-    db_handler.update_artifacts(path)
+    db_handler.update_artifacts(path, resume=resume, prune=prune)
+    if vacuum:
+        db_handler.vacuum()
+
+
+def _open_sharded_store(path: str, param_hint: str = "--path") -> ShardStore:
+    """
+    Opens the sharded store at ``path``, so that the upstream artifacts are compared
+    with the store the harvested data is written to.
+    """
+    store_path = Path(path)
+    if "://" in path or store_path.is_file():
+        raise typer.BadParameter(
+            "expected a sharded store directory",
+            param_hint=param_hint,
+        )
+    if (
+        store_path.is_dir()
+        and any(store_path.iterdir())
+        and not ShardStore.is_store(store_path)
+    ):
+        raise typer.BadParameter(
+            f"'{path}' is neither a sharded store nor an empty directory",
+            param_hint=param_hint,
+        )
+    return ShardStore(store_path)
+
+
+@app.command()
+def bootstrap_artifacts(
+    subdirs: List[str] = typer.Option(
+        None,
+        "--subdir",
+        help="Only bootstrap this subdir (e.g. linux-64), can be repeated.",
+    ),
+):
+    """
+    Fill the packages, artifacts and dependencies tables straight from the upstream
+    repodata, without downloading the archives. Their files are backfilled by
+    harvest-packages-and-artifacts --ingest, or update-artifacts.
+    """
+    from cfdb.handler import CFDBHandler
+
+    db_handler = CFDBHandler()
+    inserted = db_handler.bootstrap_artifacts(subdirs=subdirs)
+    typer.echo(f"Bootstrapped {inserted} artifacts")
 
 
 @app.command()
 def harvest_packages_and_artifacts(
     path: str = typer.Option(
         ..., "--path", "-p", help="Path to the artifacts directory or Database URL."
-    )
+    ),
+    incremental: bool = typer.Option(
+        False,
+        "--incremental",
+        help="Only compare the upstream artifacts published since the previous incremental run.",
+    ),
+    lazy_yaml: bool = typer.Option(
+        False,
+        "--lazy-yaml",
+        envvar="CFDB_HARVEST_LAZY_YAML",
+        help="Store the raw YAML of the recipes instead of parsing it while harvesting.",
+    ),
+    yaml_loader_name: str = typer.Option(
+        "ruamel",
+        "--yaml-loader",
+        envvar="CFDB_YAML_LOADER",
+        help="YAML backend used to parse recipes: 'ruamel' or 'libyaml' (faster, but resolves scalars following YAML 1.1, e.g. 'on' is a boolean).",
+    ),
+    sharded_store: bool = typer.Option(
+        False,
+        "--sharded-store",
+        envvar="CFDB_HARVEST_SHARDED_STORE",
+        help="Write the harvested data to the sharded store at --path (created if needed) instead of one JSON file per artifact.",
+    ),
+    ingest: bool = typer.Option(
+        False,
+        "--ingest",
+        help="Write the harvested artifacts, file paths and relations to the database as they are harvested. The upstream artifacts are then compared with the database rather than with --path.",
+    ),
+    write_blobs: bool = typer.Option(
+        True,
+        "--write-blobs/--no-write-blobs",
+        help="Whether to store the harvested data on disk (only meaningful with --ingest).",
+    ),
+    max_scan_members: int = typer.Option(
+        DEFAULT_MAX_SCAN_MEMBERS,
+        "--max-scan-members",
+        envvar="CFDB_HARVEST_MAX_SCAN_MEMBERS",
+        help="Maximum number of members read while looking for the info members of a .tar.bz2 archive listing its payload first (0 for no limit).",
+    ),
+    pipeline: bool = typer.Option(
+        False,
+        "--pipeline",
+        envvar="CFDB_HARVEST_PIPELINE",
+        help="Download on threads and harvest in a process pool, logging the throughput of each stage.",
+    ),
+    harvest_workers: int = typer.Option(
+        0,
+        "--harvest-workers",
+        envvar="CFDB_HARVEST_WORKERS",
+        help="Number of harvesting processes with --pipeline (0 for the number of CPUs).",
+    ),
+    archive_cache: str = typer.Option(
+        None,
+        "--archive-cache",
+        envvar="CFDB_ARCHIVE_CACHE",
+        help="Directory of a cache of the downloaded archives, keyed by their repodata sha256.",
+    ),
+    archive_cache_size_gb: float = typer.Option(
+        DEFAULT_MAX_SIZE_GB,
+        "--archive-cache-size-gb",
+        envvar="CFDB_ARCHIVE_CACHE_SIZE_GB",
+        help="Size above which the least recently used archives are evicted from the cache.",
+    ),
+    quarantine: bool = typer.Option(
+        False,
+        "--quarantine/--no-quarantine",
+        envvar="CFDB_HARVEST_QUARANTINE",
+        help="Record the failures in the database (CFDB_DB_PATH) and skip the artifacts failing repeatedly.",
+    ),
+    latest: int = typer.Option(
+        0,
+        "--latest",
+        envvar="CFDB_HARVEST_LATEST",
+        help="Only harvest the latest N versions of each package, per subdir (0 for all).",
+    ),
+    since: datetime = typer.Option(
+        None,
+        "--since",
+        envvar="CFDB_HARVEST_SINCE",
+        help="Only harvest the artifacts uploaded after this date (UTC).",
+    ),
+    subdirs: List[str] = typer.Option(
+        None,
+        "--subdir",
+        help="Only harvest this subdir (e.g. linux-64), can be repeated.",
+    ),
+    max_artifacts: int = typer.Option(
+        1000,
+        "--max-artifacts",
+        envvar="CFDB_HARVEST_MAX_ARTIFACTS",
+        help="Maximum number of artifacts reaped by the run, most recent uploads first (0 for no limit).",
+    ),
 ):
     """
     Harvest the packages and artifacts from the artifacts directory.
     """
-    reap_artifacts(path)
+    from cfdb.handler import CFDBHandler
+    from cfdb.harvest.core import reap as reap_artifacts
+    from cfdb.harvest.policy import HarvestPolicy
+
+    yaml_loader.configure(yaml_loader_name)
+    store = _open_sharded_store(path) if sharded_store else None
+    reap_kwargs = dict(
+        incremental=incremental,
+        lazy_yaml=lazy_yaml,
+        store=store,
+        max_scan_members=max_scan_members or None,
+        pipeline=pipeline,
+        harvest_workers=harvest_workers or None,
+        policy=HarvestPolicy(latest=latest or None, since=since, subdirs=subdirs),
+        max_artifacts=max_artifacts or None,
+    )
+    if archive_cache:
+        reap_kwargs["cache"] = ArchiveCache(
+            Path(archive_cache), max_bytes=int(archive_cache_size_gb * 1024**3)
+        )
+
+    db_handler = CFDBHandler() if ingest or quarantine else None
+    if quarantine:
+        reap_kwargs["failures"] = db_handler.failure_registry()
+
+    if ingest:
+        db_handler.harvest_artifacts(write_blobs=write_blobs, **reap_kwargs)
+    else:
+        reap_artifacts(path, **reap_kwargs)
+
+
+@app.command()
+def pipeline(
+    feedstock_outputs_path: str = typer.Option(
+        None,
+        "--feedstock-outputs",
+        envvar="CFDB_FEEDSTOCK_OUTPUTS_PATH",
+        help="Path to the feedstock outputs directory (the stage is skipped without it).",
+    ),
+    import_maps_path: str = typer.Option(
+        None,
+        "--import-maps",
+        envvar="CFDB_IMPORT_MAPS_PATH",
+        help="Path to the import to package maps directory (the stage is skipped without it).",
+    ),
+    artifacts_path: str = typer.Option(
+        None,
+        "--artifacts",
+        envvar="CFDB_ARTIFACTS_PATH",
+        help="Path to the harvested artifacts directory (the stage is skipped without it).",
+    ),
+    harvest: bool = typer.Option(
+        True, "--harvest/--no-harvest", help="Harvest the artifacts missing from the database."
+    ),
+    stages: List[str] = typer.Option(
+        None,
+        "--stage",
+        help="Only run this stage (feedstock-outputs, import-maps, harvest or artifacts), can be repeated.",
+    ),
+    max_workers: int = typer.Option(
+        0, "--max-workers", help="Maximum number of concurrent stages (0 for all)."
+    ),
+    incremental: bool = typer.Option(
+        False, "--incremental", help="See harvest-packages-and-artifacts."
+    ),
+    max_artifacts: int = typer.Option(
+        1000,
+        "--max-artifacts",
+        envvar="CFDB_HARVEST_MAX_ARTIFACTS",
+        help="See harvest-packages-and-artifacts.",
+    ),
+):
+    """
+    Run the updates in a single process, sharing the database engine, the package
+    names and the directory walks. Independent stages run concurrently (one writer
+    at a time), and a per-stage timing summary is printed at the end.
+    """
+    from cfdb.handler import CFDBHandler
+    from cfdb.stages import default_stages, format_summary, run_stages, select_stages
+
+    dag = default_stages(
+        feedstock_outputs_path=feedstock_outputs_path,
+        import_maps_path=import_maps_path,
+        artifacts_path=artifacts_path,
+        harvest=harvest,
+        incremental=incremental,
+        max_artifacts=max_artifacts or None,
+    )
+    if stages:
+        try:
+            dag = select_stages(dag, stages)
+        except ValueError as e:
+            raise typer.BadParameter(str(e), param_hint="--stage")
+
+    results = run_stages(dag, CFDBHandler(), max_workers=max_workers or None)
+    typer.echo(format_summary(results))
+    if any(result.status != "done" for result in results):
+        raise typer.Exit(1)
+
+
+@app.command()
+def list_reap_failures(
+    quarantined: bool = typer.Option(
+        False, "--quarantined", help="Only list the quarantined artifacts."
+    ),
+):
+    """
+    List the artifacts that could not be reaped, with their number of consecutive
+    failures and the last error.
+    """
+    from cfdb.handler import CFDBHandler
+
+    registry = CFDBHandler().failure_registry()
+    for failure in registry.list_failures(quarantined_only=quarantined):
+        status = "quarantined" if registry.is_quarantined(failure) else "retrying"
+        typer.echo(
+            f"{failure.url}\t{failure.attempts}\t{status}\t"
+            f"{failure.last_attempt:%Y-%m-%d %H:%M:%S}\t{failure.error_class}: {failure.message}"
+        )
+
+
+@app.command()
+def clear_reap_failures(
+    urls: List[str] = typer.Option(None, "--url", help="URL to clear, can be repeated."),
+    package: str = typer.Option(None, "--package", help="Clear the failures of a package."),
+    all_failures: bool = typer.Option(False, "--all", help="Clear every failure."),
+):
+    """
+    Remove artifacts from the failure registry, so that they are retried on the next run.
+    """
+    from cfdb.handler import CFDBHandler
+
+    if not (urls or package or all_failures):
+        raise typer.BadParameter("Pass --url, --package or --all")
+    removed = CFDBHandler().failure_registry().clear(urls=urls, package_name=package)
+    typer.echo(f"Cleared {removed} failures")
+
+
+@app.command()
+def reverse_dependencies(
+    package: str = typer.Option(..., "--package", help="Name of the dependency."),
+    platform: str = typer.Option("linux-64", "--platform", help="Platform, e.g. linux-64."),
+    transitive: bool = typer.Option(
+        False, "--transitive", help="Include the indirect reverse dependencies."
+    ),
+):
+    """
+    List the packages depending on a package (what to rebuild when it changes).
+    """
+    from cfdb.handler import CFDBHandler
+
+    for name in CFDBHandler().reverse_dependencies(package, platform, transitive=transitive):
+        typer.echo(name)
+
+
+@app.command()
+def latest_artifact(
+    package: str = typer.Option(..., "--package", help="Name of the package."),
+    platform: str = typer.Option("linux-64", "--platform", help="Platform, e.g. linux-64."),
+):
+    """
+    Show the latest artifact of a package on a platform.
+    """
+    from cfdb.handler import CFDBHandler
+
+    artifact = CFDBHandler().latest_artifact(package, platform)
+    if artifact is None:
+        typer.echo(f"No artifact of {package} on {platform}", err=True)
+        raise typer.Exit(1)
+    typer.echo(f"{artifact.artifact_name}\t{artifact.version}\t{artifact.build}")
+
+
+@app.command()
+def run_history(
+    command: str = typer.Option(None, "--command", help="Only list the runs of this command."),
+    limit: int = typer.Option(20, "--limit", help="Maximum number of runs."),
+    details: bool = typer.Option(
+        False, "--details", help="Print the full JSON reports, one per line."
+    ),
+):
+    """
+    List the past runs of the update and harvest commands, most recent first.
+    """
+    from cfdb.handler import CFDBHandler
+
+    for run in CFDBHandler().run_history(command=command, limit=limit):
+        if details:
+            typer.echo(run.report)
+        else:
+            typer.echo(
+                f"{run.started_at:%Y-%m-%d %H:%M:%S}\t{run.command}\t{run.status}\t"
+                f"{run.seconds:.1f}s"
+            )
+
+
+@app.command("harvest-local")
+def harvest_local_archives(
+    path: str = typer.Option(
+        ..., "--path", "-p", help="Directory of the .conda/.tar.bz2 archives, walked recursively."
+    ),
+    store_path: str = typer.Option(
+        None,
+        "--sharded-store",
+        envvar="CFDB_HARVEST_SHARDED_STORE_PATH",
+        help="Sharded store receiving the harvested data, instead of one JSON file per artifact under $CFDB_ARTIFACTS_PATH/artifacts.",
+    ),
+    manifest_path: str = typer.Option(
+        None,
+        "--manifest",
+        envvar="CFDB_LOCAL_MANIFEST",
+        help="Record of the harvested archives (defaults to .cfdb/local-archives.tsv).",
+    ),
+    channel: str = typer.Option(
+        "conda-forge", "--channel", help="Channel the archives belong to."
+    ),
+    read_workers: int = typer.Option(
+        4, "--read-workers", help="Number of threads reading the archives."
+    ),
+    harvest_workers: int = typer.Option(
+        0,
+        "--harvest-workers",
+        envvar="CFDB_HARVEST_WORKERS",
+        help="Number of harvesting processes (0 for the number of CPUs).",
+    ),
+    lazy_yaml: bool = typer.Option(
+        False,
+        "--lazy-yaml",
+        envvar="CFDB_HARVEST_LAZY_YAML",
+        help="Store the raw YAML of the recipes instead of parsing it while harvesting.",
+    ),
+    verify_checksum: bool = typer.Option(
+        False,
+        "--verify-checksum",
+        help="Also compare the sha256 of the archives already harvested before skipping them.",
+    ),
+):
+    """
+    Harvest local package archives (a mirror or a package cache) without downloading
+    anything. Archives already harvested, with the same file name and size, are skipped.
+    """
+    from cfdb.harvest.archives import ArchiveManifest, default_manifest_path, harvest_local
+
+    yaml_loader.configure()
+    store = _open_sharded_store(store_path, "--sharded-store") if store_path else None
+    manifest = ArchiveManifest(
+        Path(manifest_path) if manifest_path else default_manifest_path()
+    )
+    harvest_local(
+        Path(path),
+        store=store,
+        manifest=manifest,
+        channel=channel,
+        read_workers=read_workers,
+        harvest_workers=harvest_workers or None,
+        lazy_yaml=lazy_yaml,
+        verify_checksum=verify_checksum,
+    )
 
 
 def _main():
-    initialize_logging()
     app()
 
 
@@ -0,0 +1,212 @@
+"""
+Instrumentation of the update and harvest stages.
+
+The hot stages of :mod:`cfdb.populate` and :mod:`cfdb.harvest` record their
+timings and row counts in a process-wide :class:`Metrics` registry:
+
+- timers accumulate the seconds spent in a stage and the number of times it ran;
+- counters accumulate quantities (files hashed, rows inserted, bytes downloaded);
+- gauges hold the last value of a measure (artifacts left to reap, cache hits).
+
+At the end of a command, :func:`build_report` turns the registry into a run
+report, written as JSON (:func:`write_report`) and optionally as a Prometheus
+textfile (:func:`write_prometheus`), and recorded in the ``run_history`` table
+(:func:`record_run`) for trend analysis.
+
+Example::
+
+    from cfdb import metrics
+
+    with metrics.timer("populate.traverse"):
+        files = list_json_files(path)
+    metrics.incr("populate.traverse.files", len(files))
+"""
+
+import json
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging import getLogger
+from pathlib import Path
+from typing import Dict
+
+logger = getLogger(__name__)
+
+
+def peak_rss_mb() -> float:
+    """Returns the peak resident set size of the current process, in MB."""
+    try:
+        import resource
+    except ImportError:
+        # not available on Windows
+        return float("nan")
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in bytes on macOS and in kilobytes elsewhere
+    if sys.platform == "darwin":
+        return peak / 1024**2
+    return peak / 1024
+
+
+class Metrics:
+    """Thread-safe registry of timers, counters and gauges, keyed by dotted names."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters: Dict[str, float] = {}
+            self.gauges: Dict[str, float] = {}
+            # name -> [count, seconds]
+            self.timers: Dict[str, list] = {}
+
+    def incr(self, name: str, value: float = 1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name: str, value: float):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name: str, seconds: float, count: int = 1):
+        """Adds a duration measured elsewhere (e.g. in a worker process) to a timer."""
+        with self._lock:
+            timer = self.timers.setdefault(name, [0, 0.0])
+            timer[0] += count
+            timer[1] += seconds
+
+    @contextmanager
+    def timer(self, name: str):
+        """Times the enclosed block, also usable as a function decorator."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                "timers": {
+                    name: {"count": count, "seconds": round(seconds, 6)}
+                    for name, (count, seconds) in sorted(self.timers.items())
+                },
+                "counters": dict(sorted(self.counters.items())),
+                "gauges": dict(sorted(self.gauges.items())),
+            }
+
+    def __bool__(self):
+        with self._lock:
+            return bool(self.timers or self.counters or self.gauges)
+
+
+#: registry of the process
+registry = Metrics()
+
+incr = registry.incr
+gauge = registry.gauge
+observe = registry.observe
+timer = registry.timer
+
+
+def build_report(
+    command: str, status: str, started_at: datetime, seconds: float, metrics: Metrics = None
+) -> Dict:
+    """
+    Run report of a command.
+
+    Args:
+        command (str): Name of the command.
+        status (str): ``done`` or ``failed``.
+        started_at (datetime): Start of the run (UTC).
+        seconds (float): Duration of the run.
+        metrics (Metrics): The registry, the one of the process by default.
+    """
+    metrics = registry if metrics is None else metrics
+    return {
+        "command": command,
+        "status": status,
+        "started_at": started_at.isoformat(),
+        "seconds": round(seconds, 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        **metrics.snapshot(),
+    }
+
+
+def _write_atomic(path: Path, text: str):
+    # the Prometheus textfile collector may read the file while it is written
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(text)
+    os.replace(tmp, path)
+
+
+def write_report(path: Path, report: Dict):
+    """Writes a run report as JSON."""
+    _write_atomic(path, json.dumps(report, indent=2) + "\n")
+    logger.info(f"Wrote the run report to {path}")
+
+
+def _metric_name(name: str) -> str:
+    return "cfdb_" + re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def format_prometheus(report: Dict) -> str:
+    """Formats a run report in the Prometheus text exposition format."""
+    labels = f'{{command="{report["command"]}"}}'
+    lines = []
+
+    def add(name, kind, value):
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name}{labels} {value}")
+
+    add("cfdb_run_seconds", "gauge", report["seconds"])
+    add("cfdb_run_success", "gauge", int(report["status"] == "done"))
+    add(
+        "cfdb_run_timestamp_seconds",
+        "gauge",
+        datetime.fromisoformat(report["started_at"]).replace(tzinfo=timezone.utc).timestamp(),
+    )
+    add("cfdb_run_peak_rss_megabytes", "gauge", report["peak_rss_mb"])
+    for name, timer in report["timers"].items():
+        add(_metric_name(name) + "_seconds_total", "counter", timer["seconds"])
+        add(_metric_name(name) + "_calls_total", "counter", timer["count"])
+    for name, value in report["counters"].items():
+        add(_metric_name(name) + "_total", "counter", value)
+    for name, value in report["gauges"].items():
+        add(_metric_name(name), "gauge", value)
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path: Path, report: Dict):
+    """Writes a run report as a Prometheus textfile (for the node exporter collector)."""
+    _write_atomic(path, format_prometheus(report))
+    logger.info(f"Wrote the Prometheus metrics to {path}")
+
+
+def record_run(session, report: Dict):
+    """Adds a run report to the ``run_history`` table (committed by the caller)."""
+    # the instrumented modules import this one, keep SQLAlchemy out of `cfdb --help`
+    from cfdb.models.schema import RunHistory
+
+    session.add(
+        RunHistory(
+            command=report["command"],
+            status=report["status"],
+            started_at=datetime.fromisoformat(report["started_at"]),
+            seconds=report["seconds"],
+            report=json.dumps(report),
+        )
+    )
+
+
+def utcnow() -> datetime:
+    """The current time as a naive UTC datetime, as stored in the database."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
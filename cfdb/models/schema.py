@@ -2,6 +2,8 @@ import uuid
 
 from sqlalchemy import (
     Column,
+    DateTime,
+    Float,
     ForeignKey,
     Index,
     Integer,
@@ -101,6 +103,8 @@ class ImportToPackageMaps(Base):
     parent_package_name = Column(String, ForeignKey("packages.name"))
     partition = Column(String)
     hash = Column(String)
+    # file of the mapping, relative to the import maps directory
+    path = Column(String)
 
     def __repr__(self):
         return f"<ImportToPackageMaps(import_name={self.import_name}, parent_package={self.parent_package})>"
@@ -112,6 +116,7 @@ Index(
     ImportToPackageMaps.parent_package_name,
     unique=True,
 )
+Index("import_to_package_mapping_path_index", ImportToPackageMaps.path)
 
 # Example:
 #  "files": [
@@ -143,6 +148,9 @@ class ArtifactsFilePaths(Base):
     path = Column(String)
 
 
+Index("artifacts_file_paths_path_index", ArtifactsFilePaths.path)
+
+
 class RelationsMapFilePaths(Base):
     __tablename__ = "relations_map_file_paths"
     id = Column(Integer, FetchedValue(), primary_key=True, index=True)
@@ -150,6 +158,179 @@ class RelationsMapFilePaths(Base):
     artifact_name = Column(String, ForeignKey("artifacts.name"))
 
 
+# an artifact is linked once to a path, see cfdb.populate.file_paths
+Index(
+    "relations_map_file_paths_index",
+    RelationsMapFilePaths.artifact_name,
+    RelationsMapFilePaths.file_path_id,
+    unique=True,
+)
+
+
+class ArtifactDependencies(Base):
+    """
+    Dependencies of the artifacts, as listed in the ``depends`` and ``constrains``
+    fields of their index.
+
+    attributes:
+        id: int - primary key
+        artifact_name: str - foreign key to artifacts
+        kind: str - ``depends`` or ``constrains``
+        package_name: str(index) - name of the dependency
+        spec: str - full match spec (e.g. ``python >=3.9,<3.10.0a0``)
+    """
+
+    __tablename__ = "artifact_dependencies"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    artifact_name = Column(String, ForeignKey("artifacts.name"), index=True)
+    kind = Column(String, default="depends")
+    package_name = Column(String, index=True)
+    spec = Column(String)
+
+    def __repr__(self):
+        return f"<ArtifactDependency(artifact_name={self.artifact_name}, kind={self.kind}, spec={self.spec})>"
+
+
+class ReverseDependencies(Base):
+    """
+    Package-level reverse dependencies, derived from the ``depends`` of the artifacts,
+    see :mod:`cfdb.populate.dependencies`.
+
+    attributes:
+        package_name: str - primary key, the dependency
+        platform: str - primary key, platform of the dependent artifacts
+        dependent_name: str - primary key, package depending on ``package_name``
+    """
+
+    __tablename__ = "reverse_dependencies"
+    package_name = Column(String, primary_key=True)
+    platform = Column(String, primary_key=True)
+    dependent_name = Column(String, primary_key=True)
+
+    def __repr__(self):
+        return f"<ReverseDependency({self.dependent_name} -> {self.package_name} on {self.platform})>"
+
+
+class DependencyClosure(Base):
+    """
+    Transitive closure of :class:`ReverseDependencies` per platform, the ``noarch``
+    edges being part of the graph of every platform.
+
+    attributes:
+        package_name: str - primary key, the dependency
+        platform: str - primary key
+        dependent_name: str - primary key, package depending on ``package_name``,
+            directly or not
+    """
+
+    __tablename__ = "dependency_closure"
+    package_name = Column(String, primary_key=True)
+    platform = Column(String, primary_key=True)
+    dependent_name = Column(String, primary_key=True)
+
+
+Index(
+    "dependency_closure_dependent_index",
+    DependencyClosure.dependent_name,
+    DependencyClosure.platform,
+)
+
+
+class LatestArtifacts(Base):
+    """
+    Latest artifact of every package per platform, see :mod:`cfdb.populate.latest`.
+
+    attributes:
+        package_name: str - primary key
+        platform: str - primary key
+        artifact_name: str - foreign key to artifacts
+        version: str
+        build: str - build number
+        version_key: str - sortable key of the version, see
+            :func:`cfdb.harvest.versions.sort_key`
+    """
+
+    __tablename__ = "latest_artifacts"
+    package_name = Column(String, primary_key=True)
+    platform = Column(String, primary_key=True)
+    artifact_name = Column(String, ForeignKey("artifacts.name"))
+    version = Column(String)
+    build = Column(String)
+    version_key = Column(String)
+
+    def __repr__(self):
+        return f"<LatestArtifact(artifact_name={self.artifact_name})>"
+
+
+class ArtifactsBackfill(Base):
+    """
+    Artifacts bootstrapped from the repodata whose files are not harvested yet.
+
+    attributes:
+        artifact_name: str - primary key, foreign key to artifacts
+        url: str - URL of the archive
+    """
+
+    __tablename__ = "artifacts_backfill"
+    artifact_name = Column(String, ForeignKey("artifacts.name"), primary_key=True)
+    url = Column(String)
+
+    def __repr__(self):
+        return f"<ArtifactBackfill(artifact_name={self.artifact_name})>"
+
+
+class ReapFailures(Base):
+    """
+    Artifacts that could not be reaped, see :mod:`cfdb.harvest.failures`.
+
+    attributes:
+        url: str(index) - primary key
+        package_name: str
+        error_class: str - class of the last error
+        message: str - message of the last error
+        attempts: int - number of consecutive failures
+        first_attempt: datetime - first failure (UTC)
+        last_attempt: datetime - last failure (UTC)
+    """
+
+    __tablename__ = "reap_failures"
+    url = Column(String, primary_key=True, index=True)
+    package_name = Column(String)
+    error_class = Column(String)
+    message = Column(String)
+    attempts = Column(Integer, default=0)
+    first_attempt = Column(DateTime)
+    last_attempt = Column(DateTime)
+
+    def __repr__(self):
+        return f"<ReapFailure(url={self.url}, attempts={self.attempts})>"
+
+
+class RunHistory(Base):
+    """
+    Reports of the past runs of the commands, see :mod:`cfdb.metrics`.
+
+    attributes:
+        id: int - primary key
+        command: str(index) - name of the command
+        status: str - ``done`` or ``failed``
+        started_at: datetime(index) - start of the run (UTC)
+        seconds: float - duration of the run
+        report: str - the JSON run report, with the timers, counters and gauges
+    """
+
+    __tablename__ = "run_history"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    command = Column(String, index=True)
+    status = Column(String)
+    started_at = Column(DateTime, index=True)
+    seconds = Column(Float)
+    report = Column(String)
+
+    def __repr__(self):
+        return f"<RunHistory(command={self.command}, started_at={self.started_at})>"
+
+
 if __name__ == "__main__":
     from eralchemy2 import render_er
 
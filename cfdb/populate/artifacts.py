@@ -5,36 +5,46 @@ import logging
 
 from sqlalchemy.orm import Session
 
+from cfdb import metrics
+from cfdb.populate import dependencies, file_paths, latest, reconcile
+from cfdb.populate.checkpoint import Checkpoint
+from cfdb.populate.packages import PackageRegistry
 from cfdb.populate.utils import (
+    WalkCache,
     traverse_files,
 )
 from typing import List
-from cfdb.log import progressBar
+from cfdb.harvest.store import ShardStore
+from cfdb.log import ItemLog, progressBar
 from cfdb.models.schema import (
+    ArtifactDependencies,
     Artifacts,
-    Packages,
-    ArtifactsFilePaths,
-    uniq_id,
-    RelationsMapFilePaths,
+    ArtifactsBackfill,
 )
 
 logger = logging.getLogger(__name__)
 
 
+@metrics.timer("populate.artifacts.compare")
 def _compare_files(artifacts, stored_files_index, root_dir):
     """
     Retrieve filestem from path to identify the package name and 
     compare with the database. Also, loads the file using json to 
     retrieve the metadata about the version and build.
+
+    Returns:
+        Tuple[set, set]: The new or modified files, and the names of the database
+        artifacts whose file was removed.
     """
 
-    db_files = set()
+    # (file, package, platform, version, build) -> artifact name
+    db_files = {}
     stored_files_set = set()
 
     # Process the artifacts
     for row in artifacts:
         name, package_name, platform, version, build = row
-        db_files.add(
+        db_files[
             (
                 f"{root_dir}/{package_name}/conda-forge/{name}.json",
                 package_name,
@@ -42,7 +52,7 @@ def _compare_files(artifacts, stored_files_index, root_dir):
                 version,
                 build,
             )
-        )
+        ] = name
 
     # Process the stored files index
     for stored_file in stored_files_index:
@@ -55,13 +65,20 @@ def _compare_files(artifacts, stored_files_index, root_dir):
                     (file_path, package_name, platform, version, build)
                 )
 
-    changed_files = stored_files_set - db_files
+    changed_files = stored_files_set - db_files.keys()
+    # a modified file (new version or build) is changed, not removed
+    stored_paths = {stored[0] for stored in stored_files_set}
+    removed_artifacts = {
+        name for file, name in db_files.items() if file[0] not in stored_paths
+    }
 
     if changed_files:
         num_changed_files = len(changed_files)
         logger.info(f"Detected {num_changed_files} modified files.")
+    if removed_artifacts:
+        logger.info(f"Detected {len(removed_artifacts)} removed files.")
 
-    return changed_files
+    return changed_files, removed_artifacts
 
 
 def _update_artifacts_and_filepaths(
@@ -110,6 +127,37 @@ def _process_artifact_batches(batch_files: List[Path], tmp_file: Path):
         f.writelines(processed_data)
 
 
+def _process_store_index(store: ShardStore, root_dir: Path, tmp_file: Path):
+    """
+    Writes the same index as :func:`_process_artifact_batches` for the artifacts of a
+    sharded store. The fields are read from the store index, so no record is decompressed.
+
+    Returns:
+        List[Path]: A single-element list holding ``tmp_file``.
+    """
+    with open(tmp_file, "w") as f:
+        for entry in store.entries():
+            f.write(
+                f"{root_dir}/{entry.package}/{entry.key},{entry.package},"
+                f"{entry.subdir},{entry.version},{entry.build_number}\n"
+            )
+
+    return [tmp_file]
+
+
+def _load_artifact_contents(filepath: Path, root_dir: Path, store: ShardStore = None):
+    """
+    Loads the harvested data of an artifact from its JSON blob, or from ``store``
+    (where ``filepath`` is the path the blob would have in the jsonblob layout).
+    """
+    if store is not None:
+        package, key = Path(filepath).relative_to(root_dir).as_posix().split("/", 1)
+        return store.get(package, key)
+
+    with open(filepath, "r") as f:
+        return json.load(f)
+
+
 def group_tuples_by_package(tuples_list):
     """
     Group a list of tuples by the package_name and create a dictionary.
@@ -146,11 +194,16 @@ def group_tuples_by_package(tuples_list):
 
 
 def update_filepaths_table(
-    session: Session, artifact: Artifacts, filepath: Path, root_dir: Path
+    session: Session,
+    artifact: Artifacts,
+    filepath: Path,
+    root_dir: Path,
+    store: ShardStore = None,
+    artifact_contents: dict = None,
 ):
     # Retrieve associated filepaths already stored in the database
-    with open(filepath, "r") as f:
-        artifact_contents = json.load(f)
+    if artifact_contents is None:
+        artifact_contents = _load_artifact_contents(filepath, root_dir, store)
 
     # Retrieve associated path list
     files = artifact_contents.get("files", [])
@@ -158,116 +211,157 @@ def update_filepaths_table(
     if not files:
         return session
 
-    # Fetch all existing file paths in one query
-    existing_filepaths = {
-        fp.path for fp in session.query(ArtifactsFilePaths.path).all()
-    }
-
-    # Create a list to store new ArtifactsFilePaths objects
-    new_filepaths = []
-
-    for _filepath in files:
-        # Check if the file path is already stored in the database
-        if _filepath in existing_filepaths:
-            # "A filepath for {_filepath} already exists in the database, skipping insertion."
-            continue
-
-        # Create a new ArtifactsFilePaths object and add it to the list
-        new_filepaths.append(
-            ArtifactsFilePaths(
-                id=uniq_id(),
-                path=_filepath,
-            )
-        )
-
-    if new_filepaths:
-        # Batch insert new ArtifactsFilePaths objects
-        session.bulk_save_objects(new_filepaths)
-
-        # Create a list to store new RelationsMapFilePaths objects
-        new_relations = []
-
-        for db_filepath in new_filepaths:
-            # Create a new relation between the artifact and the filepath and add it to the list
-            new_relations.append(
-                RelationsMapFilePaths(
-                    file_path_id=db_filepath.id,
-                    artifact_name=artifact.name,
-                )
-            )
-
-        # Batch insert new RelationsMapFilePaths objects
-        session.bulk_save_objects(new_relations)
+    # link the artifact to all its files, including the paths already stored
+    file_paths.link_files(session, {artifact.name: files})
 
     return session
 
 
-def update(session: Session, path: Path):
+def _plan(session: Session, path: Path, store: ShardStore = None, walks: WalkCache = None):
     """
-    Updates all artifacts in the database based on the recent changes from the harvested data.
+    Diffs the harvested data at ``path`` with the database.
 
-    Args:
-        session (Session): The database session.
-        path (Path): The path to the directory containing the JSON files. From "harvesting".
+    Returns:
+        Tuple[dict, set]: The changed artifacts grouped by package (see
+        :func:`group_tuples_by_package`), and the names of the removed artifacts.
     """
     tmp_dir = Path(mkdtemp(suffix="_cfdb"))
     logger.info(
         "Querying database for Recent Artifacts..."
     )  # query artifacts whose last_update was under the cron range -- hum, need to think more about this...
-    artifacts = session.query(
-        Artifacts.name,
-        Artifacts.package_name,
-        Artifacts.platform,
-        Artifacts.version,
-        Artifacts.build,
-    ).all()
+    # artifacts bootstrapped from the repodata are left out, so that their files are
+    # backfilled from the harvested data
+    artifacts = (
+        session.query(
+            Artifacts.name,
+            Artifacts.package_name,
+            Artifacts.platform,
+            Artifacts.version,
+            Artifacts.build,
+        )
+        .outerjoin(ArtifactsBackfill, ArtifactsBackfill.artifact_name == Artifacts.name)
+        .filter(ArtifactsBackfill.artifact_name.is_(None))
+        .all()
+    )
 
     logger.info(f"Traversing files in {path}...")
     # detect number of JSON blobs locally available, 
     # and store related paths/hashes into batched index files named stored_files (list)
-    stored_files = traverse_files(
-        path, tmp_dir, process_function=_process_artifact_batches
-    )
+    if store is not None:
+        stored_files = _process_store_index(store, path, tmp_dir / "store_index.csv")
+    else:
+        stored_files = traverse_files(
+            path, tmp_dir, process_function=_process_artifact_batches, walks=walks
+        )
 
     logger.info("Comparing files...")
-    changed_files = _compare_files(artifacts, stored_files, root_dir=path)
-    _total_artifact_count = len(changed_files)
+    changed_files, removed_artifacts = _compare_files(
+        artifacts, stored_files, root_dir=path
+    )
+    metrics.incr("populate.artifacts.changed", len(changed_files))
+
+    return group_tuples_by_package(changed_files), removed_artifacts
+
+
+@metrics.timer("populate.artifacts")
+def update(
+    session: Session,
+    path: Path,
+    packages: PackageRegistry = None,
+    walks: WalkCache = None,
+    checkpoint_dir: Path = None,
+    resume: bool = True,
+    prune: bool = False,
+):
+    """
+    Updates all artifacts in the database based on the recent changes from the harvested data.
 
-    if _total_artifact_count == 0:
+    Args:
+        session (Session): The database session.
+        path (Path): The path to the directory containing the JSON files, or to a sharded
+            store. From "harvesting".
+        packages (PackageRegistry): Registry of the existing packages, shared with the
+            other updates of the run.
+        walks (WalkCache): Directory walks shared with the other updates of the run.
+        checkpoint_dir (Path): Directory of the checkpoints (see
+            :mod:`cfdb.populate.checkpoint`), None not to checkpoint the run.
+        resume (bool): Resume the interrupted run of the checkpoint, if any, rather
+            than diffing the harvested data again.
+        prune (bool): Delete the artifacts whose file was removed, along with their
+            rows in the other tables (see :mod:`cfdb.populate.reconcile`). Only for a
+            complete source: the artifacts ingested straight into the database are
+            not in it.
+    """
+    if packages is None:
+        packages = PackageRegistry()
+    store = ShardStore(path) if ShardStore.is_store(path) else None
+
+    checkpoint, resumed = None, None
+    if checkpoint_dir is not None:
+        checkpoint = Checkpoint(
+            checkpoint_dir, path, session.get_bind().url.render_as_string()
+        )
+        if resume:
+            resumed = checkpoint.load()
+        else:
+            checkpoint.clear()
+
+    if resumed is not None:
+        sorted_changed_files, completed = resumed
+        logger.info(
+            "Resuming run %s after its package %d/%d (%s)",
+            checkpoint.state["run_id"],
+            completed,
+            len(sorted_changed_files),
+            checkpoint.state["last_package"],
+        )
+        metrics.incr("populate.artifacts.resumed", completed)
+    else:
+        sorted_changed_files, removed_artifacts = _plan(session, path, store, walks)
+        completed = 0
+        if prune and removed_artifacts:
+            reconcile.remove_artifacts(session, removed_artifacts)
+            session.commit()
+
+    if not sorted_changed_files:
         logger.info("No changes detected. Exiting...")
+        if checkpoint is not None:
+            checkpoint.clear()
         return
 
     logger.info("Preparing update...")
-    sorted_changed_files = group_tuples_by_package(changed_files)
-    del changed_files
-
-    # Fetch all existing packages in one query
-    existing_packages = {pkg.name for pkg in session.query(Packages.name).all()}
-
-    with progressBar:
+    if resumed is None and checkpoint is not None:
+        checkpoint.start(sorted_changed_files)
+
+    new_artifacts = []
+    # the artifacts committed by the interrupted run are not in the graph yet
+    committed_artifacts = [
+        f"{platform}/{Path(file).stem}"
+        for values in list(sorted_changed_files.values())[:completed]
+        for file, platform, _, _ in values
+    ]
+
+    new_packages = packages.add_all(session, sorted_changed_files)
+    packages.flush(session)
+    logger.debug("Created %d packages", new_packages)
+
+    package_log = ItemLog(logger, "Updating artifacts", level=logging.INFO)
+    artifact_log = ItemLog(logger, "Updating artifact files")
+    with progressBar, metrics.timer("populate.artifacts.write"):
         for idx, (package_name, values) in enumerate(
             progressBar.track(
-                sequence=sorted_changed_files.items(),
+                sequence=list(sorted_changed_files.items())[completed:],
                 description="Updating artifacts...",
-            )
+            ),
+            start=completed,
         ):
-            if package_name not in existing_packages:
-                logger.debug(
-                    f"Package '{package_name}' not found in database. Proceeding to create it and its related artifacts."
-                )
-                package = Packages(
-                    name=package_name,
-                )
-                session.add(package)
-                existing_packages.add(package_name)
-
-            logger.info(f"Updating artifacts for {package_name}...")
+            package_log.log("Updating artifacts for %s...", package_name)
 
             for artifact_blob in values:
                 file, platform, version, build_number = artifact_blob
                 artifact_name = Path(file).stem
-                logger.debug(
-                    f"Updating {package_name} :: {platform} :: {artifact_name}"
+                artifact_log.log(
+                    "Updating %s :: %s :: %s", package_name, platform, artifact_name
                 )
 
                 # Check if the artifact already exists -- should only happen if the execution is interrupted
@@ -278,6 +372,7 @@ def update(session: Session, path: Path):
                     .first()
                 )
 
+                artifact_contents = _load_artifact_contents(Path(file), path, store)
                 if not artifact:
                     artifact = Artifacts(
                         name=artifact_key,
@@ -286,18 +381,45 @@ def update(session: Session, path: Path):
                         version=version,
                         build=build_number,
                     )
+                    new_artifacts.append(artifact_key)
+                    for row in dependencies.dependency_rows(
+                        artifact_key, artifact_contents.get("index", {})
+                    ):
+                        session.add(ArtifactDependencies(**row))
 
                 # Add the new artifact to the session
                 session.add(artifact)
 
-                update_filepaths_table(session, artifact, Path(file), path)
+                update_filepaths_table(
+                    session,
+                    artifact,
+                    Path(file),
+                    path,
+                    store,
+                    artifact_contents=artifact_contents,
+                )
+                session.query(ArtifactsBackfill).filter(
+                    ArtifactsBackfill.artifact_name == artifact_key
+                ).delete(synchronize_session=False)
 
             if idx % 10 == 0:
                 # Batch commit every 10 iterations
                 session.commit()
+                if checkpoint is not None:
+                    checkpoint.commit(idx + 1, package_name)
+
+    package_log.summary()
+    artifact_log.summary()
+
+    session.flush()
+    metrics.incr("db.artifacts.inserted", len(new_artifacts))
+    dependencies.update_graph(session, committed_artifacts + new_artifacts)
+    latest.refresh(session, sorted_changed_files)
 
     # Final commit after all iterations are complete
     session.commit()
+    if checkpoint is not None:
+        checkpoint.clear()
 
 
 if __name__ == "__main__":
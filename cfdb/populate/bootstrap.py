@@ -0,0 +1,125 @@
+"""
+Bootstrap of the artifacts tables from the channel repodata.
+
+The name, version, build number, subdir and dependencies of every artifact are
+already listed in ``repodata.json``, so the ``packages``, ``artifacts`` and
+``artifact_dependencies`` tables (and the reverse dependencies derived from them,
+see :mod:`cfdb.populate.dependencies`) can be filled for the whole channel without
+downloading a single archive. The bootstrapped artifacts are recorded in
+``artifacts_backfill`` until the harvester links their files.
+"""
+
+from logging import getLogger
+from typing import Iterable, List, Set, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from cfdb import metrics
+from cfdb.models.schema import (
+    ArtifactDependencies,
+    Artifacts,
+    ArtifactsBackfill,
+)
+from cfdb.populate import dependencies, latest
+from cfdb.populate.packages import PackageRegistry
+
+logger = getLogger(__name__)
+
+
+def artifact_name(subdir: str, filename: str) -> str:
+    """Name of an artifact in the ``artifacts`` table, e.g. ``linux-64/numpy-1.25.0-py39_0``."""
+    for extension in (".conda", ".tar.bz2"):
+        if filename.endswith(extension):
+            filename = filename[: -len(extension)]
+            break
+    return f"{subdir}/{filename}"
+
+
+def _write_batch(
+    session: Session,
+    batch: List[Tuple[str, str, dict]],
+    known: Set[str],
+    packages: PackageRegistry,
+):
+    artifacts, depends, backfill = [], [], []
+    for arch, filename, record in batch:
+        subdir = record.get("subdir") or arch.rstrip("/").rsplit("/", 1)[-1]
+        name = artifact_name(subdir, filename)
+        # the same artifact is usually listed as both .tar.bz2 and .conda
+        if name in known:
+            continue
+        known.add(name)
+
+        package_name = record["name"]
+        packages.add(session, package_name)
+
+        artifacts.append(
+            {
+                "name": name,
+                "package_name": package_name,
+                "platform": subdir,
+                "version": str(record.get("version")),
+                "build": str(record.get("build_number")),
+            }
+        )
+        backfill.append({"artifact_name": name, "url": f"{arch}/{filename}"})
+        depends.extend(dependencies.dependency_rows(name, record))
+
+    packages.flush(session)
+    # executemany inserts, without building an ORM object per row
+    for model, rows in (
+        (Artifacts, artifacts),
+        (ArtifactsBackfill, backfill),
+        (ArtifactDependencies, depends),
+    ):
+        if rows:
+            session.execute(insert(model), rows)
+
+    return artifacts
+
+
+@metrics.timer("populate.bootstrap")
+def update(
+    session: Session,
+    records: Iterable[Tuple[str, str, dict]],
+    batch_size: int = 5000,
+    packages: PackageRegistry = None,
+) -> int:
+    """
+    Inserts the artifacts listed in the repodata that are not in the database yet.
+
+    Args:
+        session (Session): The database session.
+        records (Iterable[Tuple[str, str, dict]]): ``(arch, filename, record)`` tuples,
+            where ``arch`` is the channel/arch URL and ``record`` the repodata record.
+        batch_size (int): Number of records per transaction.
+        packages (PackageRegistry): Registry of the existing packages.
+
+    Returns:
+        int: The number of inserted artifacts.
+    """
+    known = {name for (name,) in session.query(Artifacts.name)}
+    if packages is None:
+        packages = PackageRegistry()
+
+    inserted = []
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            inserted.extend(_write_batch(session, batch, known, packages))
+            session.commit()
+            logger.debug(f"Bootstrapped {len(inserted)} artifacts")
+            batch = []
+    if batch:
+        inserted.extend(_write_batch(session, batch, known, packages))
+        session.commit()
+
+    dependencies.update_graph(session, [artifact["name"] for artifact in inserted])
+    latest.refresh(session, {artifact["package_name"] for artifact in inserted})
+    session.commit()
+
+    metrics.incr("db.artifacts.inserted", len(inserted))
+    logger.info(f"Bootstrapped {len(inserted)} artifacts from the repodata")
+    return len(inserted)
@@ -0,0 +1,112 @@
+"""
+Checkpoints of the ``update-artifacts`` runs.
+
+The traversal and comparison of the harvested data are the bulk of a run that
+has few artifacts to write, so a run interrupted while writing (crash, CI
+timeout) saves its diff plan and the number of packages committed so far, and
+the next run on the same source and database resumes from there instead of
+walking and diffing everything again. Artifacts harvested in between are picked
+up by the run after.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from datetime import datetime
+from logging import getLogger
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+logger = getLogger(__name__)
+
+#: changed artifacts by package, as ``(path, platform, version, build)``
+Plan = Dict[str, List[Tuple[str, str, str, str]]]
+
+
+def default_checkpoint_dir() -> Path:
+    return Path(
+        os.environ.get("CFDB_CHECKPOINT_DIR", Path.cwd() / ".cfdb" / "checkpoints")
+    )
+
+
+class Checkpoint:
+    """
+    On-disk checkpoint of the runs of a source into a database::
+
+        <checkpoint_dir>/<digest>/plan.jsonl  -- the plan, one package per line in order
+        <checkpoint_dir>/<digest>/state.json  -- run id, source and packages committed
+
+    Args:
+        checkpoint_dir (Path): Directory of the checkpoints, see
+            :func:`default_checkpoint_dir`.
+        source (Path): The harvested data, directory or sharded store.
+        database (str): URL of the database.
+    """
+
+    def __init__(self, checkpoint_dir: Path, source: Path, database: str):
+        self.source = str(Path(source).resolve())
+        self.database = database
+        digest = hashlib.blake2b(
+            f"{database}\n{self.source}".encode("utf8"), digest_size=8
+        ).hexdigest()
+        self.root = Path(checkpoint_dir) / digest
+        self.plan_path = self.root / "plan.jsonl"
+        self.state_path = self.root / "state.json"
+        self.state: dict = {}
+
+    def load(self) -> Optional[Tuple[Plan, int]]:
+        """
+        The plan of an interrupted run and the number of its packages committed,
+        None if there is none.
+        """
+        if not self.state_path.is_file() or not self.plan_path.is_file():
+            return None
+        with open(self.state_path, "r") as f:
+            state = json.load(f)
+        if state.get("source") != self.source or state.get("database") != self.database:
+            return None
+
+        plan = {}
+        with open(self.plan_path, "r") as f:
+            for line in f:
+                package_name, values = json.loads(line)
+                plan[package_name] = [tuple(value) for value in values]
+        self.state = state
+        return plan, state["completed"]
+
+    def start(self, plan: Plan):
+        """Saves the plan of a new run."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.plan_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            for package_name, values in plan.items():
+                f.write(json.dumps([package_name, values]) + "\n")
+        os.replace(tmp_path, self.plan_path)
+        self.state = {
+            "run_id": uuid.uuid4().hex,
+            "source": self.source,
+            "database": self.database,
+            "started_at": datetime.now().isoformat(),
+            "packages": len(plan),
+            "completed": 0,
+            "last_package": None,
+        }
+        self._save_state()
+
+    def commit(self, completed: int, package_name: str):
+        """Records that the first ``completed`` packages of the plan are committed."""
+        self.state.update(completed=completed, last_package=package_name)
+        self._save_state()
+
+    def clear(self):
+        """Removes the checkpoint, once the run is over."""
+        shutil.rmtree(self.root, ignore_errors=True)
+        self.state = {}
+
+    def _save_state(self):
+        tmp_path = self.state_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.state_path)
@@ -0,0 +1,267 @@
+"""
+Dependency graph of the artifacts.
+
+The ``depends`` and ``constrains`` specs of every artifact are stored in
+``artifact_dependencies``. Two derived tables answer reverse-dependency queries
+without walking the specs:
+
+- ``reverse_dependencies`` holds the package-level edges (``dependent_name``
+  depends on ``package_name``) per platform;
+- ``dependency_closure`` holds their transitive closure per platform, where the
+  graph of a platform also includes the ``noarch`` edges.
+
+Both are extended incrementally when artifacts are added (:func:`update_graph`):
+a new edge ``B <- A`` connects every package ``B`` depends on, ``B`` included, to
+every package depending on ``A``, ``A`` included. Large batches of new edges
+(e.g. a bootstrap) rebuild the closure of their platform instead.
+"""
+
+import re
+from collections import defaultdict
+from logging import getLogger
+from typing import Dict, Iterable, List, Set, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from cfdb import metrics
+from cfdb.models.schema import (
+    ArtifactDependencies,
+    Artifacts,
+    DependencyClosure,
+    ReverseDependencies,
+)
+from cfdb.populate.utils import chunked
+
+logger = getLogger(__name__)
+
+DEPENDENCY_KINDS = ("depends", "constrains")
+
+#: number of new edges of a platform above which its closure is rebuilt from scratch
+REBUILD_THRESHOLD = 1000
+
+_SPEC_NAME = re.compile(r"[^\s<>=!~,\[]+")
+
+Edge = Tuple[str, str, str]  # (package_name, platform, dependent_name)
+
+
+def dependency_name(spec: str) -> str:
+    """Package name of a match spec, e.g. ``python`` for ``python >=3.9,<3.10.0a0``."""
+    match = _SPEC_NAME.match(spec.strip())
+    return match.group(0) if match else spec
+
+
+def dependency_rows(artifact_name: str, index: Dict) -> List[Dict]:
+    """
+    Rows of ``artifact_dependencies`` for an artifact.
+
+    Args:
+        artifact_name (str): Name of the artifact (``<subdir>/<artifact>``).
+        index (Dict): The repodata record or the ``index.json`` of the artifact.
+    """
+    return [
+        {
+            "artifact_name": artifact_name,
+            "kind": kind,
+            "package_name": dependency_name(spec),
+            "spec": spec,
+        }
+        for kind in DEPENDENCY_KINDS
+        for spec in index.get(kind) or []
+    ]
+
+
+def _insert(session: Session, model, rows: List[Dict], batch_size: int = 10000):
+    for i in range(0, len(rows), batch_size):
+        session.execute(insert(model), rows[i : i + batch_size])
+
+
+def _artifact_edges(session: Session, artifact_names: List[str]) -> Set[Edge]:
+    edges = set()
+    for chunk in chunked(artifact_names):
+        edges.update(
+            session.query(
+                ArtifactDependencies.package_name, Artifacts.platform, Artifacts.package_name
+            )
+            .join(Artifacts, Artifacts.name == ArtifactDependencies.artifact_name)
+            .filter(
+                ArtifactDependencies.artifact_name.in_(chunk),
+                ArtifactDependencies.kind == "depends",
+            )
+        )
+    return {edge for edge in edges if edge[0] != edge[2]}
+
+
+def _existing_edges(session: Session, edges: Set[Edge]) -> Set[Edge]:
+    existing = set()
+    for chunk in chunked(list({package for package, _, _ in edges})):
+        existing.update(
+            session.query(
+                ReverseDependencies.package_name,
+                ReverseDependencies.platform,
+                ReverseDependencies.dependent_name,
+            ).filter(ReverseDependencies.package_name.in_(chunk))
+        )
+    return existing
+
+
+@metrics.timer("populate.dependencies")
+def update_graph(session: Session, artifact_names: Iterable[str]) -> int:
+    """
+    Adds the reverse dependencies of newly inserted artifacts, and extends the
+    transitive closure accordingly.
+
+    Args:
+        session (Session): The database session (committed by the caller).
+        artifact_names (Iterable[str]): The new artifacts, whose dependencies are
+            already in ``artifact_dependencies``.
+
+    Returns:
+        int: The number of new package-level edges.
+    """
+    edges = _artifact_edges(session, list(artifact_names))
+    edges -= _existing_edges(session, edges)
+    if not edges:
+        return 0
+
+    _insert(
+        session,
+        ReverseDependencies,
+        [
+            {"package_name": package, "platform": platform, "dependent_name": dependent}
+            for package, platform, dependent in edges
+        ],
+    )
+
+    # noarch edges belong to the graph of every platform
+    platforms = {
+        platform for (platform,) in session.query(ReverseDependencies.platform).distinct()
+    }
+    edges_by_graph = defaultdict(list)
+    for package, platform, dependent in edges:
+        graphs = platforms if platform == "noarch" else {platform}
+        for graph in graphs:
+            edges_by_graph[graph].append((package, dependent))
+
+    for platform, graph_edges in edges_by_graph.items():
+        has_closure = (
+            session.query(DependencyClosure.platform)
+            .filter(DependencyClosure.platform == platform)
+            .first()
+        )
+        if not has_closure or len(graph_edges) > REBUILD_THRESHOLD:
+            rebuild_closure(session, platform)
+        else:
+            for package, dependent in graph_edges:
+                _extend_closure(session, platform, package, dependent)
+
+    metrics.incr("db.reverse_dependencies.inserted", len(edges))
+    logger.info(f"Added {len(edges)} reverse dependencies")
+    return len(edges)
+
+
+def _extend_closure(session: Session, platform: str, package: str, dependent: str):
+    # everything `package` depends on, and everything depending on `dependent`
+    dependencies = {package}
+    dependencies.update(
+        name
+        for (name,) in session.query(DependencyClosure.package_name).filter(
+            DependencyClosure.dependent_name == package,
+            DependencyClosure.platform == platform,
+        )
+    )
+    dependents = {dependent}
+    dependents.update(
+        name
+        for (name,) in session.query(DependencyClosure.dependent_name).filter(
+            DependencyClosure.package_name == dependent,
+            DependencyClosure.platform == platform,
+        )
+    )
+
+    existing = set()
+    for chunk in chunked(list(dependencies)):
+        existing.update(
+            session.query(DependencyClosure.package_name, DependencyClosure.dependent_name)
+            .filter(
+                DependencyClosure.package_name.in_(chunk),
+                DependencyClosure.platform == platform,
+            )
+        )
+
+    _insert(
+        session,
+        DependencyClosure,
+        [
+            {"package_name": name, "platform": platform, "dependent_name": other}
+            for name in dependencies
+            for other in dependents
+            if name != other and (name, other) not in existing
+        ],
+    )
+
+
+def rebuild_closure(session: Session, platform: str) -> int:
+    """
+    Recomputes the transitive closure of a platform from ``reverse_dependencies``.
+
+    Returns:
+        int: The number of rows of the closure.
+    """
+    graphs = ["noarch"] if platform == "noarch" else [platform, "noarch"]
+    dependents = defaultdict(set)
+    for package, dependent in session.query(
+        ReverseDependencies.package_name, ReverseDependencies.dependent_name
+    ).filter(ReverseDependencies.platform.in_(graphs)):
+        dependents[package].add(dependent)
+
+    session.query(DependencyClosure).filter(DependencyClosure.platform == platform).delete(
+        synchronize_session=False
+    )
+
+    rows = []
+    for package in dependents:
+        seen = set()
+        stack = [package]
+        while stack:
+            for dependent in dependents.get(stack.pop(), ()):
+                if dependent not in seen:
+                    seen.add(dependent)
+                    stack.append(dependent)
+        seen.discard(package)
+        rows.extend(
+            {"package_name": package, "platform": platform, "dependent_name": dependent}
+            for dependent in seen
+        )
+
+    _insert(session, DependencyClosure, rows)
+    logger.info(f"Rebuilt the dependency closure of {platform} ({len(rows)} rows)")
+    return len(rows)
+
+
+def reverse_dependencies(
+    session: Session, package_name: str, platform: str, transitive: bool = False
+) -> List[str]:
+    """
+    Packages depending on ``package_name`` on a platform (``noarch`` packages included).
+
+    Args:
+        session (Session): The database session.
+        package_name (str): The dependency.
+        platform (str): The platform, e.g. ``linux-64``.
+        transitive (bool): Whether to include the indirect reverse dependencies.
+
+    Returns:
+        List[str]: The sorted names of the dependent packages.
+    """
+    if transitive:
+        query = session.query(DependencyClosure.dependent_name).filter(
+            DependencyClosure.package_name == package_name,
+            DependencyClosure.platform == platform,
+        )
+    else:
+        query = session.query(ReverseDependencies.dependent_name).filter(
+            ReverseDependencies.package_name == package_name,
+            ReverseDependencies.platform.in_({platform, "noarch"}),
+        )
+    return sorted({name for (name,) in query})
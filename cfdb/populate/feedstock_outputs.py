@@ -5,9 +5,13 @@ from logging import getLogger
 
 from sqlalchemy.orm import Session
 
-from cfdb.log import progressBar
-from cfdb.models.schema import FeedstockOutputs, Feedstocks, Packages, uniq_id
+from cfdb import metrics
+from cfdb.log import ItemLog, progressBar
+from cfdb.models.schema import FeedstockOutputs, Feedstocks, uniq_id
+from cfdb.populate import reconcile
+from cfdb.populate.packages import PackageRegistry
 from cfdb.populate.utils import (
+    WalkCache,
     retrieve_associated_feedstock_from_output_blob,
     traverse_files,
 )
@@ -15,13 +19,14 @@ from cfdb.populate.utils import (
 logger = getLogger(__name__)
 
 
+@metrics.timer("populate.feedstock_outputs.compare")
 def _compare_files(
     feedstock_outputs: List[Tuple[str, str, int]],
     stored_files: List[Path],
     root_dir: Path,
-) -> Set[Path]:
+) -> Tuple[Set[Tuple[Path, str]], Set[str]]:
     """
-    Compares the feedstock outputs from the database with the stored files, and returns a set of files that were not present in the database or have changed hashes.
+    Compares the feedstock outputs from the database with the stored files, and returns a set of files that were not present in the database or have changed hashes, along with the paths of the database rows whose file was removed.
 
     Args:
         feedstock_outputs (List[Tuple[str, str, int]]): List of tuples containing the path, hash, and id of feedstock outputs from the database.
@@ -29,7 +34,7 @@ def _compare_files(
         root_dir (Path): The root directory of the stored files.
 
     Returns:
-        Set[Path]: A set of file paths (relative to root_dir) that were not present in the database or have changed hashes.
+        Tuple[Set[Tuple[Path, str]], Set[str]]: The (path relative to root_dir, hash) of the files that were not present in the database or have changed hashes, and the paths of the removed files.
     """
     db_files = {(Path(row[0]), row[1]) for row in feedstock_outputs}
     stored_files_set = set()
@@ -41,11 +46,16 @@ def _compare_files(
                 stored_files_set.add((Path(file_path).relative_to(root_dir), file_hash))
 
     changed_files = stored_files_set - db_files
+    removed_files = {path.as_posix() for path, _ in db_files} - {
+        path.as_posix() for path, _ in stored_files_set
+    }
 
     if len(changed_files) > 0:
         logger.info(f"Detected {len(changed_files)} modified files.")
+    if removed_files:
+        logger.info(f"Detected {len(removed_files)} removed files.")
 
-    return changed_files
+    return changed_files, removed_files
 
 
 def _update_feedstock_outputs(
@@ -78,7 +88,8 @@ def _update_feedstock_outputs(
 
     if not feedstock:
         logger.debug(
-            f"Feedstock [bold blue]{feedstock_name}[/] not found in database. Proceeding to create it and its feedstock output."
+            "Feedstock [bold blue]%s[/] not found in database. Proceeding to create it and its feedstock output.",
+            feedstock_name,
         )
         feedstock = Feedstocks(
             name=feedstock_name,
@@ -96,7 +107,8 @@ def _update_feedstock_outputs(
 
     if feedstock_output:
         logger.debug(
-            f"Feedstock [bold blue]{feedstock_name}[/] found in database. Proceeding to update its feedstock output."
+            "Feedstock [bold blue]%s[/] found in database. Proceeding to update its feedstock output.",
+            feedstock_name,
         )
         feedstock_output.hash = file_hash
         session.add(feedstock_output)
@@ -113,14 +125,28 @@ def _update_feedstock_outputs(
     return session
 
 
-def update(session: Session, path: Path):
+@metrics.timer("populate.feedstock_outputs")
+def update(
+    session: Session,
+    path: Path,
+    packages: PackageRegistry = None,
+    walks: WalkCache = None,
+    prune: bool = False,
+):
     """
     Updates feedstock outputs in the database based on the comparison between the stored data and the current data.
 
     Args:
         session (Session): The database session.
         path (Path): The path to the directory containing the JSON files.
+        packages (PackageRegistry): Registry of the existing packages, shared with the
+            other updates of the run.
+        walks (WalkCache): Directory walks shared with the other updates of the run.
+        prune (bool): Delete the feedstock outputs whose file was removed.
     """
+    if packages is None:
+        packages = PackageRegistry()
+
     logger.info("Updating feedstocks...")
     logger.debug("Creating temporary directory...")
     _tmp_dir = TemporaryDirectory()
@@ -132,16 +158,28 @@ def update(session: Session, path: Path):
     ).all()
 
     logger.info(f"Traversing files in {path}...")
-    stored_files = traverse_files(path, tmp_dir)
+    stored_files = traverse_files(path, tmp_dir, walks=walks)
 
     logger.info("Comparing files...")
-    changed_files = _compare_files(feedstock_outputs, stored_files, root_dir=path)
+    changed_files, removed_files = _compare_files(
+        feedstock_outputs, stored_files, root_dir=path
+    )
 
+    metrics.incr("populate.feedstock_outputs.changed", len(changed_files))
+    if prune and removed_files:
+        reconcile.remove_feedstock_outputs(session, removed_files)
+        session.commit()
     if len(changed_files) == 0:
         logger.info("No changes detected. Exiting...")
         return
 
-    with progressBar:
+    # the packages are named after the output files
+    new_packages = packages.add_all(session, (file.stem for file, _ in changed_files))
+    packages.flush(session)
+    logger.debug("Created %d packages", new_packages)
+
+    item_log = ItemLog(logger, "Updating feedstock outputs")
+    with progressBar, metrics.timer("populate.feedstock_outputs.write"), item_log:
         for idx, (file, file_hash) in enumerate(
             progressBar.track(changed_files, description="Updating feedstocks...")
         ):
@@ -149,30 +187,17 @@ def update(session: Session, path: Path):
             associated_feedstocks = retrieve_associated_feedstock_from_output_blob(
                 file=path / file  # Need to use the absolute path here
             )
-            logger.debug(
-                f"Associated package name: '{associated_package_name}' :: Associated feedstocks: '{associated_feedstocks}'"
+            item_log.log(
+                "Associated package name: '%s' :: Associated feedstocks: '%s'",
+                associated_package_name,
+                associated_feedstocks,
             )
-            package = (
-                session.query(Packages)
-                .filter(Packages.name == associated_package_name)
-                .first()
-            )
-
-            if not package:
-                logger.debug(
-                    f"Package '{associated_package_name}' not found in database. Proceeding to create it and its feedstock outputs."
-                )
-                package = Packages(
-                    name=associated_package_name,
-                )
-                session.add(package)
-
             for feedstock_name in associated_feedstocks:
                 session = _update_feedstock_outputs(
                     session=session,
                     file_rel_path=file,
                     file_hash=file_hash,
-                    package_name=package.name,
+                    package_name=associated_package_name,
                     feedstock_name=feedstock_name,
                 )
 
@@ -0,0 +1,122 @@
+"""
+Links between the artifacts and their file paths.
+
+Every distinct path is stored once in ``artifacts_file_paths`` and shared by the
+artifacts holding it (``bin/python``, ``info/licenses/LICENSE``...), through the
+``relations_map_file_paths`` many-to-many table. :func:`link_files` resolves
+every file of a batch of artifacts to its path id, the existing ones with a few
+``IN`` queries and the new ones with a single insert, and inserts the missing
+(artifact, path) links with another one. The unique index on the links makes the
+re-runs idempotent: the links already stored are skipped.
+"""
+
+from logging import getLogger
+from typing import Dict, Iterable, Tuple
+
+from sqlalchemy import delete, func, inspect, insert, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from cfdb import metrics
+from cfdb.models.schema import ArtifactsFilePaths, RelationsMapFilePaths, uniq_id
+from cfdb.populate.utils import chunked
+
+logger = getLogger(__name__)
+
+
+def resolve_paths(
+    session: Session, paths: Iterable[str]
+) -> Tuple[Dict[str, bytes], int]:
+    """
+    Ids of file paths, inserting the paths not stored yet.
+
+    Returns:
+        Tuple[Dict[str, bytes], int]: The id of every path, and the number of
+        inserted paths.
+    """
+    paths = sorted(set(paths))
+    path_ids = {}
+    for chunk in chunked(paths):
+        path_ids.update(
+            session.query(ArtifactsFilePaths.path, ArtifactsFilePaths.id).filter(
+                ArtifactsFilePaths.path.in_(chunk)
+            )
+        )
+
+    new_paths = [
+        {"id": uniq_id(), "path": path} for path in paths if path not in path_ids
+    ]
+    if new_paths:
+        session.execute(insert(ArtifactsFilePaths), new_paths)
+        path_ids.update((row["path"], row["id"]) for row in new_paths)
+    metrics.incr("db.file_paths.inserted", len(new_paths))
+    return path_ids, len(new_paths)
+
+
+@metrics.timer("populate.file_paths")
+def link_files(session: Session, files: Dict[str, Iterable[str]]) -> Tuple[int, int]:
+    """
+    Links artifacts to all their files, whether their paths are already stored
+    (and shared with other artifacts) or not.
+
+    Args:
+        session (Session): The database session (committed by the caller).
+        files (Dict[str, Iterable[str]]): The files of every artifact, by artifact
+            name.
+
+    Returns:
+        Tuple[int, int]: The number of inserted paths and links.
+    """
+    files = {name: set(paths) for name, paths in files.items()}
+    path_ids, new_paths = resolve_paths(
+        session, (path for paths in files.values() for path in paths)
+    )
+
+    links = set()
+    for chunk in chunked(sorted(files)):
+        links.update(
+            session.query(
+                RelationsMapFilePaths.artifact_name, RelationsMapFilePaths.file_path_id
+            ).filter(RelationsMapFilePaths.artifact_name.in_(chunk))
+        )
+
+    new_links = [
+        {"artifact_name": name, "file_path_id": path_ids[path]}
+        for name, paths in files.items()
+        for path in paths
+        if (name, path_ids[path]) not in links
+    ]
+    if new_links:
+        session.execute(insert(RelationsMapFilePaths), new_links)
+    metrics.incr("db.file_paths.linked", len(new_links))
+    return new_paths, len(new_links)
+
+
+def create_indexes(engine: Engine):
+    """
+    Creates the indexes of the file paths missing from a database created by an
+    earlier version, after dropping the duplicated links the unique index forbids.
+    """
+    indexes = {
+        index["name"]
+        for table in (ArtifactsFilePaths.__tablename__, RelationsMapFilePaths.__tablename__)
+        for index in inspect(engine).get_indexes(table)
+    }
+    for table in (ArtifactsFilePaths.__table__, RelationsMapFilePaths.__table__):
+        for index in table.indexes:
+            if index.name in indexes:
+                continue
+            with engine.begin() as conn:
+                if index.unique and table is RelationsMapFilePaths.__table__:
+                    first_links = select(func.min(RelationsMapFilePaths.id)).group_by(
+                        RelationsMapFilePaths.artifact_name,
+                        RelationsMapFilePaths.file_path_id,
+                    )
+                    deleted = conn.execute(
+                        delete(RelationsMapFilePaths).where(
+                            RelationsMapFilePaths.id.not_in(first_links)
+                        )
+                    ).rowcount
+                    logger.info(f"Dropped {deleted} duplicated file path links")
+                index.create(conn)
+            logger.info(f"Created the index {index.name}")
@@ -1,12 +1,21 @@
 from pathlib import Path
 from tempfile import TemporaryDirectory
-from typing import List, Set, Tuple
+from typing import List, Optional, Set, Tuple
 from logging import getLogger
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import Session
 
+from cfdb import metrics
 from cfdb.log import progressBar
-from cfdb.models.schema import ImportToPackageMaps, Packages, uniq_id
-from cfdb.populate.utils import traverse_files, retrieve_import_maps_from_output_blob
+from cfdb.models.schema import ImportToPackageMaps, uniq_id
+from cfdb.populate import reconcile
+from cfdb.populate.packages import PackageRegistry
+from cfdb.populate.utils import (
+    WalkCache,
+    traverse_files,
+    retrieve_import_maps_from_output_blob,
+)
 
 logger = getLogger(__name__)
 
@@ -22,13 +31,43 @@ def _decompose_filename(filename_handle: str):
     return package_name, partition
 
 
+def add_path_column(engine: Engine):
+    """
+    Adds the ``path`` column and its index to the mappings of a database created by
+    an earlier version. The mappings stored without their path are replaced by the
+    next update with ``prune``.
+    """
+    table = ImportToPackageMaps.__table__
+    columns = {column["name"] for column in inspect(engine).get_columns(table.name)}
+    if "path" in columns:
+        return
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN path VARCHAR"))
+        for index in table.indexes:
+            if index.columns.keys() == ["path"]:
+                index.create(conn)
+    logger.info(f"Added the path column to {table.name}")
+
+
+@metrics.timer("populate.import_maps.compare")
 def _compare_files(
-    feedstock_outputs: List[Tuple[str, str, int]],
+    import_maps: List[Tuple[Optional[str], str]],
     stored_files: List[Path],
     root_dir: Path,
-) -> Set[Path]:
-    # (package_name.partition, hash)
-    db_files = {(Path(f"{row[0]}.{row[1]}.json"), row[2]) for row in feedstock_outputs}
+) -> Tuple[Set[Tuple[Path, str]], Set[Optional[str]]]:
+    """
+    Compares the mappings of the database with the stored files, by (path, hash):
+    identical files are tracked separately, and a renamed file is both new and
+    removed.
+
+    Returns:
+        Tuple[Set[Tuple[Path, str]], Set[Optional[str]]]: The (path relative to
+        root_dir, hash) of the new or modified files, and the paths of the database
+        rows whose file was removed or modified (None for the rows stored without
+        their path).
+    """
+    # (path, hash)
+    db_files = set(import_maps)
     stored_files_set = set()
 
     for stored_file in stored_files:
@@ -37,15 +76,30 @@ def _compare_files(
                 file_path, file_hash = line.strip().split(",")
                 stored_files_set.add((Path(file_path).relative_to(root_dir), file_hash))
 
-    changed_files = stored_files_set - db_files
+    changed_files = {
+        (file, file_hash)
+        for file, file_hash in stored_files_set
+        if (file.as_posix(), file_hash) not in db_files
+    }
+    stored_keys = {(file.as_posix(), file_hash) for file, file_hash in stored_files_set}
+    removed_files = {path for path, file_hash in db_files - stored_keys}
 
     if len(changed_files) > 0:
         logger.info(f"Detected {len(changed_files)} modified files.")
+    if removed_files:
+        logger.info(f"Detected {len(removed_files)} removed or outdated files.")
 
-    return changed_files
+    return changed_files, removed_files
 
 
-def update(session: Session, path: Path):
+@metrics.timer("populate.import_maps")
+def update(
+    session: Session,
+    path: Path,
+    packages: PackageRegistry = None,
+    walks: WalkCache = None,
+    prune: bool = False,
+):
     """
     Updates Import to Package maps in the database  based on the comparison between the stored data and the current data.
 
@@ -53,26 +107,50 @@ def update(session: Session, path: Path):
         session (Session): The SQLAlchemy session object.
         path (Path): The path to import to package maps directory containing the JSON blobs
         (relative to the root directory of "libcfgraph" or viable alternative).
+        packages (PackageRegistry): Registry of the existing packages, shared with the
+            other updates of the run.
+        walks (WalkCache): Directory walks shared with the other updates of the run.
+        prune (bool): Delete the mappings of the files that were removed, renamed or
+            modified.
     """
+    if packages is None:
+        packages = PackageRegistry()
+
     logger.info("Updating feedstocks...")
     logger.debug("Creating temporary directory...")
     _tmp_dir = TemporaryDirectory()
     tmp_dir = Path(_tmp_dir.name)
 
     logger.info("Querying database for current mappings...")
-    _database_mappings = session.query(
-        ImportToPackageMaps.parent_package_name,
-        ImportToPackageMaps.partition,
-        ImportToPackageMaps.hash,
-    ).all()
+    _database_mappings = (
+        session.query(ImportToPackageMaps.path, ImportToPackageMaps.hash)
+        .distinct()
+        .all()
+    )
 
     logger.info(f"Traversing files in {path}...")
-    stored_files = traverse_files(path, tmp_dir)
+    stored_files = traverse_files(path, tmp_dir, walks=walks)
 
     logger.info("Comparing files...")
-    changed_files = _compare_files(_database_mappings, stored_files, root_dir=path)
+    changed_files, removed_files = _compare_files(
+        [tuple(row) for row in _database_mappings], stored_files, root_dir=path
+    )
+    metrics.incr("populate.import_maps.changed", len(changed_files))
+    if prune and removed_files:
+        # before the writes, the imports of a modified file are inserted again
+        reconcile.remove_import_maps(session, removed_files)
+        session.commit()
 
-    with progressBar:
+    # a mapping is stored once, for the first file holding it
+    stored_mappings = set()
+    if changed_files:
+        stored_mappings.update(
+            session.query(
+                ImportToPackageMaps.import_name, ImportToPackageMaps.parent_package_name
+            )
+        )
+
+    with progressBar, metrics.timer("populate.import_maps.write"):
         for idx, (file, file_hash) in enumerate(
             progressBar.track(changed_files, description="Updating import maps")
         ):
@@ -82,30 +160,21 @@ def update(session: Session, path: Path):
                 file=path / file  # absolute path
             )
             # now we will have a dictionary containing the package names and their respective imports
+            packages.add_all(session, import_map_data_blob)
+            packages.flush(session)
 
             for package_name, imports in import_map_data_blob.items():
-                package = (
-                    session.query(Packages)
-                    .filter(Packages.name == package_name)
-                    .first()
-                )
-
-                if not package:
-                    logger.debug(
-                        f"Package '{package_name}' not found in database. Proceeding to create it and its feedstock outputs."
-                    )
-                    package = Packages(
-                        name=package_name,
-                    )
-                    session.add(package)
-
                 for _import in imports:
+                    if (_import, package_name) in stored_mappings:
+                        continue
+                    stored_mappings.add((_import, package_name))
                     _mapping = ImportToPackageMaps(
                         id=uniq_id(),
                         import_name=_import,
-                        parent_package_name=package.name,
+                        parent_package_name=package_name,
                         partition=partition,
                         hash=file_hash,
+                        path=file.as_posix(),
                     )
                     session.add(_mapping)
 
@@ -0,0 +1,207 @@
+"""
+Direct ingestion of harvested artifacts into the database.
+
+Instead of writing JSON blobs that ``update-artifacts`` walks and parses again
+later on, the records returned by :func:`cfdb.harvest.core.reap_package` are
+handed over to an :class:`ArtifactWriter`, which inserts the packages,
+artifacts, file paths and relations in large transactions from a dedicated
+thread.
+"""
+
+import queue
+import threading
+from logging import getLogger
+from typing import Dict, List
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session, sessionmaker
+
+from cfdb import metrics
+from cfdb.models.schema import (
+    ArtifactDependencies,
+    Artifacts,
+    ArtifactsBackfill,
+)
+from cfdb.populate import dependencies, file_paths, latest
+from cfdb.populate.packages import PackageRegistry
+from cfdb.populate.utils import chunked
+
+logger = getLogger(__name__)
+
+_STOP = object()
+
+
+@metrics.timer("populate.ingest.write")
+def write_batch(
+    session: Session, records: List[Dict], packages: PackageRegistry = None
+) -> int:
+    """
+    Inserts a batch of harvested records, skipping the artifacts already stored.
+    Artifacts bootstrapped from the repodata only get their files linked.
+
+    Args:
+        session (Session): The database session (committed by the caller).
+        records (List[Dict]): Records as returned by ``reap_package``.
+        packages (PackageRegistry): Registry of the existing packages.
+
+    Returns:
+        int: The number of inserted or backfilled artifacts.
+    """
+    artifacts = {}
+    for record in records:
+        artifact_name = f"{record['arch']}/{record['name']}"
+        artifacts[artifact_name] = record
+
+    names = list(artifacts)
+    existing_artifacts = set()
+    for chunk in chunked(names):
+        existing_artifacts.update(
+            name for (name,) in session.query(Artifacts.name).filter(Artifacts.name.in_(chunk))
+        )
+
+    backfilled = set()
+    for chunk in chunked(list(existing_artifacts)):
+        backfilled.update(
+            name
+            for (name,) in session.query(ArtifactsBackfill.artifact_name).filter(
+                ArtifactsBackfill.artifact_name.in_(chunk)
+            )
+        )
+
+    new_artifacts = {
+        name: record for name, record in artifacts.items() if name not in existing_artifacts
+    }
+    linked_artifacts = {
+        name: record
+        for name, record in artifacts.items()
+        if name not in existing_artifacts or name in backfilled
+    }
+    if not linked_artifacts:
+        return 0
+
+    if packages is None:
+        packages = PackageRegistry()
+    packages.add_all(session, (record["pkg"] for record in new_artifacts.values()))
+    packages.flush(session)
+
+    session.bulk_save_objects(
+        [
+            Artifacts(
+                name=name,
+                package_name=record["pkg"],
+                platform=record["arch"],
+                version=str(record["index"].get("version")),
+                build=str(record["index"].get("build_number")),
+            )
+            for name, record in new_artifacts.items()
+        ]
+    )
+    depends = [
+        row
+        for name, record in new_artifacts.items()
+        for row in dependencies.dependency_rows(name, record["index"])
+    ]
+    if depends:
+        session.execute(insert(ArtifactDependencies), depends)
+
+    # link every file of the new artifacts, including the paths already shared
+    # with other artifacts
+    file_paths.link_files(
+        session,
+        {name: record.get("files", []) for name, record in linked_artifacts.items()},
+    )
+
+    for chunk in chunked(list(backfilled)):
+        session.query(ArtifactsBackfill).filter(
+            ArtifactsBackfill.artifact_name.in_(chunk)
+        ).delete(synchronize_session=False)
+
+    dependencies.update_graph(session, list(new_artifacts))
+    latest.refresh(session, {record["pkg"] for record in new_artifacts.values()})
+
+    metrics.incr("db.artifacts.inserted", len(new_artifacts))
+    return len(linked_artifacts)
+
+
+class ArtifactWriter(threading.Thread):
+    """
+    Background thread writing harvested records to the database in batches.
+
+    Records are queued with :meth:`submit` (blocking when ``max_pending`` records are
+    waiting, which throttles the harvesters), and written every ``batch_size`` records
+    in a single transaction. :meth:`close` flushes the last batch and re-raises the
+    first error met by the thread, if any; used as a context manager, an error of the
+    ``with`` block takes precedence over it.
+
+    Args:
+        session_factory (sessionmaker): Factory of the sessions used by the thread.
+        batch_size (int): Number of records per transaction.
+        max_pending (int): Maximum number of queued records.
+        packages (PackageRegistry): Registry of the existing packages.
+    """
+
+    def __init__(
+        self,
+        session_factory: sessionmaker,
+        batch_size: int = 500,
+        max_pending: int = 5000,
+        packages: PackageRegistry = None,
+    ):
+        super().__init__(name="cfdb-artifact-writer", daemon=True)
+        self.session_factory = session_factory
+        self.packages = packages if packages is not None else PackageRegistry()
+        self.batch_size = batch_size
+        self.written = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+
+    def submit(self, record: Dict):
+        if self._error is not None:
+            raise RuntimeError("The artifact writer stopped") from self._error
+        self._queue.put(record)
+
+    def run(self):
+        session = self.session_factory()
+        batch = []
+        stopped = False
+        try:
+            while not stopped:
+                record = self._queue.get()
+                stopped = record is _STOP
+                if not stopped:
+                    batch.append(record)
+                if batch and (len(batch) >= self.batch_size or stopped):
+                    self.written += write_batch(session, batch, self.packages)
+                    session.commit()
+                    logger.debug(f"Ingested {self.written} artifacts")
+                    batch = []
+        except Exception as e:
+            session.rollback()
+            self.packages.invalidate()
+            self._error = e
+            logger.exception(e)
+            # keep draining until close() so that producers never block on a full queue
+            while not stopped:
+                stopped = self._queue.get() is _STOP
+        finally:
+            session.close()
+
+    def close(self):
+        self._queue.put(_STOP)
+        self.join()
+        logger.info(f"Ingested {self.written} artifacts into the database")
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.close()
+        except Exception as e:
+            if exc_type is None:
+                raise
+            # the error of the block is the one to report, not its consequence
+            logger.error(f"The artifact writer failed as well: {e!r}")
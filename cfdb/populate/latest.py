@@ -0,0 +1,96 @@
+"""
+Latest artifact of every package per platform.
+
+``artifacts.version`` and ``artifacts.build`` are plain strings, which do not
+sort like conda versions. The ``latest_artifacts`` table keeps the latest
+artifact of every (package, platform), along with a sortable key of its version
+(:func:`cfdb.harvest.versions.sort_key`). It is refreshed for the packages
+touched by a run only.
+"""
+
+from logging import getLogger
+from typing import Iterable, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from cfdb import metrics
+from cfdb.harvest.versions import sort_key
+from cfdb.models.schema import Artifacts, LatestArtifacts
+from cfdb.populate.utils import chunked
+
+logger = getLogger(__name__)
+
+
+def _build_number(build: str) -> int:
+    try:
+        return int(build)
+    except (TypeError, ValueError):
+        return -1
+
+
+@metrics.timer("populate.latest")
+def refresh(session: Session, package_names: Iterable[str]) -> int:
+    """
+    Recomputes the latest artifacts of some packages.
+
+    Args:
+        session (Session): The database session (committed by the caller).
+        package_names (Iterable[str]): The packages whose artifacts changed.
+
+    Returns:
+        int: The number of (package, platform) rows written.
+    """
+    written = 0
+    for chunk in chunked(sorted(set(package_names))):
+        latest = {}
+        for name, package_name, platform, version, build in session.query(
+            Artifacts.name,
+            Artifacts.package_name,
+            Artifacts.platform,
+            Artifacts.version,
+            Artifacts.build,
+        ).filter(Artifacts.package_name.in_(chunk)):
+            # highest version, then build number; the name breaks the ties between
+            # the variants of a build
+            rank = (sort_key(version), _build_number(build), name)
+            current = latest.get((package_name, platform))
+            if current is None or rank > current[0]:
+                latest[(package_name, platform)] = (rank, name, version, build)
+
+        session.query(LatestArtifacts).filter(
+            LatestArtifacts.package_name.in_(chunk)
+        ).delete(synchronize_session=False)
+        if latest:
+            session.execute(
+                insert(LatestArtifacts),
+                [
+                    {
+                        "package_name": package_name,
+                        "platform": platform,
+                        "artifact_name": name,
+                        "version": version,
+                        "build": build,
+                        "version_key": rank[0],
+                    }
+                    for (package_name, platform), (rank, name, version, build) in latest.items()
+                ],
+            )
+        written += len(latest)
+
+    logger.debug(f"Refreshed {written} latest artifacts")
+    return written
+
+
+def latest_artifact(
+    session: Session, package_name: str, platform: str
+) -> Optional[LatestArtifacts]:
+    """The latest artifact of a package on a platform, if any."""
+    return (
+        session.query(LatestArtifacts)
+        .filter(
+            LatestArtifacts.package_name == package_name,
+            LatestArtifacts.platform == platform,
+        )
+        .one_or_none()
+    )
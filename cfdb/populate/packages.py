@@ -0,0 +1,83 @@
+"""
+Registry of the package names stored in the database.
+
+Every populate path needs to create the ``packages`` rows referenced by the rows
+it inserts. A :class:`PackageRegistry` loads the existing names once, and queues
+the new ones to insert them in a single statement. The :class:`~cfdb.handler.CFDBHandler`
+shares one registry between all its updates, so that running them back to back
+queries the ``packages`` table once.
+"""
+
+import threading
+from logging import getLogger
+from typing import Iterable, List, Optional, Set
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from cfdb import metrics
+from cfdb.models.schema import Packages
+
+logger = getLogger(__name__)
+
+
+class PackageRegistry:
+    """
+    Cache of the names of the ``packages`` table.
+
+    New names are queued by :meth:`add` and inserted by :meth:`flush`, which must be
+    called before the rows referencing them are flushed. The cache is only valid for
+    a database where packages are not deleted concurrently; :meth:`invalidate` drops
+    it, e.g. after a rollback.
+    """
+
+    def __init__(self):
+        self._names: Optional[Set[str]] = None
+        self._pending: List[str] = []
+        self._lock = threading.Lock()
+
+    def _load(self, session: Session) -> Set[str]:
+        if self._names is None:
+            self._names = {name for (name,) in session.query(Packages.name)}
+            logger.debug(f"Loaded {len(self._names)} package names")
+        return self._names
+
+    def add(self, session: Session, name: str) -> bool:
+        """
+        Queues a package for insertion, unless it is already known.
+
+        Returns:
+            bool: Whether the package is new.
+        """
+        with self._lock:
+            names = self._load(session)
+            if name in names:
+                return False
+            names.add(name)
+            self._pending.append(name)
+            return True
+
+    def add_all(self, session: Session, names: Iterable[str]) -> int:
+        """Queues several packages, returns the number of new ones."""
+        return sum(self.add(session, name) for name in names)
+
+    def flush(self, session: Session) -> int:
+        """
+        Inserts the queued packages.
+
+        Returns:
+            int: The number of inserted packages.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if pending:
+            # inserted right away, before the pending ORM objects that may reference them
+            with session.no_autoflush:
+                session.execute(insert(Packages), [{"name": name} for name in pending])
+            metrics.incr("db.packages.inserted", len(pending))
+        return len(pending)
+
+    def invalidate(self):
+        with self._lock:
+            self._names = None
+            self._pending = []
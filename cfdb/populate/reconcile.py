@@ -0,0 +1,255 @@
+"""
+Deletion propagation.
+
+The updates insert and update the rows of the files present in the harvested
+data, and the diff of a run also yields the keys of the rows whose source file
+disappeared: removed feedstock outputs, import map files and yanked artifacts.
+The functions of this module delete them with set-based statements, chunked
+``IN`` deletes for the removed keys and anti-joins (``NOT IN`` subqueries) for
+the rows they leave behind:
+
+- the feedstocks without any output;
+- the file paths, dependencies, latest artifacts and backfill entries of the
+  removed artifacts, the orphaned ``artifacts_file_paths`` rows no longer
+  referenced by ``relations_map_file_paths``, and the reverse dependencies no
+  longer backed by any artifact.
+
+The deleted rows leave free pages behind, :func:`vacuum` gives them back to the
+file system.
+"""
+
+from logging import getLogger
+from typing import Iterable, Optional
+
+from sqlalchemy import delete, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from cfdb import metrics
+from cfdb.models.schema import (
+    ArtifactDependencies,
+    Artifacts,
+    ArtifactsBackfill,
+    ArtifactsFilePaths,
+    FeedstockOutputs,
+    Feedstocks,
+    ImportToPackageMaps,
+    LatestArtifacts,
+    RelationsMapFilePaths,
+    ReverseDependencies,
+)
+from cfdb.populate import dependencies, latest
+from cfdb.populate.utils import chunked
+
+logger = getLogger(__name__)
+
+#: number of pages freed per incremental vacuum of SQLite, None to free them all
+VACUUM_PAGES = None
+
+
+def _delete_in(session: Session, column, keys: Iterable) -> int:
+    deleted = 0
+    for chunk in chunked(sorted(set(keys))):
+        result = session.execute(
+            delete(column.class_).where(column.in_(chunk)).execution_options(
+                synchronize_session=False
+            )
+        )
+        deleted += result.rowcount
+    return deleted
+
+
+def _delete_orphans(session: Session, column, referenced) -> int:
+    # anti-join: the rows whose key no other table refers to
+    result = session.execute(
+        delete(column.class_)
+        .where(column.not_in(select(referenced).where(referenced.is_not(None))))
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+@metrics.timer("populate.reconcile.feedstock_outputs")
+def remove_feedstock_outputs(session: Session, paths: Iterable[str]) -> int:
+    """
+    Deletes the feedstock outputs of removed files, and the feedstocks left without
+    any output.
+
+    Args:
+        session (Session): The database session (committed by the caller).
+        paths (Iterable[str]): Paths of the removed files, as stored in
+            ``feedstock_outputs.path``.
+
+    Returns:
+        int: The number of deleted feedstock outputs.
+    """
+    deleted = _delete_in(session, FeedstockOutputs.path, paths)
+    if deleted:
+        feedstocks = _delete_orphans(
+            session, Feedstocks.name, FeedstockOutputs.feedstock_name
+        )
+        metrics.incr("db.feedstocks.deleted", feedstocks)
+    metrics.incr("db.feedstock_outputs.deleted", deleted)
+    logger.info(f"Deleted {deleted} removed feedstock outputs")
+    return deleted
+
+
+@metrics.timer("populate.reconcile.import_maps")
+def remove_import_maps(session: Session, paths: Iterable[Optional[str]]) -> int:
+    """
+    Deletes the import mappings of removed or modified files.
+
+    Args:
+        session (Session): The database session (committed by the caller).
+        paths (Iterable[Optional[str]]): Paths of the files, as stored in
+            ``import_to_package_mapping.path``. None stands for the mappings stored
+            before the paths were.
+
+    Returns:
+        int: The number of deleted mappings.
+    """
+    paths = set(paths)
+    deleted = _delete_in(session, ImportToPackageMaps.path, paths - {None})
+    if None in paths:
+        deleted += session.execute(
+            delete(ImportToPackageMaps)
+            .where(ImportToPackageMaps.path.is_(None))
+            .execution_options(synchronize_session=False)
+        ).rowcount
+    metrics.incr("db.import_maps.deleted", deleted)
+    logger.info(f"Deleted {deleted} stale import mappings")
+    return deleted
+
+
+def _prune_reverse_dependencies(session: Session, package_names: Iterable[str]):
+    # the edges of the dependents that no artifact backs anymore
+    backed = (
+        select(ArtifactDependencies.package_name)
+        .join(Artifacts, Artifacts.name == ArtifactDependencies.artifact_name)
+        .where(
+            ArtifactDependencies.kind == "depends",
+            Artifacts.platform == ReverseDependencies.platform,
+            Artifacts.package_name == ReverseDependencies.dependent_name,
+        )
+    )
+    platforms, deleted = set(), 0
+    for chunk in chunked(sorted(set(package_names))):
+        condition = ReverseDependencies.dependent_name.in_(
+            chunk
+        ) & ReverseDependencies.package_name.not_in(backed)
+        platforms.update(
+            platform
+            for (platform,) in session.query(ReverseDependencies.platform)
+            .filter(condition)
+            .distinct()
+        )
+        deleted += session.execute(
+            delete(ReverseDependencies)
+            .where(condition)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+
+    if "noarch" in platforms:
+        # noarch edges belong to the graph of every platform
+        platforms.update(
+            platform for (platform,) in session.query(ReverseDependencies.platform).distinct()
+        )
+    for platform in sorted(platforms):
+        dependencies.rebuild_closure(session, platform)
+    metrics.incr("db.reverse_dependencies.deleted", deleted)
+
+
+@metrics.timer("populate.reconcile.artifacts")
+def remove_artifacts(session: Session, artifact_names: Iterable[str]) -> int:
+    """
+    Deletes removed artifacts along with their rows in the other tables, then
+    collects the file paths no artifact refers to anymore and updates the
+    dependency graph and the latest artifacts of their packages.
+
+    Args:
+        session (Session): The database session (committed by the caller).
+        artifact_names (Iterable[str]): Names of the removed artifacts
+            (``<subdir>/<artifact>``).
+
+    Returns:
+        int: The number of deleted artifacts.
+    """
+    artifact_names = sorted(set(artifact_names))
+    package_names = set()
+    for chunk in chunked(artifact_names):
+        package_names.update(
+            name
+            for (name,) in session.query(Artifacts.package_name).filter(
+                Artifacts.name.in_(chunk)
+            )
+        )
+
+    for column in (
+        RelationsMapFilePaths.artifact_name,
+        ArtifactDependencies.artifact_name,
+        LatestArtifacts.artifact_name,
+        ArtifactsBackfill.artifact_name,
+    ):
+        _delete_in(session, column, artifact_names)
+    deleted = _delete_in(session, Artifacts.name, artifact_names)
+    metrics.incr("db.artifacts.deleted", deleted)
+    logger.info(f"Deleted {deleted} removed artifacts")
+    if not deleted:
+        return 0
+
+    collect_file_paths(session)
+    _prune_reverse_dependencies(session, package_names)
+    latest.refresh(session, package_names)
+    return deleted
+
+
+@metrics.timer("populate.reconcile.file_paths")
+def collect_file_paths(session: Session) -> int:
+    """
+    Deletes the ``artifacts_file_paths`` rows that no
+    ``relations_map_file_paths`` row refers to.
+
+    Returns:
+        int: The number of deleted file paths.
+    """
+    deleted = _delete_orphans(
+        session, ArtifactsFilePaths.id, RelationsMapFilePaths.file_path_id
+    )
+    metrics.incr("db.file_paths.deleted", deleted)
+    logger.info(f"Collected {deleted} orphaned file paths")
+    return deleted
+
+
+@metrics.timer("populate.vacuum")
+def vacuum(engine: Engine, pages: int = VACUUM_PAGES):
+    """
+    Returns the free pages of the database to the file system.
+
+    On SQLite, the first call switches the database to incremental auto-vacuum,
+    which takes a full ``VACUUM``; the later ones only free ``pages`` pages (all
+    of them by default) with ``PRAGMA incremental_vacuum``. On PostgreSQL, the
+    tables are vacuumed and analyzed. Other databases are left as is.
+    """
+    dialect = engine.dialect.name
+    if dialect == "sqlite":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            # 0: none, 1: full, 2: incremental
+            if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:
+                logger.info("Enabling the incremental auto-vacuum (full VACUUM)...")
+                conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+                conn.exec_driver_sql("VACUUM")
+            else:
+                free = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+                # a page is freed per step of the statement, and the sqlite3 module
+                # only steps it to completion in a script
+                conn.connection.dbapi_connection.executescript(
+                    "PRAGMA incremental_vacuum" + (f"({int(pages)})" if pages else "")
+                )
+                freed = free - conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+                logger.info(f"Freed {freed} of {free} free pages")
+    elif dialect == "postgresql":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("VACUUM ANALYZE"))
+        logger.info("Vacuumed the database")
+    else:
+        logger.warning(f"VACUUM is not supported for {dialect}, skipping it")
@@ -2,12 +2,56 @@ from concurrent.futures import ThreadPoolExecutor, wait
 import glob
 import hashlib
 import json
+import threading
 from pathlib import Path
-from typing import List, Callable
+from typing import Dict, Iterable, List, Callable
 
 from logging import getLogger
+
+from cfdb import metrics
+
 logger = getLogger(__name__)
 
+#: maximum number of bound parameters per IN clause (SQLite's default limit is 999)
+IN_CLAUSE_CHUNK = 500
+
+
+def chunked(items: List, size: int = IN_CLAUSE_CHUNK) -> Iterable[List]:
+    """Splits ``items`` in lists of ``size`` items, to bound the IN clauses of the queries."""
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def list_json_files(path: Path) -> List[Path]:
+    """Recursively lists the JSON files under ``path``."""
+    return [f for f in Path(path).glob("**/*.json") if f.is_file()]
+
+
+class WalkCache:
+    """
+    Results of the directory walks of a run, so that the updates walking the same
+    directory share a single walk. Stages writing to a directory must
+    :meth:`invalidate` it.
+    """
+
+    def __init__(self):
+        self._files: Dict[Path, List[Path]] = {}
+        self._lock = threading.Lock()
+
+    def json_files(self, path: Path) -> List[Path]:
+        key = Path(path).resolve()
+        with self._lock:
+            if key not in self._files:
+                self._files[key] = list_json_files(path)
+            return self._files[key]
+
+    def invalidate(self, path: Path = None):
+        with self._lock:
+            if path is None:
+                self._files.clear()
+            else:
+                self._files.pop(Path(path).resolve(), None)
+
 
 def hash_file(filename: str) -> str:
     """
@@ -39,10 +83,11 @@ def process_batch(batch_files: List[Path], tmp_file: Path) -> None:
         batch_files (List[Path]): The list of files in the batch.
         tmp_file (Path): The path to the temporary file.
     """
-    with open(tmp_file, "w") as f:
+    with metrics.timer("populate.hash"), open(tmp_file, "w") as f:
         for file in batch_files:
             file_hash = hash_file(file)
             f.write(f"{file},{file_hash}\n")
+    metrics.incr("populate.hash.files", len(batch_files))
 
 
 def retrieve_associated_feedstock_from_output_blob(file: Path):
@@ -86,8 +131,12 @@ def retrieve_import_maps_from_output_blob(file: Path):
     return packages_to_imports
 
 
+@metrics.timer("populate.traverse")
 def traverse_files(
-    path: Path, output_dir: Path = None, process_function: Callable = process_batch
+    path: Path,
+    output_dir: Path = None,
+    process_function: Callable = process_batch,
+    walks: WalkCache = None,
 ) -> List[Path]:
     """
     Traverses a directory of JSON files, generating a list of dictionaries
@@ -100,6 +149,7 @@ def traverse_files(
         path (Path): The path to the directory containing the JSON files.
         output_dir (Path, optional): The output directory to store the list of dictionaries.
             If not provided, the current directory will be used. Defaults to None.
+        walks (WalkCache, optional): Walks shared with the other updates of the run.
 
     Returns:
         List[Path]: A list of paths to the stored files.
@@ -107,15 +157,13 @@ def traverse_files(
     if not path.is_dir():
         raise NotADirectoryError(f"{path} is not a directory.")
 
-    files = []
-    for f in path.glob("**/*.json"):
-        if f.is_file():
-            files.append(f)
+    files = walks.json_files(path) if walks is not None else list_json_files(path)
 
     if not files:
         raise FileNotFoundError(f"No JSON files found in {path}")
 
     num_of_files = len(files)
+    metrics.incr("populate.traverse.files", num_of_files)
     num_of_batches = num_of_files // 1000
 
     if num_of_files % 1000 != 0:
@@ -0,0 +1,189 @@
+"""
+Profiling of the CLI commands.
+
+``python -m cfdb --profile <command>`` runs the command under :mod:`cProfile`,
+including the threads it starts (e.g. the hashing threads of ``traverse_files``
+and the download threads of ``reap``) and the harvesting processes of the
+pipeline, and ``--profile-memory`` traces its allocations with
+:mod:`tracemalloc`. The outputs are written to ``CFDB_PROFILING_DIR``
+(``.profiles`` next to ``.logs`` by default), named after the command and the
+start time:
+
+- ``<command>_<time>.prof``: the merged CPU profile, e.g. for ``snakeviz`` or
+  ``python -m pstats``;
+- ``<command>_<time>.txt``: the hottest functions;
+- ``<command>_<time>.memory.txt``: the lines holding the most memory at the end of
+  the run, and the peak of the traced memory.
+"""
+
+import cProfile
+import io
+import multiprocessing.util
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import tracemalloc
+from datetime import datetime
+from logging import getLogger
+from pathlib import Path
+from typing import List
+
+logger = getLogger(__name__)
+
+#: directory where the worker processes dump their profiles, set while profiling
+WORKERS_DIR_ENV = "CFDB_PROFILE_WORKERS_DIR"
+
+#: number of frames stored per traced allocation
+TRACEMALLOC_FRAMES = 10
+
+
+def default_output_dir() -> Path:
+    return Path(os.environ.get("CFDB_PROFILING_DIR", Path.cwd() / ".profiles"))
+
+
+def start_worker():
+    """
+    Profiles the current worker process if the parent is profiling, the profile
+    being dumped when the process exits. Called by the process pool initializers.
+    """
+    directory = os.environ.get(WORKERS_DIR_ENV)
+    if not directory:
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+
+    def dump():
+        profile.disable()
+        profile.dump_stats(os.path.join(directory, f"worker-{os.getpid()}.prof"))
+
+    # run by multiprocessing when the worker exits
+    multiprocessing.util.Finalize(None, dump, exitpriority=100)
+
+
+class Profiler:
+    """
+    CPU and memory profiler of a command.
+
+    Args:
+        name (str): Name of the command, used in the output names.
+        cpu (bool): Whether to profile with :mod:`cProfile`.
+        memory (bool): Whether to trace the allocations with :mod:`tracemalloc`.
+        output_dir (Path): Directory of the outputs, see :func:`default_output_dir`.
+        top (int): Number of entries of the summaries.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        cpu: bool = True,
+        memory: bool = False,
+        output_dir: Path = None,
+        top: int = 15,
+    ):
+        self.cpu = cpu
+        self.memory = memory
+        self.top = top
+        self.output_dir = Path(output_dir or default_output_dir())
+        self.prefix = f"{name}_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}"
+        self._profile = None
+        self._thread_profiles: List[cProfile.Profile] = []
+        self._lock = threading.Lock()
+        self._workers_dir = None
+
+    def _profile_thread(self, frame, event, arg):
+        # installed by threading.setprofile, called once at the start of every thread
+        sys.setprofile(None)
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # a single profiler at a time since Python 3.12, which covers every thread
+            return
+        with self._lock:
+            self._thread_profiles.append(profile)
+
+    def start(self):
+        if self.cpu:
+            self._workers_dir = tempfile.TemporaryDirectory(prefix="cfdb-profile-")
+            os.environ[WORKERS_DIR_ENV] = self._workers_dir.name
+            threading.setprofile(self._profile_thread)
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        if self.memory:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+
+    def stop(self) -> str:
+        """
+        Stops the profilers and writes their outputs.
+
+        Returns:
+            str: The summary of the hottest functions and largest allocations.
+        """
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        summaries = []
+        # before merging the CPU profiles, which allocates a lot
+        if self.memory and tracemalloc.is_tracing():
+            summaries.append(self._stop_memory())
+        if self._profile is not None:
+            summaries.insert(0, self._stop_cpu())
+        return "\n".join(summaries)
+
+    def _stop_cpu(self) -> str:
+        self._profile.disable()
+        threading.setprofile(None)
+        os.environ.pop(WORKERS_DIR_ENV, None)
+
+        stats = pstats.Stats(self._profile)
+        with self._lock:
+            for profile in self._thread_profiles:
+                # a no-op for the threads that are over
+                profile.disable()
+                profile.create_stats()
+                stats.add(profile)
+        workers = sorted(Path(self._workers_dir.name).glob("worker-*.prof"))
+        for worker in workers:
+            stats.add(str(worker))
+        self._workers_dir.cleanup()
+
+        path = self.output_dir / f"{self.prefix}.prof"
+        stats.dump_stats(path)
+
+        stream = io.StringIO()
+        stats.stream = stream
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(self.top)
+        summary = stream.getvalue().strip()
+        (self.output_dir / f"{self.prefix}.txt").write_text(summary + "\n")
+        logger.info(
+            f"Wrote the CPU profile of {len(self._thread_profiles)} threads and "
+            f"{len(workers)} worker processes to {path}"
+        )
+        return f"CPU profile ({path}):\n{summary}"
+
+    def _stop_memory(self) -> str:
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__),)
+        )
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        lines = [
+            f"Traced memory: {current / 1024**2:.1f} MB at exit, {peak / 1024**2:.1f} MB at peak"
+        ]
+        for stat in snapshot.statistics("lineno")[: self.top]:
+            frame = stat.traceback[0]
+            lines.append(
+                f"{stat.size / 1024**2:10.2f} MB {stat.count:>9} blocks  "
+                f"{frame.filename}:{frame.lineno}"
+            )
+        summary = "\n".join(lines)
+
+        path = self.output_dir / f"{self.prefix}.memory.txt"
+        with open(path, "w") as f:
+            f.write(summary + "\n\nLargest allocations, by traceback:\n")
+            for stat in snapshot.statistics("traceback")[: self.top]:
+                f.write(f"\n{stat.size / 1024**2:.2f} MB in {stat.count} blocks\n")
+                f.write("\n".join(stat.traceback.format()) + "\n")
+        logger.info(f"Wrote the memory profile to {path}")
+        return f"Memory profile ({path}):\n{summary}"
@@ -0,0 +1,189 @@
+"""
+Accounting of the SQL statements of a run.
+
+:class:`SQLStats` hooks the cursor events of an engine and aggregates the
+statements by normalised shape (literals, parameters and ``IN`` lists replaced
+by placeholders) and by the ``cfdb`` function issuing them, with their number,
+affected rows and time. It also flags the N+1 patterns: the same shape issued
+over and over from the same line within a single call of a function (the caller
+or one of the ``cfdb`` functions up the stack), i.e. a query inside a loop.
+
+The accounting is opt-in (``--sql-stats`` or ``CFDB_SQL_STATS``): once
+:func:`enable` is called, every :class:`~cfdb.handler.CFDBHandler` created
+afterwards attaches the process-wide :class:`SQLStats` to its engine.
+"""
+
+import re
+import sys
+import threading
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+#: number of identical-shape statements of a single call site and call above which
+#: it is flagged as an N+1 pattern
+N_PLUS_ONE_THRESHOLD = 20
+
+#: number of cfdb frames up the stack considered for the N+1 patterns
+STACK_DEPTH = 8
+
+_WHITESPACE = re.compile(r"\s+")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PARAMETER = re.compile(r"%\(\w+\)s|%s|:\w+|\$\d+")
+_IN_LIST = re.compile(r"IN \(\?(?:, \?)*\)", re.IGNORECASE)
+_VALUES_LIST = re.compile(r"(\(\?(?:, \?)*\))(?:, \(\?(?:, \?)*\))+")
+
+
+def normalize(statement: str) -> str:
+    """
+    Shape of a statement, e.g. ``SELECT a FROM t WHERE b IN (...) AND c = ?``
+    for ``SELECT a FROM t WHERE b IN (?, ?, ?) AND c = 'x'``.
+    """
+    shape = _WHITESPACE.sub(" ", statement).strip()
+    shape = _STRING.sub("?", shape)
+    shape = _PARAMETER.sub("?", shape)
+    shape = _NUMBER.sub("?", shape)
+    shape = _IN_LIST.sub("IN (...)", shape)
+    return _VALUES_LIST.sub(r"\1, ...", shape)
+
+
+class ShapeStats(NamedTuple):
+    shape: str
+    caller: str
+    statements: int
+    rows: int
+    seconds: float
+    #: longest run of the shape from one line within a single call of a function
+    max_repeats: int
+    #: ``function:line`` of that run, i.e. the loop issuing the statements
+    loop: str
+
+    @property
+    def n_plus_one(self) -> bool:
+        return self.max_repeats >= N_PLUS_ONE_THRESHOLD
+
+
+def _call_sites(frame) -> List[Tuple[str, int, object]]:
+    # the cfdb frames, innermost first, or the first frame outside sqlalchemy
+    sites, fallback = [], None
+    while frame is not None and len(sites) < STACK_DEPTH:
+        module = frame.f_globals.get("__name__", "")
+        if module != __name__ and not module.startswith("sqlalchemy"):
+            site = (f"{module}.{frame.f_code.co_name}", frame.f_lineno, frame)
+            if module.startswith("cfdb"):
+                sites.append(site)
+            elif fallback is None:
+                fallback = site
+        frame = frame.f_back
+    return sites or [fallback or ("<unknown>", 0, None)]
+
+
+class SQLStats:
+    """
+    Statement counts, rows and time per shape and calling function.
+
+    The repetitions are tracked by keeping the frame of the last call of every
+    call site, which keeps its locals alive until the next statement of the site
+    or :meth:`reset`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # (shape, caller) -> [statements, rows, seconds, max_repeats, loop]
+            self._stats: Dict[Tuple[str, str], list] = {}
+            # (shape, function, line) -> [frame, repeats]
+            self._runs: Dict[Tuple[str, str, int], list] = {}
+
+    def attach(self, engine: Engine):
+        event.listen(engine, "before_cursor_execute", self._before)
+        event.listen(engine, "after_cursor_execute", self._after)
+
+    def detach(self, engine: Engine):
+        event.remove(engine, "before_cursor_execute", self._before)
+        event.remove(engine, "after_cursor_execute", self._after)
+
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        self._local.start = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - getattr(self._local, "start", time.perf_counter())
+        if executemany:
+            rows = len(parameters)
+        else:
+            rows = max(cursor.rowcount, 0)
+        shape = normalize(statement)
+        sites = _call_sites(sys._getframe(1))
+
+        with self._lock:
+            stats = self._stats.setdefault((shape, sites[0][0]), [0, 0, 0.0, 0, ""])
+            stats[0] += 1
+            stats[1] += rows
+            stats[2] += elapsed
+            for function, line, frame in sites:
+                run = self._runs.get((shape, function, line))
+                if run is not None and run[0] is frame:
+                    run[1] += 1
+                else:
+                    run = self._runs[shape, function, line] = [frame, 1]
+                if run[1] > stats[3]:
+                    stats[3], stats[4] = run[1], f"{function}:{line}"
+
+    def results(self) -> List[ShapeStats]:
+        """The statistics, by decreasing total time."""
+        with self._lock:
+            results = [
+                ShapeStats(shape, caller, *stats)
+                for (shape, caller), stats in self._stats.items()
+            ]
+        return sorted(results, key=lambda result: result.seconds, reverse=True)
+
+    def n_plus_one(self) -> List[ShapeStats]:
+        return [result for result in self.results() if result.n_plus_one]
+
+    def format_table(self, top: int = 15, width: int = 90) -> str:
+        """Table of the ``top`` most expensive shapes, followed by the N+1 patterns."""
+        results = self.results()
+        total = sum(result.statements for result in results)
+        seconds = sum(result.seconds for result in results)
+        lines = [
+            f"SQL: {total} statements in {seconds:.2f}s, {len(results)} shapes",
+            f"{'count':>8} {'rows':>9} {'total ms':>10} {'mean ms':>8}  n+1  caller / shape",
+        ]
+        for result in results[:top]:
+            lines.append(
+                f"{result.statements:>8} {result.rows:>9} {result.seconds * 1000:>10.1f} "
+                f"{result.seconds * 1000 / result.statements:>8.2f}  "
+                f"{'yes' if result.n_plus_one else '   '}  {result.caller}"
+            )
+            lines.append(f"{'':>43}{result.shape[:width]}")
+
+        for result in self.n_plus_one():
+            lines.append(
+                f"Possible N+1: {result.caller} issued {result.max_repeats} times from a "
+                f"single call of {result.loop}: {result.shape[:width]}"
+            )
+        return "\n".join(lines)
+
+
+_active: Optional[SQLStats] = None
+
+
+def enable() -> SQLStats:
+    """Enables the accounting for the handlers created from now on."""
+    global _active
+    if _active is None:
+        _active = SQLStats()
+    return _active
+
+
+def active() -> Optional[SQLStats]:
+    """The process-wide :class:`SQLStats`, None unless :func:`enable` was called."""
+    return _active
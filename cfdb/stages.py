@@ -0,0 +1,224 @@
+"""
+Single-process runs of the update commands.
+
+``cfdb pipeline`` runs the updates as the stages of a DAG, in one process: the
+stages share the engine, the package registry and the directory walks of one
+:class:`~cfdb.handler.CFDBHandler`, and the stages whose dependencies are done
+run concurrently. The stages writing to the database run one after the other,
+whatever the database: they share the pending names of the package registry, and
+SQLite only allows one writer at a time anyway. The other stages overlap with them.
+"""
+
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from logging import getLogger
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from cfdb import metrics
+from cfdb.handler import CFDBHandler
+
+logger = getLogger(__name__)
+
+
+class Stage(NamedTuple):
+    """
+    A step of the pipeline.
+
+    Attributes:
+        name: Name of the stage.
+        run: Function running the stage with the shared handler.
+        after: Names of the stages to complete first.
+        writes_db: Whether the stage writes to the database for most of its run.
+    """
+
+    name: str
+    run: Callable[[CFDBHandler], None]
+    after: Tuple[str, ...] = ()
+    writes_db: bool = True
+
+
+class StageResult(NamedTuple):
+    name: str
+    #: ``done``, ``failed`` or ``skipped`` (a dependency did not complete)
+    status: str
+    seconds: float = 0.0
+    error: Optional[BaseException] = None
+
+
+def select_stages(stages: List[Stage], names: Iterable[str]) -> List[Stage]:
+    """
+    Keeps the stages in ``names``, dropping the dependencies on the other ones.
+
+    Raises:
+        ValueError: If a name is not a stage.
+    """
+    names = set(names)
+    unknown = names - {stage.name for stage in stages}
+    if unknown:
+        raise ValueError(f"Unknown stages: {', '.join(sorted(unknown))}")
+    return [
+        stage._replace(after=tuple(name for name in stage.after if name in names))
+        for stage in stages
+        if stage.name in names
+    ]
+
+
+def _check_dag(stages: List[Stage]):
+    by_name = {stage.name: stage for stage in stages}
+    if len(by_name) != len(stages):
+        raise ValueError("Stage names must be unique")
+    for stage in stages:
+        missing = set(stage.after) - set(by_name)
+        if missing:
+            raise ValueError(f"Stage {stage.name} depends on unknown stages: {missing}")
+
+    visited, visiting = set(), set()
+
+    def visit(name):
+        if name in visiting:
+            raise ValueError(f"Cycle between the stages, through {name}")
+        if name not in visited:
+            visiting.add(name)
+            for dependency in by_name[name].after:
+                visit(dependency)
+            visiting.discard(name)
+            visited.add(name)
+
+    for stage in stages:
+        visit(stage.name)
+
+
+def run_stages(
+    stages: List[Stage], handler: CFDBHandler, max_workers: int = None
+) -> List[StageResult]:
+    """
+    Runs the stages as soon as their dependencies are done, the stages depending on
+    a failed stage being skipped.
+
+    Args:
+        stages (List[Stage]): The stages, in any order.
+        handler (CFDBHandler): The handler shared by the stages.
+        max_workers (int): Maximum number of concurrent stages (all by default).
+
+    Returns:
+        List[StageResult]: The results, in completion order.
+
+    Raises:
+        ValueError: If the stages do not form a DAG.
+    """
+    _check_dag(stages)
+    # the writers share the package registry, whose pending names belong to the
+    # session of one of them (and SQLite would raise "database is locked")
+    db_lock = threading.Lock()
+
+    def run(stage: Stage) -> StageResult:
+        start = time.perf_counter()
+        try:
+            if stage.writes_db:
+                with db_lock:
+                    stage.run(handler)
+            else:
+                stage.run(handler)
+        except Exception as e:
+            logger.exception(f"Stage {stage.name} failed")
+            return StageResult(stage.name, "failed", time.perf_counter() - start, e)
+        finally:
+            metrics.observe(f"stage.{stage.name}", time.perf_counter() - start)
+        return StageResult(stage.name, "done", time.perf_counter() - start)
+
+    results: Dict[str, StageResult] = {}
+    pending = list(stages)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers or len(stages) or 1) as executor:
+        while pending or running:
+            for stage in list(pending):
+                statuses = [results[name].status for name in stage.after if name in results]
+                if any(status != "done" for status in statuses):
+                    pending.remove(stage)
+                    results[stage.name] = StageResult(stage.name, "skipped")
+                    logger.warning(f"Skipping stage {stage.name}")
+                elif len(statuses) == len(stage.after):
+                    pending.remove(stage)
+                    logger.info(f"Starting stage {stage.name}")
+                    running[executor.submit(run, stage)] = stage
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                results[result.name] = result
+                del running[future]
+                logger.info(f"Stage {result.name} {result.status} in {result.seconds:.1f}s")
+
+    return list(results.values())
+
+
+def format_summary(results: List[StageResult]) -> str:
+    """Per-stage timing summary of a run."""
+    width = max([len(result.name) for result in results] + [5])
+    lines = [f"{'stage':<{width}}  {'status':<7}  seconds"]
+    lines.extend(
+        f"{result.name:<{width}}  {result.status:<7}  {result.seconds:7.1f}"
+        for result in results
+    )
+    lines.append(f"{'total':<{width}}  {'':<7}  {sum(r.seconds for r in results):7.1f}")
+    return "\n".join(lines)
+
+
+def default_stages(
+    feedstock_outputs_path: str = None,
+    import_maps_path: str = None,
+    artifacts_path: str = None,
+    harvest: bool = True,
+    **reap_kwargs,
+) -> List[Stage]:
+    """
+    The stages of the database build: the feedstock outputs, the import maps and the
+    harvest of the artifacts missing from the database are independent, the update
+    of the artifacts from the harvested data follows the harvest. Stages without
+    their path are left out.
+
+    Args:
+        feedstock_outputs_path (str): See ``update-feedstock-outputs``.
+        import_maps_path (str): See ``update-import-to-package-maps``.
+        artifacts_path (str): See ``update-artifacts``.
+        harvest (bool): Whether to harvest the upstream artifacts.
+        reap_kwargs: Extra arguments for :func:`cfdb.harvest.core.reap`.
+    """
+    stages = []
+    if feedstock_outputs_path:
+        stages.append(
+            Stage(
+                "feedstock-outputs",
+                lambda handler: handler.update_feedstock_outputs(feedstock_outputs_path),
+            )
+        )
+    if import_maps_path:
+        stages.append(
+            Stage(
+                "import-maps",
+                lambda handler: handler.update_import_to_package_maps(import_maps_path),
+            )
+        )
+    if harvest:
+
+        def harvest_stage(handler: CFDBHandler):
+            from cfdb.harvest.core import reap
+
+            reap(handler.engine, failures=handler.failure_registry(), **reap_kwargs)
+            # the harvested blobs were added to the artifacts directory
+            handler.walks.invalidate()
+
+        # it reads the database and records the failures in it
+        stages.append(Stage("harvest", harvest_stage))
+    if artifacts_path:
+        stages.append(
+            Stage(
+                "artifacts",
+                lambda handler: handler.update_artifacts(artifacts_path),
+                after=("harvest",) if harvest else (),
+            )
+        )
+    return stages
@@ -3,8 +3,30 @@ import os
 from pathlib import Path
 from tempfile import TemporaryDirectory
 
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from cfdb.models.schema import Base
+
 
 if "CFDB_LOGGING_DIR" not in os.environ:
     tmp = TemporaryDirectory("pytest-logs")
     atexit.register(tmp.cleanup)
     os.environ["CFDB_LOGGING_DIR"] = str(Path(tmp.name, "cfdb.log"))
+
+if "CFDB_CHECKPOINT_DIR" not in os.environ:
+    checkpoints = TemporaryDirectory("pytest-checkpoints")
+    atexit.register(checkpoints.cleanup)
+    os.environ["CFDB_CHECKPOINT_DIR"] = checkpoints.name
+
+
+@pytest.fixture
+def db():
+    """An in-memory SQLite session with every table created."""
+    engine = create_engine("sqlite:///:memory:")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+    engine.dispose()
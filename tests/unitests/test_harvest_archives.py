@@ -0,0 +1,48 @@
+from test_harvester import INDEX, make_tar_bz2
+
+from cfdb.harvest.archives import (
+    ArchiveManifest,
+    ManifestEntry,
+    harvest_local,
+    iter_archives,
+)
+from cfdb.harvest.store import ShardStore
+
+
+def write_archive(path, **kwargs):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(make_tar_bz2(**kwargs).getvalue())
+
+
+def test_harvest_local(tmp_path):
+    archives = tmp_path / "mirror"
+    write_archive(archives / "noarch" / "pkg-1.0-0.tar.bz2")
+    write_archive(archives / "noarch" / "pkg-1.1-0.tar.bz2", payload_members=5)
+    (archives / "noarch" / "repodata.json").write_text("{}")
+    assert len(list(iter_archives(archives))) == 2
+
+    store = ShardStore(tmp_path / "store", num_shards=2)
+    manifest = ArchiveManifest(tmp_path / "manifest.tsv")
+
+    assert harvest_local(archives, store=store, manifest=manifest, harvest_workers=1) == 2
+    record = store.get("pkg", "conda-forge/noarch/pkg-1.0-0.json")
+    assert record["index"] == INDEX
+
+    # unchanged archives are skipped, also by a new manifest instance
+    manifest = ArchiveManifest(tmp_path / "manifest.tsv")
+    assert harvest_local(archives, store=store, manifest=manifest, harvest_workers=1) == 0
+
+    # an archive whose size changed is harvested again
+    write_archive(archives / "noarch" / "pkg-1.0-0.tar.bz2", payload_members=10)
+    assert harvest_local(archives, store=store, manifest=manifest, harvest_workers=1) == 1
+
+
+def test_manifest_checksum(tmp_path):
+    archive = tmp_path / "pkg-1.0-0.tar.bz2"
+    archive.write_bytes(b"abc")
+    manifest = ArchiveManifest(tmp_path / "manifest.tsv")
+    manifest.record(ManifestEntry("pkg-1.0-0.tar.bz2", 3, "0" * 64))
+
+    assert manifest.is_harvested(archive, 3)
+    assert not manifest.is_harvested(archive, 3, verify_checksum=True)
+    assert not manifest.is_harvested(archive, 4)
@@ -0,0 +1,55 @@
+import hashlib
+import os
+
+import pytest
+
+from cfdb.harvest.cache import ArchiveCache, IntegrityError, verify_chunks
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def test_verify_chunks():
+    data = b"x" * 100
+    assert verify_chunks([data[:30], data[30:]], sha256(data), 100) == data
+    assert verify_chunks([data], None, None) == data
+
+    with pytest.raises(IntegrityError):
+        verify_chunks([data], sha256(b"other"), 100)
+    with pytest.raises(IntegrityError):
+        verify_chunks([data], sha256(data), 99)
+
+
+def test_cache_fetch_and_get(tmp_path):
+    cache = ArchiveCache(tmp_path / "cache")
+    data = b"archive"
+
+    assert cache.get(sha256(data)) is None
+    assert cache.fetch([b"arch", b"ive"], sha256(data), len(data)) == data
+    assert cache.get(sha256(data)) == data
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # a corrupt download is not cached
+    with pytest.raises(IntegrityError):
+        cache.fetch([b"corrupt"], sha256(b"expected"))
+    assert cache.get(sha256(b"expected")) is None
+    assert not list((tmp_path / "cache").glob("*/*.tmp"))
+
+
+def test_cache_lru_eviction(tmp_path):
+    cache = ArchiveCache(tmp_path / "cache", max_bytes=250)
+    payloads = [bytes([i]) * 100 for i in range(3)]
+
+    cache.fetch([payloads[0]], sha256(payloads[0]))
+    cache.fetch([payloads[1]], sha256(payloads[1]))
+    # make the first archive the most recently used one
+    os.utime(cache.path_for(sha256(payloads[1])), (0, 0))
+    cache.get(sha256(payloads[0]))
+
+    cache.fetch([payloads[2]], sha256(payloads[2]))
+
+    assert cache.get(sha256(payloads[1])) is None
+    assert cache.get(sha256(payloads[0])) == payloads[0]
+    assert cache.get(sha256(payloads[2])) == payloads[2]
+    assert ArchiveCache(tmp_path / "cache").total_bytes == 200
@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from cfdb.harvest import core
+from cfdb.harvest.core import PackageData
+from cfdb.harvest.failures import FailureRegistry
+from cfdb.models.schema import Base, ReapFailures
+
+URL = "https://conda.anaconda.org/conda-forge/noarch/pkg-1.0-0.conda"
+NOW = datetime(2024, 1, 1)
+
+
+@pytest.fixture
+def registry(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/failures.db")
+    Base.metadata.create_all(engine)
+    yield FailureRegistry(
+        sessionmaker(bind=engine),
+        threshold=2,
+        base_interval=timedelta(hours=1),
+        max_interval=timedelta(hours=6),
+    )
+    engine.dispose()
+
+
+def fail(registry, times, now=NOW):
+    for _ in range(times):
+        registry.record_failure(URL, "pkg", "HTTPError", "404", now=now)
+    registry.close()
+
+
+def test_retry_interval(registry):
+    assert registry.retry_interval(1) == timedelta(0)
+    assert registry.retry_interval(2) == timedelta(hours=1)
+    assert registry.retry_interval(4) == timedelta(hours=4)
+    assert registry.retry_interval(100) == timedelta(hours=6)
+
+
+def test_quarantine(registry):
+    fail(registry, 1)
+    assert registry.quarantined_urls(now=NOW) == set()
+
+    fail(registry, 2)
+    (failure,) = registry.list_failures()
+    assert (failure.attempts, failure.error_class) == (3, "HTTPError")
+    # quarantined for 2 hours after the third failure
+    assert registry.quarantined_urls(now=NOW + timedelta(hours=1)) == {URL}
+    assert registry.quarantined_urls(now=NOW + timedelta(hours=3)) == set()
+
+
+def test_success_clears_failure(registry):
+    fail(registry, 3)
+    registry.record_success(URL)
+    registry.close()
+
+    assert registry.list_failures() == []
+
+
+def test_clear(registry):
+    fail(registry, 3)
+    assert registry.clear(package_name="other") == 0
+    assert registry.clear(urls=[URL]) == 1
+    with registry.session_factory() as session:
+        assert session.query(ReapFailures).count() == 0
+
+
+def test_threshold_zero(registry):
+    registry = FailureRegistry(registry.session_factory, threshold=0)
+    assert registry.threshold == 0
+
+
+def test_reap_limit_skips_quarantined(registry, monkeypatch):
+    # the most recent uploads are quarantined, the limit applies to the others
+    packages = [
+        PackageData("pkg", f"pkg-{i}.json", f"{URL}.{i}", timestamp=i) for i in range(5)
+    ]
+    for package in packages[3:]:
+        for _ in range(2):
+            registry.record_failure(package.url, "pkg", "HTTPError", "404")
+    registry.close()
+
+    reaped = []
+    monkeypatch.setattr(core, "install_response_cache", lambda: None)
+    monkeypatch.setattr(core, "diff", lambda *args, **kwargs: packages)
+    monkeypatch.setattr(
+        core, "_reap_threaded", lambda packages, *args, **kwargs: reaped.extend(packages) or []
+    )
+    core.reap("blobs", failures=registry, max_artifacts=2)
+
+    assert [p.url for p in reaped] == [f"{URL}.2", f"{URL}.1"]
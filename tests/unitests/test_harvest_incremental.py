@@ -0,0 +1,258 @@
+import json
+
+import pytest
+
+from cfdb.harvest import incremental
+from cfdb.harvest.incremental import (
+    IncrementalUpdate,
+    RepodataState,
+    SeenIndex,
+    update_from_jlap,
+    url_digest,
+)
+from cfdb.harvest.jlap import (
+    JLAPError,
+    apply_patch,
+    apply_patches,
+    apply_record_operations,
+    group_operations,
+    hash_repodata,
+    keyed_hash,
+    parse_jlap,
+)
+
+ARCH = "https://conda.anaconda.org/conda-forge/noarch"
+
+
+def make_jlap(patches, latest):
+    """Builds a valid .jlap payload out of a list of patches."""
+    iv = b"0" * 64
+    lines = [json.dumps(p).encode() for p in patches]
+    lines.append(json.dumps({"url": "repodata.json", "latest": latest}).encode())
+
+    key = bytes.fromhex(iv.decode())
+    for line in lines:
+        key = keyed_hash(line, key)
+
+    return b"\n".join([iv, *lines, key.hex().encode()]) + b"\n"
+
+
+@pytest.fixture
+def repodata():
+    return {
+        "info": {"subdir": "noarch"},
+        "packages": {},
+        "packages.conda": {
+            "pkg-1.0-0.conda": {"name": "pkg", "version": "1.0"},
+        },
+    }
+
+
+@pytest.fixture
+def patch():
+    return {
+        "from": "a" * 64,
+        "to": "b" * 64,
+        "patch": [
+            {
+                "op": "add",
+                "path": "/packages.conda/pkg-1.1-0.conda",
+                "value": {"name": "pkg", "version": "1.1"},
+            },
+            {"op": "remove", "path": "/packages.conda/pkg-1.0-0.conda"},
+        ],
+    }
+
+
+def test_parse_jlap(patch):
+    jlap = parse_jlap(make_jlap([patch], "b" * 64))
+
+    assert jlap.latest == "b" * 64
+    assert jlap.patches == [patch]
+
+
+def test_parse_jlap_resume(patch):
+    content = make_jlap([patch], "b" * 64)
+    jlap = parse_jlap(content)
+
+    # resuming from the stored offset only needs the metadata and checksum lines
+    partial = parse_jlap(
+        content[jlap.resume_offset :],
+        offset=jlap.resume_offset,
+        key=jlap.resume_key,
+    )
+    assert partial.latest == "b" * 64
+    assert partial.patches == []
+
+
+def test_parse_jlap_checksum_mismatch(patch):
+    content = make_jlap([patch], "b" * 64).replace(b"1.1", b"6.6")
+
+    with pytest.raises(JLAPError):
+        parse_jlap(content)
+
+
+def test_apply_patches(repodata, patch):
+    jlap = parse_jlap(make_jlap([patch], "b" * 64))
+    apply_patches(repodata, "a" * 64, jlap)
+
+    assert list(repodata["packages.conda"]) == ["pkg-1.1-0.conda"]
+
+
+def test_apply_patches_broken_chain(repodata, patch):
+    jlap = parse_jlap(make_jlap([patch], "b" * 64))
+
+    with pytest.raises(JLAPError):
+        apply_patches(repodata, "c" * 64, jlap)
+
+
+def test_apply_patch_list_operations():
+    document = {"removed": ["a", "c"]}
+    apply_patch(
+        document,
+        [
+            {"op": "add", "path": "/removed/1", "value": "b"},
+            {"op": "add", "path": "/removed/-", "value": "d"},
+            {"op": "replace", "path": "/removed/0", "value": "z"},
+        ],
+    )
+    assert document == {"removed": ["z", "b", "c", "d"]}
+
+
+def test_seen_index_roundtrip(tmp_path):
+    urls = [f"{ARCH}/pkg-1.{i}-0.conda" for i in range(10)]
+    index = SeenIndex.from_digests(url_digest(url) for url in urls)
+    index.save(tmp_path / "seen.idx")
+
+    loaded = SeenIndex.load(tmp_path / "seen.idx")
+    assert len(loaded) == 10
+    assert all(url_digest(url) in loaded for url in urls)
+    assert url_digest(f"{ARCH}/other-1.0-0.conda") not in loaded
+
+
+def test_incremental_update_keeps_pending(tmp_path):
+    state = RepodataState(tmp_path, ARCH)
+    urls = [f"{ARCH}/pkg-1.{i}-0.conda" for i in range(3)]
+
+    update = IncrementalUpdate()
+    update.add(state, [url_digest(url) for url in urls])
+    update.commit(pending_urls=[urls[0]])
+
+    seen = state.load_seen()
+    assert url_digest(urls[0]) not in seen
+    assert url_digest(urls[1]) in seen
+    assert url_digest(urls[2]) in seen
+
+
+def test_update_from_jlap(tmp_path, monkeypatch, repodata, patch):
+    state = RepodataState(tmp_path, ARCH)
+    content = json.dumps(repodata).encode()
+    state.save(content, {"have": "a" * 64})
+
+    payload = make_jlap([patch], "b" * 64)
+    monkeypatch.setattr(
+        incremental, "_fetch_jlap", lambda arch, offset=0, key=None: parse_jlap(payload)
+    )
+
+    assert update_from_jlap(state)
+    assert state.load()["have"] == "b" * 64
+
+    expected = apply_patches(repodata, "a" * 64, parse_jlap(payload))
+    assert state.load_snapshot() == expected
+    assert list(expected["packages.conda"]) == ["pkg-1.1-0.conda"]
+
+
+def test_update_from_jlap_up_to_date(tmp_path, monkeypatch, repodata, patch):
+    state = RepodataState(tmp_path, ARCH)
+    content = json.dumps(repodata).encode()
+    state.save(content, {"have": "b" * 64})
+
+    payload = make_jlap([patch], "b" * 64)
+    monkeypatch.setattr(
+        incremental, "_fetch_jlap", lambda arch, offset=0, key=None: parse_jlap(payload)
+    )
+
+    assert update_from_jlap(state)
+    # the snapshot is left untouched, only the resume point is stored
+    assert state.snapshot_path.read_bytes() == content
+    assert state.load()["jlap_offset"] > 0
+
+
+def test_update_from_jlap_streamed_patch(tmp_path, monkeypatch, repodata):
+    state = RepodataState(tmp_path, ARCH)
+    repodata["removed"] = []
+    state.save(json.dumps(repodata).encode(), {"have": "a" * 64})
+
+    chain = [
+        {
+            "from": "a" * 64,
+            "to": "b" * 64,
+            "patch": [
+                {"op": "add", "path": "/removed/-", "value": "pkg-0.9-0.conda"},
+                {
+                    "op": "replace",
+                    "path": "/packages.conda/pkg-1.0-0.conda/version",
+                    "value": "1.0.1",
+                },
+                {
+                    "op": "add",
+                    "path": "/packages/old-1.0-0.tar.bz2",
+                    "value": {"name": "old"},
+                },
+            ],
+        },
+        {
+            "from": "b" * 64,
+            "to": "c" * 64,
+            "patch": [{"op": "remove", "path": "/packages/old-1.0-0.tar.bz2"}],
+        },
+    ]
+    payload = make_jlap(chain, "c" * 64)
+    monkeypatch.setattr(
+        incremental, "_fetch_jlap", lambda arch, offset=0, key=None: parse_jlap(payload)
+    )
+
+    assert update_from_jlap(state)
+    assert state.load()["have"] == "c" * 64
+    assert state.load_snapshot() == apply_patches(repodata, "a" * 64, parse_jlap(payload))
+
+
+def test_update_from_jlap_broken_patch(tmp_path, monkeypatch, repodata):
+    state = RepodataState(tmp_path, ARCH)
+    state.save(json.dumps(repodata).encode(), {"have": "a" * 64})
+
+    patch = {
+        "from": "a" * 64,
+        "to": "b" * 64,
+        "patch": [
+            {"op": "replace", "path": "/packages/missing.tar.bz2/version", "value": "2"}
+        ],
+    }
+    payload = make_jlap([patch], "b" * 64)
+    monkeypatch.setattr(
+        incremental, "_fetch_jlap", lambda arch, offset=0, key=None: parse_jlap(payload)
+    )
+
+    assert not update_from_jlap(state)
+    # a full download is needed on the next run
+    assert state.load() == {}
+
+
+def test_group_operations(patch):
+    info_operation = {"op": "add", "path": "/info/x", "value": 1}
+    records, others = group_operations([patch["patch"], [info_operation]])
+
+    assert others == [info_operation]
+    assert apply_record_operations(None, records[("packages.conda", "pkg-1.1-0.conda")]) == {
+        "name": "pkg",
+        "version": "1.1",
+    }
+    assert apply_record_operations({}, records[("packages.conda", "pkg-1.0-0.conda")]) is None
+
+
+def test_update_from_jlap_without_snapshot(tmp_path):
+    assert not update_from_jlap(RepodataState(tmp_path, ARCH))
+
+
+def test_hash_repodata():
+    assert len(hash_repodata(b"{}")) == 64
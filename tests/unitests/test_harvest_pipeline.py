@@ -0,0 +1,62 @@
+import pytest
+
+from cfdb.harvest import harvester
+from cfdb.harvest.pipeline import HarvestPipeline
+
+from test_harvester import INDEX, make_tar_bz2
+
+ARCH = "https://conda.anaconda.org/conda-forge/noarch"
+
+
+def fetch(package_data):
+    url = package_data[2]
+    if "broken" in url:
+        raise IOError(f"Unable to fetch {url}")
+    return make_tar_bz2(info_first="fallback" not in url).getvalue()
+
+
+@pytest.fixture(autouse=True)
+def reset_scan_stats():
+    harvester.scan_stats.clear()
+    yield
+    harvester.scan_stats.clear()
+
+
+def test_pipeline():
+    packages = [
+        ("pkg", f"conda-forge/noarch/pkg-1.{i}-0.json", f"{ARCH}/pkg-1.{i}-0.tar.bz2")
+        for i in range(4)
+    ]
+    packages.append(
+        ("pkg", "conda-forge/noarch/fallback-1.0-0.json", f"{ARCH}/fallback-1.0-0.tar.bz2")
+    )
+    packages.append(
+        ("pkg", "conda-forge/noarch/broken-1.0-0.json", f"{ARCH}/broken-1.0-0.tar.bz2")
+    )
+
+    written = {}
+
+    def write(package_data, data, blob):
+        written[package_data[1]] = blob
+        return data
+
+    pipeline = HarvestPipeline(
+        fetch, write, download_workers=2, harvest_workers=1, max_pending=2, serialize=True
+    )
+    results = {
+        package_data[2]: (data, error)
+        for package_data, data, error in pipeline.run(packages)
+    }
+
+    assert len(results) == 6
+    data, error = results[f"{ARCH}/pkg-1.0-0.tar.bz2"]
+    assert error is None and data["index"] == INDEX
+    assert isinstance(results[f"{ARCH}/broken-1.0-0.tar.bz2"][1], IOError)
+
+    assert len(written) == 5
+    assert all('"index"' in blob for blob in written.values())
+    # the scan outcomes of the worker processes are merged
+    assert harvester.scan_stats == {"early_exit": 4, "fallback_full_scan": 1}
+    assert pipeline.stats["download"].errors == 1
+    assert pipeline.stats["harvest"].items == 5
+    assert pipeline.stats["write"].items == 5
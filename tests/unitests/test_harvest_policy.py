@@ -0,0 +1,102 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from cfdb.harvest.core import PackageData
+from cfdb.harvest.policy import HarvestPolicy
+from cfdb.harvest.upstream import UpstreamArtifact
+from cfdb.harvest.versions import VersionOrder, sort_key
+
+BASE = "https://conda.anaconda.org/conda-forge"
+
+
+def ms(year, month=1, day=1):
+    return int(datetime(year, month, day, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def artifact(subdir, version, timestamp=None, build_number=0):
+    filename = f"conda-forge/{subdir}/pkg-{version}-{build_number}.json"
+    url = f"{BASE}/{subdir}/pkg-{version}-{build_number}.conda"
+    return filename, UpstreamArtifact(url, None, None, version, build_number, timestamp)
+
+
+@pytest.fixture
+def upstream():
+    return {
+        "pkg": dict(
+            [
+                artifact("linux-64", "1.9", ms(2023)),
+                artifact("linux-64", "1.10", ms(2024)),
+                artifact("linux-64", "1.10", ms(2024), build_number=1),
+                artifact("linux-64", "1.10rc1", ms(2023, 12)),
+                artifact("noarch", "0.5", ms(2020)),
+            ]
+        )
+    }
+
+
+def versions(selected):
+    return sorted(
+        (filename.split("/")[1], a.version, a.build_number)
+        for artifacts in selected.values()
+        for filename, a in artifacts.items()
+    )
+
+
+@pytest.mark.parametrize(
+    "versions_in, expected",
+    [
+        (["1.9", "1.10", "1.10rc1"], ["1.9", "1.10rc1", "1.10"]),
+        (["1.0", "1.0.post1", "1.0dev0", "1.0a1"], ["1.0dev0", "1.0a1", "1.0", "1.0.post1"]),
+        (["2.0", "1!1.0"], ["2.0", "1!1.0"]),
+    ],
+)
+def test_version_order(versions_in, expected):
+    assert sorted(versions_in, key=VersionOrder) == expected
+    assert VersionOrder("1.0") == VersionOrder("1.0.0")
+
+
+def test_policy_latest(upstream):
+    selected = HarvestPolicy(latest=1).select(upstream)
+    assert versions(selected) == [
+        ("linux-64", "1.10", 0),
+        ("linux-64", "1.10", 1),
+        ("noarch", "0.5", 0),
+    ]
+
+
+def test_policy_since_and_subdirs(upstream):
+    selected = HarvestPolicy(since=datetime(2023, 6, 1), subdirs=["linux-64"]).select(
+        upstream
+    )
+    assert versions(selected) == [
+        ("linux-64", "1.10", 0),
+        ("linux-64", "1.10", 1),
+        ("linux-64", "1.10rc1", 0),
+    ]
+
+
+def test_policy_unrestricted(upstream):
+    assert HarvestPolicy().select(upstream) is upstream
+
+
+def test_prioritize(upstream):
+    packages = [
+        PackageData("pkg", filename, *a) for filename, a in upstream["pkg"].items()
+    ]
+    ordered = HarvestPolicy.prioritize(packages)
+    assert [(p.version, p.build_number) for p in ordered[:3]] == [
+        ("1.10", 1),
+        ("1.10", 0),
+        ("1.10rc1", 0),
+    ]
+
+
+def test_version_sort_key():
+    versions = [
+        "1.0dev0", "1.0a1", "1.0", "1.0.1", "1.0.post1", "1.1rc1", "1.1", "1.9", "1.10",
+        "2.0.0+local", "1!0.1",
+    ]
+    assert sorted(versions, key=sort_key) == versions
+    assert sorted(reversed(versions), key=sort_key) == versions
+    assert sort_key("1.0") == sort_key("1.0.0") == sort_key("1_0")
@@ -0,0 +1,96 @@
+import pytest
+
+from cfdb.harvest.local import fetch_jsonblobs
+from cfdb.harvest.store import ShardStore
+from cfdb.models.schema import Artifacts, ArtifactsFilePaths
+from cfdb.populate import artifacts
+
+
+def make_record(name, version, subdir="linux-64", files=()):
+    return {
+        "name": name,
+        "version": version,
+        "index": {
+            "name": name,
+            "version": version,
+            "subdir": subdir,
+            "build_number": 0,
+        },
+        "files": list(files),
+    }
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ShardStore(tmp_path / "store", num_shards=4)
+    store.put(
+        "numpy",
+        "conda-forge/linux-64/numpy-1.25.0-py39_0.json",
+        make_record("numpy", "1.25.0", files=["lib/numpy/__init__.py"]),
+    )
+    store.put(
+        "python",
+        "conda-forge/linux-64/python-3.9.0-0.json",
+        make_record("python", "3.9.0", files=["bin/python", "lib/libpython.so"]),
+    )
+    return store
+
+
+def test_store_get(store):
+    record = store.get("numpy", "conda-forge/linux-64/numpy-1.25.0-py39_0.json")
+    assert record == make_record("numpy", "1.25.0", files=["lib/numpy/__init__.py"])
+
+    with pytest.raises(KeyError):
+        store.get("numpy", "conda-forge/linux-64/missing.json")
+
+
+def test_store_last_record_wins(store):
+    key = "conda-forge/linux-64/numpy-1.25.0-py39_0.json"
+    store.put("numpy", key, make_record("numpy", "1.25.0", files=["other"]))
+
+    reopened = ShardStore(store.root)
+    assert reopened.get("numpy", key)["files"] == ["other"]
+    assert len(list(reopened.entries())) == 2
+
+
+def test_store_reopen_keeps_num_shards(store):
+    assert ShardStore(store.root, num_shards=128).num_shards == 4
+
+
+def test_store_iter_records(store):
+    records = {entry.key: record for entry, record in store.iter_records()}
+    assert records["conda-forge/linux-64/python-3.9.0-0.json"]["version"] == "3.9.0"
+    assert len(records) == 2
+
+
+def test_fetch_jsonblobs_from_store(store):
+    assert fetch_jsonblobs(store.root) == {
+        "numpy": {"conda-forge/linux-64/numpy-1.25.0-py39_0.json"},
+        "python": {"conda-forge/linux-64/python-3.9.0-0.json"},
+    }
+
+
+def test_update_artifacts_from_store(db, store):
+    artifacts.update(db, path=store.root)
+
+    names = {name for (name,) in db.query(Artifacts.name)}
+    assert names == {"linux-64/numpy-1.25.0-py39_0", "linux-64/python-3.9.0-0"}
+
+    paths = {path for (path,) in db.query(ArtifactsFilePaths.path)}
+    assert paths == {"lib/numpy/__init__.py", "bin/python", "lib/libpython.so"}
+
+
+def test_store_skips_partial_index_line(store):
+    key = "conda-forge/linux-64/numpy-1.25.0-py39_0.json"
+    shard = store.shard_for("numpy")
+    # simulate a crash in the middle of an index write
+    with open(store._index_path(shard), "a") as f:
+        f.write("numpy\tconda-forge/linux-64/numpy-2.0")
+
+    reopened = ShardStore(store.root)
+    assert reopened.get("numpy", key)["version"] == "1.25.0"
+
+    # later writes are not merged into the partial line
+    new_key = "conda-forge/linux-64/numpy-2.0.0-py39_0.json"
+    reopened.put("numpy", new_key, make_record("numpy", "2.0.0"))
+    assert ShardStore(store.root).fetch_keys()["numpy"] == {key, new_key}
@@ -0,0 +1,83 @@
+import bz2
+import json
+
+import pytest
+
+from cfdb.harvest.streaming import iter_bz2_chunks, iter_repodata_records
+from cfdb.harvest.upstream import UpstreamArtifact, iter_artifacts, iter_repodata
+
+ARCH = "https://conda.anaconda.org/conda-forge/linux-64"
+
+
+@pytest.fixture
+def repodata():
+    return {
+        "info": {"subdir": "linux-64", "base_url": "https://example.com"},
+        "packages": {
+            "numpy-1.24.0-py39_0.tar.bz2": {
+                "name": "numpy",
+                "build_number": 0,
+                "sha256": "ab" * 32,
+                "size": 1024,
+            },
+        },
+        "packages.conda": {
+            "numpy-1.25.0-py39_0.conda": {"name": "numpy", "build_number": 0},
+            "python-3.9.0-0_cpython.conda": {"name": "python", "depends": ["a", "b"]},
+        },
+        "removed": ["old-1.0-0.tar.bz2"],
+        "repodata_version": 1,
+    }
+
+
+def chunked(data: bytes, size: int):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_iter_repodata_records(repodata, chunk_size):
+    payload = json.dumps(repodata, indent=2).encode()
+
+    records = list(iter_repodata_records(chunked(payload, chunk_size)))
+
+    assert [(section, fn) for section, fn, _ in records] == [
+        ("packages", "numpy-1.24.0-py39_0.tar.bz2"),
+        ("packages.conda", "numpy-1.25.0-py39_0.conda"),
+        ("packages.conda", "python-3.9.0-0_cpython.conda"),
+    ]
+    assert records[2][2] == repodata["packages.conda"]["python-3.9.0-0_cpython.conda"]
+
+
+def test_iter_repodata_records_multibyte_split():
+    payload = json.dumps(
+        {"packages": {"é-1.0-0.tar.bz2": {"name": "é"}}}, ensure_ascii=False
+    ).encode()
+
+    records = list(iter_repodata_records(chunked(payload, 1)))
+    assert records == [("packages", "é-1.0-0.tar.bz2", {"name": "é"})]
+
+
+def test_iter_repodata_records_empty():
+    assert list(iter_repodata_records([b"{ }"])) == []
+
+
+def test_iter_bz2_chunks(repodata):
+    payload = json.dumps(repodata).encode()
+    # two concatenated bz2 streams
+    compressed = bz2.compress(payload[:10]) + bz2.compress(payload[10:])
+
+    assert b"".join(iter_bz2_chunks(chunked(compressed, 5))) == payload
+
+
+def test_iter_artifacts_matches_iter_repodata(repodata):
+    payload = json.dumps(repodata).encode()
+    streamed = set(iter_artifacts(ARCH, iter_repodata_records([payload])))
+
+    assert streamed == set(iter_repodata(ARCH, repodata))
+    assert (
+        "numpy",
+        "conda-forge/linux-64/numpy-1.24.0-py39_0.json",
+        UpstreamArtifact(
+            f"{ARCH}/numpy-1.24.0-py39_0.tar.bz2", "ab" * 32, 1024, None, 0, None
+        ),
+    ) in streamed
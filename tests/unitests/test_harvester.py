@@ -0,0 +1,136 @@
+import io
+import json
+import tarfile
+
+import pytest
+
+from cfdb.harvest import harvester, yaml_loader
+from cfdb.harvest.harvester import harvest
+
+INDEX = {"name": "pkg", "version": "1.0", "subdir": "noarch", "build_number": 0}
+RECIPE = "package:\n  name: pkg\n  version: '1.0'\n"
+
+
+def _add(tf, name, content: bytes):
+    info = tarfile.TarInfo(name)
+    info.size = len(content)
+    tf.addfile(info, io.BytesIO(content))
+
+
+def make_tar_bz2(info_first=True, payload_members=3):
+    info_members = [
+        ("info/index.json", json.dumps(INDEX).encode()),
+        ("info/files", b"site-packages/pkg/__init__.py\nsite-packages/pkg/a.pyc\n"),
+        ("info/about.json", b'{"license": "MIT"}'),
+        ("info/recipe/meta.yaml", RECIPE.encode()),
+        ("info/recipe/build.sh", b"pip install ."),
+    ]
+    payload = [
+        (f"site-packages/pkg/file{i}.py", b"x" * 1024) for i in range(payload_members)
+    ]
+
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:bz2") as tf:
+        members = info_members + payload if info_first else payload + info_members
+        for name, content in members:
+            _add(tf, name, content)
+    buffer.seek(0)
+    return buffer
+
+
+@pytest.fixture(autouse=True)
+def reset_scan_stats():
+    harvester.scan_stats.clear()
+    yield
+    harvester.scan_stats.clear()
+
+
+def test_harvest_early_exit():
+    data = harvest(make_tar_bz2())
+
+    assert data["index"] == INDEX
+    assert data["files"] == ["site-packages/pkg/__init__.py"]
+    assert data["rendered_recipe"] == {"package": {"name": "pkg", "version": "1.0"}}
+    assert harvester.scan_stats == {"early_exit": 1}
+
+
+def test_harvest_early_exit_matches_full_scan():
+    early = harvest(make_tar_bz2())
+    full = harvest(make_tar_bz2(), early_exit=False)
+
+    assert early == full
+    assert harvester.scan_stats == {"early_exit": 1}
+
+
+def test_harvest_fallback_scan():
+    data = harvest(make_tar_bz2(info_first=False))
+
+    assert data["index"] == INDEX
+    assert harvester.scan_stats == {"fallback_full_scan": 1}
+
+
+def test_harvest_fallback_scan_limit():
+    with pytest.raises(RuntimeError):
+        harvest(make_tar_bz2(info_first=False, payload_members=10), max_scan_members=5)
+
+    assert harvester.scan_stats == {"fallback_scan_limit": 1}
+
+
+def test_harvest_lazy_yaml():
+    data = harvest(make_tar_bz2(), lazy_yaml=True)
+
+    assert data["rendered_recipe"] is None
+    assert data["rendered_recipe_yaml"] == RECIPE
+    assert harvester.parse_lazy_yaml(data, "rendered_recipe") == {
+        "package": {"name": "pkg", "version": "1.0"}
+    }
+    # parsed once, then cached in the harvested data
+    assert data["rendered_recipe"] == {"package": {"name": "pkg", "version": "1.0"}}
+    assert harvester.parse_lazy_yaml(data, "conda_build_config") == {}
+
+
+@pytest.mark.parametrize("loader", ["ruamel", "libyaml"])
+def test_yaml_loader_fallback_tags(loader):
+    yaml_loader.configure(loader)
+    try:
+        document = (
+            "a: !!python/object/apply:builtins.getattr [1, 2]\n"
+            "b: [1, 2]\n"
+        )
+        assert yaml_loader.safe_load(document) == {"a": None, "b": [1, 2]}
+    finally:
+        yaml_loader.configure()
+
+
+def test_yaml_loader_default_is_yaml_1_2(monkeypatch):
+    monkeypatch.delenv("CFDB_YAML_LOADER", raising=False)
+    yaml_loader.configure()
+
+    assert yaml_loader.loader_name() == "ruamel"
+    document = "a: on\nb: 010\nc: 1:20\n"
+    assert yaml_loader.safe_load(document) == {"a": "on", "b": 10, "c": "1:20"}
+
+
+def test_yaml_loader_unknown():
+    with pytest.raises(ValueError):
+        yaml_loader.configure("unknown")
+
+
+def test_reap_package_bounds_fallback_scan(monkeypatch):
+    from cfdb.harvest import core
+
+    archive = make_tar_bz2(info_first=False, payload_members=10).getvalue()
+    monkeypatch.setattr(core, "fetch_url", lambda url, *args, **kwargs: archive)
+    package_data = (
+        "pkg",
+        "conda-forge/noarch/pkg-1.0-0.json",
+        "https://host/pkg-1.0-0.tar.bz2",
+    )
+
+    with pytest.raises(core.ReapFailure):
+        core.reap_package(package_data, write_blobs=False, max_scan_members=5)
+    assert harvester.scan_stats == {"fallback_scan_limit": 1}
+
+    data = core.reap_package(package_data, write_blobs=False)
+    assert data["index"] == INDEX
+    assert harvester.scan_stats["fallback_full_scan"] == 1
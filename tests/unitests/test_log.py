@@ -0,0 +1,62 @@
+import logging
+
+import pytest
+
+from cfdb import log
+
+
+@pytest.fixture
+def cfdb_logger():
+    logger = logging.getLogger("cfdb")
+    handlers, level = logger.handlers[:], logger.level
+    logger.handlers.clear()
+    yield logger
+    log.stop_logging()
+    for handler in logger.handlers:
+        handler.close()
+    logger.handlers[:] = handlers
+    logger.setLevel(level)
+
+
+def test_initialize_logging(tmp_path, monkeypatch, cfdb_logger):
+    # the directory is read as a string from the environment
+    monkeypatch.setenv("CFDB_LOGGING_DIR", str(tmp_path / "logs"))
+    monkeypatch.setenv(log.LOG_LEVEL_ENV, "info")
+    log.initialize_logging()
+
+    logger = logging.getLogger("cfdb.populate.artifacts")
+    logger.debug("Updating %s", "numpy")
+    logger.info("Updating %s", "scipy")
+    log.stop_logging()
+
+    (path,) = (tmp_path / "logs").iterdir()
+    content = path.read_text()
+    assert "Updating scipy" in content
+    assert "numpy" not in content
+
+
+def test_item_log(caplog):
+    logger = logging.getLogger("cfdb.test_log")
+    with caplog.at_level(logging.DEBUG, logger="cfdb"):
+        with log.ItemLog(logger, "Updating", every=3, limit=2) as items:
+            for i in range(10):
+                items.log("item %d", i)
+
+    assert [record.getMessage() for record in caplog.records] == [
+        "item 0",
+        "item 3",
+        "Updating: logged 2 of 10 messages",
+    ]
+
+
+def test_item_log_from_environment(caplog, monkeypatch):
+    monkeypatch.setenv(log.LOG_ITEMS_LIMIT_ENV, "0")
+    logger = logging.getLogger("cfdb.test_log")
+    with caplog.at_level(logging.DEBUG, logger="cfdb"):
+        with log.ItemLog(logger, "Updating") as items:
+            for i in range(5):
+                items.log("item %d", i)
+
+    assert [record.getMessage() for record in caplog.records] == [
+        "Updating: logged 0 of 5 messages"
+    ]
@@ -0,0 +1,36 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import cfdb
+
+HEAVY_MODULES = ["sqlalchemy", "requests", "requests_cache", "ruamel.yaml", "cfdb.handler"]
+
+
+def test_help_is_lazy(tmp_path):
+    # `cfdb --help` imports neither the database nor the harvesting stacks, and
+    # creates neither the logs nor the response cache
+    code = (
+        "import json, sys\n"
+        "from cfdb.main import app\n"
+        "try:\n"
+        "    app(['--help'])\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        f"print(json.dumps([name for name in {HEAVY_MODULES!r} if name in sys.modules]))\n"
+    )
+    env = {**os.environ, "PYTHONPATH": str(Path(cfdb.__file__).parents[1])}
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=tmp_path,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    assert "update-artifacts" in result.stdout
+    assert json.loads(result.stdout.splitlines()[-1]) == []
+    assert list(tmp_path.iterdir()) == []
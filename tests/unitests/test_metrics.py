@@ -0,0 +1,85 @@
+import json
+from datetime import datetime
+
+import pytest
+
+from cfdb import metrics
+from cfdb.models.schema import RunHistory
+from cfdb.populate.utils import traverse_files
+
+
+@pytest.fixture
+def registry():
+    metrics.registry.reset()
+    yield metrics.registry
+    metrics.registry.reset()
+
+
+def test_metrics():
+    registry = metrics.Metrics()
+    assert not registry
+
+    with registry.timer("stage"):
+        pass
+
+    @registry.timer("stage")
+    def run():
+        registry.incr("rows", 2)
+
+    run()
+    registry.incr("rows")
+    registry.gauge("left", 5)
+    registry.gauge("left", 3)
+    registry.observe("worker", 1.5, count=4)
+
+    snapshot = registry.snapshot()
+    assert snapshot["timers"]["stage"]["count"] == 2
+    assert snapshot["timers"]["worker"] == {"count": 4, "seconds": 1.5}
+    assert snapshot["counters"] == {"rows": 3}
+    assert snapshot["gauges"] == {"left": 3}
+
+
+def test_report(tmp_path, db):
+    registry = metrics.Metrics()
+    registry.observe("populate.traverse", 0.25)
+    registry.incr("db.artifacts.inserted", 10)
+    registry.gauge("harvest.outstanding", 7)
+    report = metrics.build_report(
+        "update-artifacts", "done", datetime(2024, 1, 1), 1.5, metrics=registry
+    )
+
+    metrics.write_report(tmp_path / "report.json", report)
+    assert json.loads((tmp_path / "report.json").read_text()) == report
+
+    metrics.write_prometheus(tmp_path / "cfdb.prom", report)
+    lines = (tmp_path / "cfdb.prom").read_text().splitlines()
+    labels = '{command="update-artifacts"}'
+    assert f"cfdb_run_success{labels} 1" in lines
+    assert f"cfdb_run_timestamp_seconds{labels} 1704067200.0" in lines
+    assert "# TYPE cfdb_populate_traverse_seconds_total counter" in lines
+    assert f"cfdb_populate_traverse_seconds_total{labels} 0.25" in lines
+    assert f"cfdb_db_artifacts_inserted_total{labels} 10" in lines
+    assert f"cfdb_harvest_outstanding{labels} 7" in lines
+
+    metrics.record_run(db, report)
+    db.commit()
+    run = db.query(RunHistory).one()
+    assert (run.command, run.status, run.started_at) == (
+        "update-artifacts",
+        "done",
+        datetime(2024, 1, 1),
+    )
+    assert json.loads(run.report)["counters"] == {"db.artifacts.inserted": 10}
+
+
+def test_traverse_files_metrics(tmp_path, registry):
+    for i in range(3):
+        (tmp_path / f"{i}.json").write_text("{}")
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+
+    traverse_files(tmp_path, output_dir)
+
+    snapshot = registry.snapshot()
+    assert snapshot["counters"] == {"populate.hash.files": 3, "populate.traverse.files": 3}
+    assert snapshot["timers"]["populate.traverse"]["count"] == 1
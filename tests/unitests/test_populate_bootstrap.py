@@ -0,0 +1,88 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from cfdb.harvest.local import query_existing_artifacts
+from cfdb.models.schema import (
+    ArtifactDependencies,
+    Artifacts,
+    ArtifactsBackfill,
+    Base,
+    Packages,
+    RelationsMapFilePaths,
+)
+from cfdb.populate import bootstrap
+from cfdb.populate.ingest import write_batch
+
+ARCH = "https://conda.anaconda.org/conda-forge/linux-64"
+
+
+def repodata_records():
+    numpy = {
+        "name": "numpy",
+        "version": "1.25.0",
+        "build_number": 0,
+        "subdir": "linux-64",
+        "depends": ["python >=3.9,<3.10.0a0", "libblas>=3.9.0", "python_abi 3.9.* *_cp39"],
+    }
+    return [
+        (ARCH, "numpy-1.25.0-py39_0.tar.bz2", numpy),
+        (ARCH, "numpy-1.25.0-py39_0.conda", numpy),
+        (ARCH, "python-3.9.0-0.conda", {"name": "python", "version": "3.9.0", "build_number": 0}),
+    ]
+
+
+def test_bootstrap(db):
+    assert bootstrap.update(db, repodata_records(), batch_size=2) == 2
+
+    assert {name for (name,) in db.query(Packages.name)} == {"numpy", "python"}
+    artifact = db.query(Artifacts).filter(Artifacts.name == "linux-64/numpy-1.25.0-py39_0").one()
+    assert (artifact.platform, artifact.version, artifact.build) == ("linux-64", "1.25.0", "0")
+    assert {
+        (d.package_name, d.spec)
+        for d in db.query(ArtifactDependencies).filter(
+            ArtifactDependencies.artifact_name == artifact.name
+        )
+    } == {
+        ("python", "python >=3.9,<3.10.0a0"),
+        ("libblas", "libblas>=3.9.0"),
+        ("python_abi", "python_abi 3.9.* *_cp39"),
+    }
+    assert db.query(ArtifactsBackfill).count() == 2
+
+    # bootstrapping again is a no-op
+    assert bootstrap.update(db, repodata_records()) == 0
+    assert db.query(ArtifactDependencies).count() == 3
+
+
+def test_bootstrapped_artifacts_are_backfilled(tmp_path):
+    db_url = f"sqlite:///{tmp_path}/bootstrap.db"
+    engine = create_engine(db_url)
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    bootstrap.update(session, repodata_records())
+
+    # the harvester still reports them as missing
+    assert query_existing_artifacts(db_url) == []
+
+    record = {
+        "pkg": "numpy",
+        "arch": "linux-64",
+        "name": "numpy-1.25.0-py39_0",
+        "index": {"version": "1.25.0", "build_number": 0},
+        "files": ["lib/numpy/__init__.py"],
+    }
+    assert write_batch(session, [record]) == 1
+    session.commit()
+
+    assert session.query(Artifacts).count() == 2
+    assert session.query(RelationsMapFilePaths).count() == 1
+    assert [name for (name,) in session.query(ArtifactsBackfill.artifact_name)] == [
+        "linux-64/python-3.9.0-0"
+    ]
+    assert [a.name for a in query_existing_artifacts(db_url)] == [
+        "linux-64/numpy-1.25.0-py39_0"
+    ]
+    # once backfilled, the artifact is skipped
+    assert write_batch(session, [record]) == 0
+    session.close()
+    engine.dispose()
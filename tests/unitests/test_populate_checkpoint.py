@@ -0,0 +1,66 @@
+import pytest
+
+from cfdb.harvest.store import ShardStore
+from cfdb.models.schema import Artifacts, ReverseDependencies
+from cfdb.populate import artifacts
+from cfdb.populate.checkpoint import Checkpoint
+
+from test_harvest_store import make_record
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ShardStore(tmp_path / "store", num_shards=2)
+    for name, depends in [("numpy", []), ("scipy", ["numpy"]), ("pandas", ["numpy"])]:
+        record = make_record(name, "1.0", files=[f"lib/{name}.py"])
+        record["index"]["depends"] = depends
+        store.put(name, f"conda-forge/linux-64/{name}-1.0-0.json", record)
+    return store
+
+
+def test_update_resumes_from_checkpoint(db, store, tmp_path, monkeypatch):
+    checkpoint_dir = tmp_path / "checkpoints"
+    update_filepaths_table = artifacts.update_filepaths_table
+    calls = []
+
+    def interrupt(*args, **kwargs):
+        calls.append(args)
+        if len(calls) == 2:
+            raise KeyboardInterrupt
+        return update_filepaths_table(*args, **kwargs)
+
+    monkeypatch.setattr(artifacts, "update_filepaths_table", interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        artifacts.update(db, path=store.root, checkpoint_dir=checkpoint_dir)
+    db.rollback()
+
+    checkpoint = Checkpoint(checkpoint_dir, store.root, db.get_bind().url.render_as_string())
+    plan, completed = checkpoint.load()
+    assert completed == 1
+    assert db.query(Artifacts).count() == 1
+
+    # the resumed run neither traverses nor compares the files
+    monkeypatch.setattr(artifacts, "update_filepaths_table", update_filepaths_table)
+    monkeypatch.setattr(artifacts, "_plan", pytest.fail)
+    artifacts.update(db, path=store.root, checkpoint_dir=checkpoint_dir)
+
+    assert {name for (name,) in db.query(Artifacts.name)} == {
+        "linux-64/numpy-1.0-0",
+        "linux-64/scipy-1.0-0",
+        "linux-64/pandas-1.0-0",
+    }
+    assert {
+        (row.package_name, row.dependent_name) for row in db.query(ReverseDependencies)
+    } == {("numpy", "scipy"), ("numpy", "pandas")}
+    assert checkpoint.load() is None
+    assert not checkpoint.root.exists()
+
+
+def test_update_without_resume(db, store, tmp_path):
+    checkpoint = Checkpoint(tmp_path, store.root, db.get_bind().url.render_as_string())
+    checkpoint.start({"numpy": [("missing.json", "linux-64", "1.0", "0")]})
+
+    artifacts.update(db, path=store.root, checkpoint_dir=tmp_path, resume=False)
+
+    assert db.query(Artifacts).count() == 3
+    assert checkpoint.load() is None
@@ -0,0 +1,91 @@
+import pytest
+
+from cfdb.models.schema import ArtifactDependencies, DependencyClosure
+from cfdb.populate import dependencies
+from cfdb.populate.ingest import write_batch
+
+
+def make_record(pkg, arch, depends=(), constrains=()):
+    return {
+        "pkg": pkg,
+        "arch": arch,
+        "name": f"{pkg}-1.0-0",
+        "index": {
+            "name": pkg,
+            "version": "1.0",
+            "build_number": 0,
+            "depends": list(depends),
+            "constrains": list(constrains),
+        },
+        "files": [],
+    }
+
+
+def closure(db, platform):
+    return sorted(
+        db.query(DependencyClosure.package_name, DependencyClosure.dependent_name).filter(
+            DependencyClosure.platform == platform
+        )
+    )
+
+
+@pytest.fixture
+def graph(db):
+    write_batch(
+        db,
+        [
+            make_record("zlib", "linux-64"),
+            make_record("lib", "linux-64", ["zlib >=1.2"], constrains=["app >=1"]),
+            make_record("app", "linux-64", ["lib", "zlib"]),
+            make_record("tool", "noarch", ["app"]),
+            make_record("lib2", "osx-64", ["zlib"]),
+        ],
+    )
+    db.commit()
+    return db
+
+
+@pytest.mark.parametrize(
+    "spec, name",
+    [
+        ("python >=3.9,<3.10.0a0", "python"),
+        ("libblas>=3.9.0", "libblas"),
+        ("openssl", "openssl"),
+        ("__glibc >=2.17", "__glibc"),
+    ],
+)
+def test_dependency_name(spec, name):
+    assert dependencies.dependency_name(spec) == name
+
+
+def test_dependency_kinds(graph):
+    rows = graph.query(ArtifactDependencies.kind, ArtifactDependencies.spec).filter(
+        ArtifactDependencies.artifact_name == "linux-64/lib-1.0-0"
+    )
+    assert sorted(rows) == [("constrains", "app >=1"), ("depends", "zlib >=1.2")]
+    # constraints are not dependencies
+    assert dependencies.reverse_dependencies(graph, "app", "linux-64") == ["tool"]
+
+
+def test_reverse_dependencies(graph):
+    assert dependencies.reverse_dependencies(graph, "zlib", "linux-64") == ["app", "lib"]
+    assert dependencies.reverse_dependencies(graph, "zlib", "linux-64", transitive=True) == [
+        "app",
+        "lib",
+        "tool",
+    ]
+    assert dependencies.reverse_dependencies(graph, "zlib", "osx-64", transitive=True) == [
+        "lib2"
+    ]
+
+
+def test_closure_is_extended_incrementally(graph):
+    write_batch(graph, [make_record("cli", "linux-64", ["tool"])])
+    graph.commit()
+
+    assert "cli" in dependencies.reverse_dependencies(
+        graph, "zlib", "linux-64", transitive=True
+    )
+    incremental = closure(graph, "linux-64")
+    dependencies.rebuild_closure(graph, "linux-64")
+    assert closure(graph, "linux-64") == incremental
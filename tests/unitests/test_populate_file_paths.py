@@ -0,0 +1,65 @@
+from sqlalchemy import create_engine, inspect, text
+
+from cfdb.models.schema import ArtifactsFilePaths, Base, RelationsMapFilePaths
+from cfdb.populate import artifacts, file_paths
+
+from test_harvest_store import make_record
+from test_populate_packages import write_json
+
+
+def test_shared_paths_are_linked(db, tmp_path):
+    root = tmp_path / "artifacts"
+    for name in ("python", "pypy"):
+        record = make_record(name, "3.12", files=["bin/python", f"lib/lib{name}.so"])
+        write_json(root / name / "conda-forge" / "linux-64" / f"{name}-3.12-0.json", record)
+
+    artifacts.update(db, path=root)
+
+    links = set(
+        db.query(RelationsMapFilePaths.artifact_name, ArtifactsFilePaths.path).join(
+            ArtifactsFilePaths, ArtifactsFilePaths.id == RelationsMapFilePaths.file_path_id
+        )
+    )
+    assert links == {
+        ("linux-64/python-3.12-0", "bin/python"),
+        ("linux-64/python-3.12-0", "lib/libpython.so"),
+        ("linux-64/pypy-3.12-0", "bin/python"),
+        ("linux-64/pypy-3.12-0", "lib/libpypy.so"),
+    }
+    assert db.query(ArtifactsFilePaths).count() == 3
+
+    # re-runs are no-ops
+    assert file_paths.link_files(
+        db, {"linux-64/pypy-3.12-0": ["bin/python", "lib/libpypy.so", "bin/python"]}
+    ) == (0, 0)
+    assert file_paths.link_files(db, {"linux-64/pypy-3.12-0": ["bin/pypy"]}) == (1, 1)
+
+
+def test_create_indexes(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/cfdb.db")
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        # a database created before the indexes, with a duplicated link
+        conn.execute(text("DROP INDEX relations_map_file_paths_index"))
+        conn.execute(text("DROP INDEX artifacts_file_paths_path_index"))
+        for _ in range(2):
+            conn.execute(
+                text(
+                    "INSERT INTO relations_map_file_paths (file_path_id, artifact_name) "
+                    "VALUES ('1', 'linux-64/python-3.12-0')"
+                )
+            )
+
+    file_paths.create_indexes(engine)
+
+    indexes = {
+        index["name"]: index["unique"]
+        for table in ("artifacts_file_paths", "relations_map_file_paths")
+        for index in inspect(engine).get_indexes(table)
+    }
+    assert indexes["relations_map_file_paths_index"]
+    assert "artifacts_file_paths_path_index" in indexes
+    with engine.connect() as conn:
+        count = conn.execute(text("SELECT COUNT(*) FROM relations_map_file_paths"))
+        assert count.scalar() == 1
+    engine.dispose()
@@ -0,0 +1,106 @@
+import threading
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from cfdb.models.schema import (
+    Artifacts,
+    ArtifactsFilePaths,
+    Base,
+    Packages,
+    RelationsMapFilePaths,
+)
+from cfdb.populate.ingest import ArtifactWriter, write_batch
+
+
+def make_record(pkg, name, files, arch="linux-64"):
+    return {
+        "pkg": pkg,
+        "arch": arch,
+        "channel": "conda-forge",
+        "name": name,
+        "index": {"name": pkg, "version": "1.0", "build_number": 0, "subdir": arch},
+        "files": files,
+    }
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/ingest.db")
+    Base.metadata.create_all(engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def test_write_batch(db):
+    records = [
+        make_record("numpy", "numpy-1.0-py39_0", ["lib/numpy.py", "lib/common.h"]),
+        make_record("scipy", "scipy-1.0-py39_0", ["lib/scipy.py", "lib/common.h"]),
+    ]
+
+    assert write_batch(db, records) == 2
+    db.commit()
+
+    assert {name for (name,) in db.query(Packages.name)} == {"numpy", "scipy"}
+    artifact = db.query(Artifacts).filter(Artifacts.name == "linux-64/numpy-1.0-py39_0").one()
+    assert (artifact.package_name, artifact.version, artifact.build) == ("numpy", "1.0", "0")
+    assert db.query(ArtifactsFilePaths).count() == 3
+    # the shared path is linked to both artifacts
+    assert db.query(RelationsMapFilePaths).count() == 4
+
+    # already ingested artifacts are skipped
+    assert write_batch(db, records) == 0
+
+
+def test_artifact_writer(session_factory):
+    with ArtifactWriter(session_factory, batch_size=2) as writer:
+        for i in range(5):
+            writer.submit(make_record("pkg", f"pkg-1.{i}-0", [f"lib/file{i}"]))
+
+    assert writer.written == 5
+    with session_factory() as session:
+        assert session.query(Artifacts).count() == 5
+        assert session.query(ArtifactsFilePaths).count() == 5
+
+
+def test_artifact_writer_error(session_factory):
+    writer = ArtifactWriter(session_factory)
+    writer.start()
+    writer.submit({"invalid": "record"})
+
+    errors = []
+
+    def close():
+        try:
+            writer.close()
+        except Exception as e:
+            errors.append(e)
+
+    # a failing final flush must not leave close() waiting forever
+    closer = threading.Thread(target=close, daemon=True)
+    closer.start()
+    closer.join(timeout=10)
+
+    assert not closer.is_alive()
+    assert len(errors) == 1 and isinstance(errors[0], KeyError)
+
+
+def test_artifact_writer_error_in_block(session_factory):
+    # the error of the block propagates, not the one of the writer
+    with pytest.raises(ValueError, match="harvest failed"):
+        with ArtifactWriter(session_factory) as writer:
+            writer.submit({"invalid": "record"})
+            raise ValueError("harvest failed")
+    assert isinstance(writer._error, KeyError)
+
+
+def test_write_batch_links_existing_paths(db):
+    write_batch(db, [make_record("numpy", "numpy-1.0-py39_0", ["lib/common.h"])])
+    db.commit()
+    write_batch(db, [make_record("scipy", "scipy-1.0-py39_0", ["lib/common.h"])])
+    db.commit()
+
+    assert db.query(ArtifactsFilePaths).count() == 1
+    names = {name for (name,) in db.query(RelationsMapFilePaths.artifact_name)}
+    assert names == {"linux-64/numpy-1.0-py39_0", "linux-64/scipy-1.0-py39_0"}
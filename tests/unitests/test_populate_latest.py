@@ -0,0 +1,47 @@
+from cfdb.harvest.versions import sort_key
+from cfdb.models.schema import LatestArtifacts
+from cfdb.populate import latest
+from cfdb.populate.ingest import write_batch
+
+
+def make_record(pkg, version, build_number=0, arch="linux-64", variant="py39"):
+    return {
+        "pkg": pkg,
+        "arch": arch,
+        "name": f"{pkg}-{version}-{variant}_{build_number}",
+        "index": {"name": pkg, "version": version, "build_number": build_number},
+        "files": [],
+    }
+
+
+def test_latest_artifact(db):
+    write_batch(
+        db,
+        [
+            make_record("numpy", "1.9.0"),
+            make_record("numpy", "1.10.0rc1"),
+            make_record("numpy", "1.10.0", build_number=1),
+            make_record("numpy", "1.10.0"),
+            make_record("numpy", "2.0.0", arch="osx-64"),
+        ],
+    )
+    db.commit()
+
+    artifact = latest.latest_artifact(db, "numpy", "linux-64")
+    assert artifact.artifact_name == "linux-64/numpy-1.10.0-py39_1"
+    assert artifact.version_key == sort_key("1.10.0")
+    assert latest.latest_artifact(db, "numpy", "osx-64").version == "2.0.0"
+    assert latest.latest_artifact(db, "numpy", "win-64") is None
+
+
+def test_latest_artifact_is_refreshed_for_touched_packages(db):
+    write_batch(db, [make_record("numpy", "1.0"), make_record("scipy", "1.0")])
+    db.commit()
+    scipy = latest.latest_artifact(db, "scipy", "linux-64")
+
+    write_batch(db, [make_record("numpy", "1.1", variant="py310")])
+    db.commit()
+
+    assert latest.latest_artifact(db, "numpy", "linux-64").version == "1.1"
+    assert db.query(LatestArtifacts).count() == 2
+    assert latest.latest_artifact(db, "scipy", "linux-64") is scipy
@@ -0,0 +1,90 @@
+import json
+import re
+
+import pytest
+from sqlalchemy import event
+
+from cfdb.handler import CFDBHandler
+from cfdb.harvest.store import ShardStore
+from cfdb.models.schema import FeedstockOutputs, ImportToPackageMaps, Packages
+from cfdb.populate import feedstock_outputs
+from cfdb.populate.packages import PackageRegistry
+
+PACKAGES_QUERY = re.compile(r"\bFROM packages\b", re.IGNORECASE)
+
+
+def write_json(path, payload):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(payload))
+
+
+def test_registry(db):
+    db.add(Packages(name="numpy"))
+    db.commit()
+
+    registry = PackageRegistry()
+    assert registry.add_all(db, ["numpy", "scipy", "scipy"]) == 1
+    assert registry.flush(db) == 1
+    assert registry.flush(db) == 0
+    db.commit()
+
+    assert {name for (name,) in db.query(Packages.name)} == {"numpy", "scipy"}
+
+
+def test_updates_share_the_registry(tmp_path):
+    outputs = tmp_path / "outputs"
+    write_json(outputs / "numpy.json", {"feedstocks": ["numpy-feedstock"]})
+    write_json(outputs / "scipy.json", {"feedstocks": ["scipy-feedstock"]})
+
+    import_maps = tmp_path / "import_maps"
+    write_json(import_maps / "nu.json", {"numpy": {"elements": ["numpy", "numpy-base"]}})
+
+    store = ShardStore(tmp_path / "store", num_shards=2)
+    store.put(
+        "numpy",
+        "conda-forge/linux-64/numpy-1.25.0-py39_0.json",
+        {
+            "index": {"name": "numpy", "version": "1.25.0", "subdir": "linux-64", "build_number": 0},
+            "files": ["lib/numpy.py"],
+        },
+    )
+
+    handler = CFDBHandler(f"sqlite:///{tmp_path}/cfdb.db")
+    statements = []
+    event.listen(
+        handler.engine,
+        "before_cursor_execute",
+        lambda conn, cursor, statement, *args: statements.append(statement),
+    )
+
+    handler.update_feedstock_outputs(outputs)
+    handler.update_import_to_package_maps(import_maps)
+    handler.update_artifacts(store.root)
+
+    assert len([s for s in statements if PACKAGES_QUERY.search(s)]) == 1
+    with handler.Session() as session:
+        assert {name for (name,) in session.query(Packages.name)} == {
+            "numpy",
+            "numpy-base",
+            "scipy",
+        }
+        assert session.query(FeedstockOutputs).count() == 2
+        assert session.query(ImportToPackageMaps).count() == 2
+
+
+def test_handler_invalidates_registry_on_error(tmp_path, monkeypatch):
+    handler = CFDBHandler(f"sqlite:///{tmp_path}/cfdb.db")
+
+    def failing_update(session, packages, **kwargs):
+        packages.add(session, "numpy")
+        packages.flush(session)
+        raise RuntimeError("interrupted")
+
+    monkeypatch.setattr(feedstock_outputs, "update", failing_update)
+    with pytest.raises(RuntimeError):
+        handler.update_feedstock_outputs(tmp_path)
+
+    # the insert was rolled back, the name is queued again
+    with handler.Session() as session:
+        assert session.query(Packages).count() == 0
+        assert handler.packages.add(session, "numpy")
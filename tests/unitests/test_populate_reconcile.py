@@ -0,0 +1,197 @@
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from cfdb.models.schema import (
+    ArtifactDependencies,
+    Artifacts,
+    ArtifactsFilePaths,
+    Base,
+    DependencyClosure,
+    FeedstockOutputs,
+    Feedstocks,
+    ImportToPackageMaps,
+    LatestArtifacts,
+    RelationsMapFilePaths,
+    ReverseDependencies,
+    uniq_id,
+)
+from cfdb.populate import artifacts, feedstock_outputs, import_to_package_maps, reconcile
+
+from test_harvest_store import make_record
+from test_populate_packages import write_json
+
+
+def write_artifact(root, name, depends=()):
+    record = make_record(name, "1.0", files=[f"lib/{name}.py"])
+    record["index"]["depends"] = list(depends)
+    path = root / name / "conda-forge" / "linux-64" / f"{name}-1.0-0.json"
+    write_json(path, record)
+    return path
+
+
+def test_prune_artifacts(db, tmp_path):
+    root = tmp_path / "artifacts"
+    write_artifact(root, "numpy")
+    scipy = write_artifact(root, "scipy", depends=["numpy"])
+    write_artifact(root, "pandas", depends=["numpy", "scipy"])
+    artifacts.update(db, path=root)
+    assert db.query(DependencyClosure).count() == 3
+
+    scipy.unlink()
+    # the removed artifacts are left as is unless pruning
+    artifacts.update(db, path=root)
+    assert db.query(Artifacts).count() == 3
+
+    artifacts.update(db, path=root, prune=True)
+
+    assert {name for (name,) in db.query(Artifacts.name)} == {
+        "linux-64/numpy-1.0-0",
+        "linux-64/pandas-1.0-0",
+    }
+    assert {path for (path,) in db.query(ArtifactsFilePaths.path)} == {
+        "lib/numpy.py",
+        "lib/pandas.py",
+    }
+    assert db.query(RelationsMapFilePaths).count() == 2
+    assert db.query(ArtifactDependencies).filter(
+        ArtifactDependencies.artifact_name == "linux-64/scipy-1.0-0"
+    ).count() == 0
+    assert {
+        (row.package_name, row.dependent_name) for row in db.query(ReverseDependencies)
+    } == {("numpy", "pandas"), ("scipy", "pandas")}
+    assert {
+        (row.package_name, row.dependent_name) for row in db.query(DependencyClosure)
+    } == {("numpy", "pandas"), ("scipy", "pandas")}
+    assert {row.package_name for row in db.query(LatestArtifacts)} == {"numpy", "pandas"}
+
+
+def test_prune_keeps_modified_artifacts(db, tmp_path, monkeypatch):
+    root = tmp_path / "artifacts"
+    write_artifact(root, "numpy")
+    write_artifact(root, "scipy", depends=["numpy"])
+    artifacts.update(db, path=root)
+
+    record = make_record("numpy", "1.0", files=["lib/numpy.py", "lib/extra.py"])
+    record["index"]["build_number"] = 1
+    write_json(root / "numpy" / "conda-forge" / "linux-64" / "numpy-1.0-0.json", record)
+    removed = []
+    monkeypatch.setattr(
+        reconcile, "remove_artifacts", lambda session, names: removed.extend(names)
+    )
+    artifacts.update(db, path=root, prune=True)
+
+    # updated in place, not deleted and inserted again
+    assert removed == []
+    assert db.query(Artifacts).count() == 2
+    assert {path for (path,) in db.query(ArtifactsFilePaths.path)} == {
+        "lib/numpy.py",
+        "lib/extra.py",
+        "lib/scipy.py",
+    }
+
+
+def test_collect_file_paths(db):
+    python, orphan = uniq_id(), uniq_id()
+    db.add_all(
+        [
+            ArtifactsFilePaths(id=python, path="bin/python"),
+            ArtifactsFilePaths(id=orphan, path="bin/orphan"),
+            RelationsMapFilePaths(
+                file_path_id=python, artifact_name="linux-64/python-3.12-0"
+            ),
+        ]
+    )
+    db.commit()
+
+    assert reconcile.collect_file_paths(db) == 1
+    assert [path for (path,) in db.query(ArtifactsFilePaths.path)] == ["bin/python"]
+
+
+def test_prune_feedstock_outputs(db, tmp_path):
+    outputs = tmp_path / "outputs"
+    write_json(outputs / "numpy.json", {"feedstocks": ["numpy-feedstock"]})
+    write_json(outputs / "scipy.json", {"feedstocks": ["scipy-feedstock"]})
+    feedstock_outputs.update(db, path=outputs)
+
+    (outputs / "scipy.json").unlink()
+    feedstock_outputs.update(db, path=outputs, prune=True)
+
+    assert [name for (name,) in db.query(FeedstockOutputs.package_name)] == ["numpy"]
+    assert [name for (name,) in db.query(Feedstocks.name)] == ["numpy-feedstock"]
+
+
+def test_prune_import_maps(db, tmp_path):
+    import_maps = tmp_path / "import_maps"
+    write_json(import_maps / "nu.json", {"numpy": {"elements": ["numpy"]}})
+    write_json(import_maps / "sc.json", {"scipy": {"elements": ["scipy"]}})
+    import_to_package_maps.update(db, path=import_maps)
+
+    # a modified file replaces its mappings, a removed one drops them
+    write_json(import_maps / "nu.json", {"numpy": {"elements": ["numpy", "numpy-base"]}})
+    (import_maps / "sc.json").unlink()
+    import_to_package_maps.update(db, path=import_maps, prune=True)
+
+    assert {
+        (row.import_name, row.parent_package_name) for row in db.query(ImportToPackageMaps)
+    } == {("numpy", "numpy"), ("numpy", "numpy-base")}
+
+
+def test_prune_import_maps_by_path(db, tmp_path):
+    import_maps = tmp_path / "import_maps"
+    write_json(import_maps / "nu.json", {"numpy": {"elements": ["numpy"]}})
+    write_json(import_maps / "np.json", {"numpy": {"elements": ["numpy"]}})
+    write_json(import_maps / "sc.json", {"scipy": {"elements": ["scipy"]}})
+    import_to_package_maps.update(db, path=import_maps)
+    assert db.query(ImportToPackageMaps).count() == 2
+
+    # an identical file still holds the mapping, a renamed one moves it
+    (import_maps / "nu.json").unlink()
+    (import_maps / "sc.json").rename(import_maps / "sc.py.json")
+    import_to_package_maps.update(db, path=import_maps, prune=True)
+
+    assert {
+        (row.import_name, row.path, row.partition) for row in db.query(ImportToPackageMaps)
+    } == {("numpy", "np.json", ""), ("scipy", "sc.py.json", "py")}
+
+
+def test_prune_import_maps_without_path(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/cfdb.db")
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX import_to_package_mapping_path_index"))
+        conn.execute(text("ALTER TABLE import_to_package_mapping DROP COLUMN path"))
+    import_to_package_maps.add_path_column(engine)
+
+    import_maps = tmp_path / "import_maps"
+    write_json(import_maps / "nu.json", {"numpy": {"elements": ["numpy"]}})
+    with sessionmaker(bind=engine)() as session:
+        session.add(
+            ImportToPackageMaps(
+                id=uniq_id(), import_name="scipy", parent_package_name="scipy", hash="0"
+            )
+        )
+        session.commit()
+        import_to_package_maps.update(session, path=import_maps, prune=True)
+
+        assert [
+            (row.import_name, row.path) for row in session.query(ImportToPackageMaps)
+        ] == [("numpy", "nu.json")]
+    engine.dispose()
+
+
+def test_vacuum(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/cfdb.db")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE blobs (data BLOB)"))
+        conn.execute(text("INSERT INTO blobs VALUES (zeroblob(100000))"))
+
+    reconcile.vacuum(engine)
+    with engine.begin() as conn:
+        assert conn.execute(text("PRAGMA auto_vacuum")).scalar() == 2
+        conn.execute(text("DELETE FROM blobs"))
+        assert conn.execute(text("PRAGMA freelist_count")).scalar() > 0
+
+    reconcile.vacuum(engine)
+    with engine.connect() as conn:
+        assert conn.execute(text("PRAGMA freelist_count")).scalar() == 0
+    engine.dispose()
@@ -5,6 +5,7 @@ from pathlib import Path
 
 import pytest
 
+from cfdb.populate import utils
 from cfdb.populate.utils import (
     hash_file,
     process_batch,
@@ -75,3 +76,21 @@ def test_retrieve_associated_feedstock_from_output_blob():
         # Assert that the retrieved feedstocks match the expected feedstocks
         expected_feedstocks = ["feedstock1", "feedstock2"]
         assert associated_feedstocks == expected_feedstocks
+
+
+def test_walk_cache(tmp_path, monkeypatch):
+    (tmp_path / "a.json").write_text("{}")
+    walks = utils.WalkCache()
+    calls = []
+    list_json_files = utils.list_json_files
+    monkeypatch.setattr(
+        utils, "list_json_files", lambda path: calls.append(path) or list_json_files(path)
+    )
+
+    assert walks.json_files(tmp_path) == [tmp_path / "a.json"]
+    (tmp_path / "b.json").write_text("{}")
+    assert walks.json_files(tmp_path) == [tmp_path / "a.json"]
+    assert len(calls) == 1
+
+    walks.invalidate(tmp_path)
+    assert sorted(walks.json_files(tmp_path)) == [tmp_path / "a.json", tmp_path / "b.json"]
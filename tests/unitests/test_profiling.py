@@ -0,0 +1,35 @@
+import pstats
+from concurrent.futures import ThreadPoolExecutor
+
+from cfdb.profiling import Profiler
+
+
+def _busy_worker_thread(n):
+    return sum(i * i for i in range(n))
+
+
+def test_profiler(tmp_path):
+    profiler = Profiler("update-artifacts", cpu=True, memory=True, output_dir=tmp_path)
+    profiler.start()
+    with ThreadPoolExecutor(2) as executor:
+        list(executor.map(_busy_worker_thread, [1000] * 4))
+    blocks = [bytearray(1024) for _ in range(100)]
+    summary = profiler.stop()
+
+    assert "CPU profile" in summary and "Memory profile" in summary
+    outputs = {path.name.split("_", 1)[0]: path for path in tmp_path.iterdir()}
+    assert len(outputs) == 1 and "update-artifacts" in outputs
+    assert {path.suffixes[-1] for path in tmp_path.iterdir()} == {".prof", ".txt"}
+
+    stats = pstats.Stats(str(next(tmp_path.glob("*.prof"))))
+    calls = {
+        func: ncalls
+        for func, (_, ncalls, _, _, _) in stats.stats.items()
+        if func[2] == "_busy_worker_thread"
+    }
+    # profiled in the worker threads
+    assert list(calls.values()) == [4]
+
+    memory = next(tmp_path.glob("*.memory.txt")).read_text()
+    assert "test_profiling.py" in memory
+    del blocks
@@ -0,0 +1,69 @@
+from sqlalchemy import create_engine, text
+
+from cfdb import sqlstats
+from cfdb.handler import CFDBHandler
+from cfdb.sqlstats import SQLStats, normalize
+
+
+def test_normalize():
+    assert (
+        normalize("SELECT a FROM t\n WHERE b IN (?, ?, ?) AND c = 'it''s' LIMIT 10")
+        == "SELECT a FROM t WHERE b IN (...) AND c = ? LIMIT ?"
+    )
+    assert (
+        normalize("INSERT INTO t (a, b) VALUES (%(a_0)s, %(b_0)s), (%(a_1)s, %(b_1)s)")
+        == "INSERT INTO t (a, b) VALUES (?, ?), ..."
+    )
+    assert normalize("SELECT * FROM t WHERE id = :id_1") == "SELECT * FROM t WHERE id = ?"
+
+
+def _select_one(connection, i):
+    connection.execute(text("SELECT :i"), {"i": i})
+
+
+def test_sql_stats():
+    engine = create_engine("sqlite:///:memory:")
+    stats = SQLStats()
+    stats.attach(engine)
+
+    with engine.connect() as connection:
+        connection.execute(text("CREATE TABLE t (a INTEGER)"))
+        connection.execute(text("INSERT INTO t VALUES (:a)"), [{"a": i} for i in range(5)])
+        for i in range(sqlstats.N_PLUS_ONE_THRESHOLD):
+            connection.execute(text("SELECT a FROM t WHERE a = :a"), {"a": i})
+        # a statement per call of a function is not a loop of that function
+        for i in range(sqlstats.N_PLUS_ONE_THRESHOLD):
+            _select_one(connection, i)
+
+    results = {result.shape: result for result in stats.results()}
+    assert results["INSERT INTO t VALUES (?)"].rows == 5
+    in_loop = results["SELECT a FROM t WHERE a = ?"]
+    assert in_loop.statements == sqlstats.N_PLUS_ONE_THRESHOLD
+    assert in_loop.caller == f"{__name__}.test_sql_stats"
+    assert in_loop.n_plus_one
+    assert in_loop.loop.startswith(f"{__name__}.test_sql_stats:")
+    assert not results["SELECT ?"].n_plus_one
+    assert stats.n_plus_one() == [in_loop]
+
+    table = stats.format_table(top=2)
+    assert table.startswith("SQL: 42 statements")
+    assert "Possible N+1: " in table
+
+    stats.detach(engine)
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+    assert sum(result.statements for result in stats.results()) == 42
+
+
+def test_handler_attaches_sql_stats(monkeypatch, tmp_path):
+    assert CFDBHandler(f"sqlite:///{tmp_path}/off.db").sql_stats is None
+
+    monkeypatch.setattr(sqlstats, "_active", None)
+    stats = sqlstats.enable()
+    handler = CFDBHandler(f"sqlite:///{tmp_path}/on.db")
+    assert handler.sql_stats is stats
+    assert handler.latest_artifact("numpy", "linux-64") is None
+    assert any(
+        result.caller == "cfdb.populate.latest.latest_artifact" for result in stats.results()
+    )
+    handler.engine.dispose()
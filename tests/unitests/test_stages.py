@@ -0,0 +1,106 @@
+import threading
+import time
+
+import pytest
+
+from cfdb.handler import CFDBHandler
+from cfdb.stages import (
+    Stage,
+    default_stages,
+    format_summary,
+    run_stages,
+    select_stages,
+)
+
+
+@pytest.fixture
+def handler(tmp_path):
+    return CFDBHandler(f"sqlite:///{tmp_path}/cfdb.db")
+
+
+def test_run_stages_order(handler):
+    order = []
+    harvest_started = threading.Event()
+
+    def record(name, wait_for=None):
+        def run(h):
+            assert h is handler
+            if wait_for is not None:
+                # runs concurrently with the harvest
+                assert wait_for.wait(timeout=10)
+            order.append(name)
+
+        return run
+
+    def harvest(h):
+        harvest_started.set()
+        order.append("harvest")
+
+    stages = [
+        Stage("artifacts", record("artifacts"), after=("harvest",)),
+        Stage("harvest", harvest, writes_db=False),
+        Stage("feedstock-outputs", record("feedstock-outputs", wait_for=harvest_started)),
+    ]
+    results = run_stages(stages, handler)
+
+    assert {r.name: r.status for r in results} == {
+        "artifacts": "done",
+        "harvest": "done",
+        "feedstock-outputs": "done",
+    }
+    assert order.index("harvest") < order.index("artifacts")
+    assert "total" in format_summary(results)
+
+
+def test_run_stages_skips_dependents_of_failed_stages(handler):
+    def fail(h):
+        raise RuntimeError("boom")
+
+    results = run_stages(
+        [
+            Stage("harvest", fail),
+            Stage("artifacts", lambda h: None, after=("harvest",)),
+            Stage("import-maps", lambda h: None),
+        ],
+        handler,
+    )
+
+    statuses = {r.name: r.status for r in results}
+    assert statuses == {"harvest": "failed", "artifacts": "skipped", "import-maps": "done"}
+    assert isinstance(next(r for r in results if r.name == "harvest").error, RuntimeError)
+
+
+def test_run_stages_rejects_cycles(handler):
+    with pytest.raises(ValueError):
+        run_stages([Stage("a", None, after=("b",)), Stage("b", None, after=("a",))], handler)
+
+
+def test_select_stages():
+    stages = [Stage("harvest", None), Stage("artifacts", None, after=("harvest",))]
+
+    assert select_stages(stages, ["artifacts"]) == [Stage("artifacts", None)]
+    with pytest.raises(ValueError):
+        select_stages(stages, ["unknown"])
+
+
+def test_default_stages_write_db():
+    stages = default_stages("outputs", "import_maps", "artifacts")
+    assert [stage.name for stage in stages if not stage.writes_db] == []
+
+
+def test_run_stages_serializes_writers(handler, monkeypatch):
+    # whatever the database, the writers share the package registry
+    monkeypatch.setattr(handler.engine.dialect, "name", "postgresql")
+    active, overlaps = [], []
+
+    def write(h):
+        active.append(1)
+        overlaps.append(len(active))
+        time.sleep(0.05)
+        active.pop()
+
+    stages = [Stage(name, write) for name in ("feedstock-outputs", "import-maps", "harvest")]
+    results = run_stages(stages, handler)
+
+    assert {result.status for result in results} == {"done"}
+    assert overlaps == [1, 1, 1]